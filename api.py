@@ -1,22 +1,27 @@
 # -*- coding: utf-8 -*-`
 """api.py - Create and configure the Game API exposing the resources.
-This can also contain game logic. For more complex games it would be wise to
-move game logic to another file. Ideally the API will be simple, concerned
-primarily with communication to/from the API's users."""
+The game logic lives in service.py, on the storage layer of storage.py: the
+API is concerned primarily with communication to/from the API's users."""
+
+from datetime import datetime
+import functools
+import os
 
 import endpoints
 from protorpc import remote, messages
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.api import memcache
-from google.appengine.api import taskqueue
-from google.appengine.ext import ndb
 
-from models import User, Game, Score
 from models import StringMessage, NewGameForm, GameForm, GameForms, MakeMoveForm,\
-    ScoreForms, RankingForm
-from utils import get_by_urlsafe
-
-
-import collections
+    ScoreForm, ScoreForms, RankingForm, RankingForms, GameStatsForm,\
+    GameHistoryForm, MoveForm, MetricsForm, EndpointMetricsForm, RpcCountForm,\
+    TraceForm
+from ndb_storage import NdbRepository, CloudStorageBlobStore
+import archive
+import metrics
+import pubsub
+import service
+import storage
 
 NEW_GAME_REQUEST = endpoints.ResourceContainer(NewGameForm)
 GET_GAME_REQUEST = endpoints.ResourceContainer(
@@ -31,8 +36,112 @@ NEW_EMAIL_PREFERENCE_REQUEST = endpoints.ResourceContainer(urlsafe_user_key=mess
 
 GET_EMAIL_PREFERENCE_REQUEST = endpoints.ResourceContainer(
         urlsafe_user_key=messages.StringField(1),)
+POLL_GAME_REQUEST = endpoints.ResourceContainer(
+        urlsafe_game_key=messages.StringField(1),
+        version=messages.IntegerField(2),)
+WAIT_GAME_REQUEST = endpoints.ResourceContainer(
+        urlsafe_game_key=messages.StringField(1),
+        version=messages.IntegerField(2),
+        timeout=messages.IntegerField(3),)
+USER_GAMES_REQUEST = endpoints.ResourceContainer(
+        user_name=messages.StringField(1),
+        page_size=messages.IntegerField(2),
+        cursor=messages.StringField(3),
+        active=messages.BooleanField(4, default=False),)
+SCORES_REQUEST = endpoints.ResourceContainer(
+        page_size=messages.IntegerField(1),
+        cursor=messages.StringField(2),)
+LEADERBOARD_REQUEST = endpoints.ResourceContainer(
+        limit=messages.IntegerField(1, default=10),
+        period=messages.StringField(2),
+        date=messages.StringField(3),)
+METRICS_REQUEST = endpoints.ResourceContainer(
+        traces=messages.BooleanField(1, default=False),)
 
 MEMCACHE_AVERAGE_MOVES_PER_GAME = 'AVERAGE_MOVES_PER_GAME'
+MEMCACHE_GAME_VERSION = 'GAME_VERSION_{}'
+# Seconds a cached game version is trusted
+GAME_VERSION_TTL = 60
+# Seconds wait_for_move holds a request by default and at most
+DEFAULT_WAIT_TIMEOUT = 20
+MAX_WAIT_TIMEOUT = 45
+MAX_LEADERBOARD_SIZE = 100
+# Cloud Storage bucket of the archived games, the app's default bucket if
+# unset
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET')
+
+# Publishes the game versions to get_game and wait_for_move
+BROKER = pubsub.MemcacheBroker(memcache.Client, MEMCACHE_GAME_VERSION,
+                               GAME_VERSION_TTL)
+REPOSITORY = NdbRepository()
+ARCHIVE = archive.Archive(REPOSITORY, CloudStorageBlobStore(ARCHIVE_BUCKET))
+SERVICE = service.GameService(REPOSITORY, BROKER, archive=ARCHIVE)
+METRICS = metrics.Registry()
+
+
+def _count_rpc(service, call, request, response):
+    """apiproxy post call hook counting the RPCs of the endpoint call
+    running on this thread, and the keys found by the memcache gets"""
+    if service == 'memcache' and call == 'Get':
+        hits = response.item_size()
+        METRICS.record_rpc(service, call, hits, request.key_size() - hits)
+    else:
+        METRICS.record_rpc(service, call)
+
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('metrics', _count_rpc)
+
+
+ERRORS = {
+    service.NotFoundError: endpoints.NotFoundException,
+    service.BadRequestError: endpoints.BadRequestException,
+    service.ConflictError: endpoints.ConflictException,
+    storage.InvalidRequestError: endpoints.BadRequestException,
+    storage.ConflictError: endpoints.ConflictException,
+}
+
+
+def raises_endpoints_exceptions(method):
+    """Raises the errors of the service and of the storage layer as the
+    endpoints exceptions in ERRORS"""
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        try:
+            return method(*args, **kwargs)
+        except (service.ServiceError, storage.StorageError) as e:
+            raise ERRORS[type(e)](e.message)
+    return wrapper
+
+
+def _game_form(game, message, names):
+    """Returns a GameForm representation of a game. names is a dict from
+    user key to name"""
+    return GameForm(urlsafe_key=SERVICE.repository.game_id(game),
+                    user_name1=names[game.user1],
+                    user_name2=names[game.user2],
+                    board_position=game.board_position,
+                    game_over=game.game_over,
+                    message=message,
+                    rows=game.rows,
+                    cols=game.cols,
+                    k=game.k,
+                    version=game.version)
+
+
+def _not_modified_form(game_id, version):
+    """Returns the GameForm telling a polling client that the game is still
+    at version. Endpoints does not pass a 304 through, so this is a 200 with
+    not_modified set and without the game state."""
+    return GameForm(urlsafe_key=game_id, message='Game not modified',
+                    version=version, not_modified=True)
+
+
+def _score_form(score, names):
+    """Returns a ScoreForm representation of a score. names is a dict from
+    user key to name"""
+    return ScoreForm(user_name=names[score.user],
+                     date=str(score.date),
+                     won=score.won,
+                     lost=score.lost)
 
 
 @endpoints.api(name='tris', version='v1')
@@ -43,14 +152,11 @@ class TrisApi(remote.Service):
                       path='user',
                       name='create_user',
                       http_method='POST')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def create_user(self, request):
         """Create a User"""
-        if User.query(User.name == request.user_name).get():
-            raise endpoints.ConflictException(
-                    'A User with that name already exists!')
-
-        user = User(name=request.user_name, email=request.email)
-        user.put()
+        SERVICE.create_user(request.user_name, request.email)
         return StringMessage(message='User {} created!'.format(
                 request.user_name))
 
@@ -60,282 +166,254 @@ class TrisApi(remote.Service):
                       path='game',
                       name='new_game',
                       http_method='POST')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def new_game(self, request):
         """Creates new game"""
-        user1 = User.query(User.name == request.user_name1).get()
-        if not user1:
-            raise endpoints.NotFoundException(
-                    'User1 with that name does not exist!')
-        user2 = User.query(User.name == request.user_name2).get()
-        if not user2:
-            raise endpoints.NotFoundException(
-                    'User2 with that name does not exist!')            
-        
-        game = Game.new_game(user1.key, user2.key)
-        return game.to_form('Good luck, Choose a position!!')
+        game, names = SERVICE.new_game(request.user_name1, request.user_name2,
+                                       request.difficulty, request.rows,
+                                       request.cols, request.k)
+        return _game_form(game, 'Good luck, Choose a position!!', names)
 
-    @endpoints.method(request_message=GET_GAME_REQUEST,
+    @endpoints.method(request_message=POLL_GAME_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='get_game',
                       http_method='GET')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def get_game(self, request):
-        """Return the current game state."""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game:
-            if game.moves % 2 == 0:
-                return game.to_form('It is player1 {} to make a move!'.format(game.user1.get().name))
-            else:
-                return game.to_form('It is player2 {} to make a move!'.format(game.user2.get().name))
-        else:
-            raise endpoints.NotFoundException('Game not found!')
+        """Return the current game state. If version is the current version
+        of the game a GameForm with not_modified set is returned instead,
+        checked against the published version without reading the game when
+        possible."""
+        try:
+            game, names = SERVICE.game_state(request.urlsafe_game_key,
+                                             request.version)
+        except service.NotModifiedError:
+            return _not_modified_form(request.urlsafe_game_key,
+                                      request.version)
+        return _game_form(game, game.turn_message(names), names)
+
+    @endpoints.method(request_message=WAIT_GAME_REQUEST,
+                      response_message=GameForm,
+                      path='game/{urlsafe_game_key}/wait',
+                      name='wait_for_move',
+                      http_method='GET')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
+    def wait_for_move(self, request):
+        """Long poll: waits until the game moves past version, for up to
+        timeout seconds, then returns the game state, or a GameForm with
+        not_modified set if the game did not change in time."""
+        if request.version is None:
+            raise endpoints.BadRequestException('version is required')
+        timeout = min(request.timeout or DEFAULT_WAIT_TIMEOUT,
+                      MAX_WAIT_TIMEOUT)
+        try:
+            game, names = SERVICE.wait_for_move(request.urlsafe_game_key,
+                                                request.version, timeout)
+        except service.NotModifiedError:
+            return _not_modified_form(request.urlsafe_game_key,
+                                      request.version)
+        return _game_form(game, game.turn_message(names), names)
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
                       response_message=StringMessage,
                       path='game/{urlsafe_game_key}',
                       name='cancel_game',
                       http_method='DELETE')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def cancel_game(self, request):
         """Deletes not finised game"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game and not game.game_over:
-            game.key.delete()
-            return StringMessage(message='Game with key: {} deleted.'.
-                                 format(request.urlsafe_game_key))
-        elif game and game.game_over:
-            raise endpoints.BadRequestException('Game is over!')
-        else:
-            raise endpoints.NotFoundException('Game not found!')
+        SERVICE.cancel_game(request.urlsafe_game_key)
+        return StringMessage(message='Game with key: {} deleted.'.
+                             format(request.urlsafe_game_key))
 
-    @endpoints.method(request_message=USER_REQUEST,
+    @endpoints.method(request_message=USER_GAMES_REQUEST,
                       response_message=GameForms,
                       path='game/user/{user_name}',
                       name='get_user_games',
                       http_method='GET')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def get_user_games(self, request):
-        """Return the state of games for user."""
-        user = User.query(User.name == request.user_name).get()
-        if not user:
-            raise endpoints.NotFoundException(
-                    'User not exist!')
-        games = Game.query(ndb.OR(Game.user1 == user.key, Game.user2 == user.key))
-        game_forms = list()
-        for game in games:
-            if game.moves % 2 == 0:
-                game_forms.append(game.to_form('It is player1 {} to make a move!'.format(game.user1.get().name)))
-            else:
-                game_forms.append(game.to_form('It is player2 {} to make a move!'.format(game.user2.get().name)))
-        return GameForms(game_forms=game_forms)
+        """Return a page of the state of games for user, the last moved
+        first. With active, only the games in progress."""
+        games, names, next_cursor = SERVICE.user_games(
+            request.user_name, request.page_size, request.cursor,
+            request.active)
+        return GameForms(game_forms=[_game_form(game, game.turn_message(names),
+                                                names)
+                                     for game in games],
+                         next_cursor=next_cursor)
 
     @endpoints.method(request_message=MAKE_MOVE_REQUEST,
                       response_message=GameForm,
                       path='game/{urlsafe_game_key}',
                       name='make_move',
                       http_method='PUT')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def make_move(self, request):
-        """Makes a move. Returns a game state with message"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if game.game_over:
-            if game.user1_won:
-                return game.to_form('Game finished! Player 1 Won')
-            elif game.user2_won:
-                return game.to_form('Game finished! Player 2 Won')
-            else:
-                return game.to_form('Game finished! It is a draw')
-
-        previous_board_position = game.board_position.split(',')
-        new_board_position = request.move.split(',')
-        game.history.append(new_board_position)
-        validation = TrisApi._validate_board_position(new_board_position,
-            previous_board_position)
-        if validation.valid == False:
-            return game.to_form(validation.message)
-
-        response_message = validation.message
-
-        if TrisApi._check_for_win(new_board_position, 'X'):
-            response_message = "Player 1 won!"
-            game.end_game(user1_won=True, 
-                user2_won=False, 
-                user1_lost=False, 
-                user2_lost=True)
-        elif TrisApi._check_for_win(new_board_position, 'O'):
-            response_message = "Player 2 won!"
-            game.end_game(user1_won=False, 
-                user2_won=True, 
-                user1_lost=True, 
-                user2_lost=False)
-        elif game.moves == 9:
-            response_message = "It is a draw!"
-            game.end_game(user1_won=False, 
-                user2_won=False, 
-                user1_lost=False, 
-                user2_lost=False)
-
-        game.board_position = request.move
-        game.moves = game.moves + 1
-        game.put()
-
-        if game.game_over:
-            taskqueue.add(url='/tasks/cache_average_moves_per_game')
-
-        return game.to_form(response_message)
-
-    @staticmethod
-    def _validate_board_position(new_board_position, previous_board_position):
-        """Validates the board position and the move"""
-        Validation = collections.namedtuple('Validation', ['valid', 'message'])
-
-        # check input
-        num_of_empty = 0
-        num_of_Xs = 0
-        num_of_Os = 0
-        if len(new_board_position) != 9:
-            return Validation(False, 'Invalid input! Input should be 9 comma seperated chars')
-        else:
-            for pos in new_board_position:
-                print pos
-                if (pos != "-" and pos != 'X' and pos != 'O'):
-                    return Validation(False, "Invalid input. Chars should be '-', 'X', or 'O'")
-                elif pos == 'X':
-                    num_of_Xs = num_of_Xs + 1
-                elif pos == 'O':
-                    num_of_Os = num_of_Os + 1
-                elif pos == '-':
-                    num_of_empty = num_of_empty + 1
-
-            if num_of_Xs - num_of_Os == 2:
-                return Validation(False,
-                                  "It is player 2\'s turn to play an 'O'!")
-            elif num_of_Xs - num_of_Os == -1:
-                return Validation(False,
-                                  "It is player 1\'s turn to play a 'X'!")
-
-        # check that the move is valid
-        num_of_differences = 0
-        for pos_ind in range(0, len(new_board_position)):
-            if (previous_board_position[pos_ind] != '-'
-                and previous_board_position[pos_ind] != new_board_position[pos_ind]):
-                return Validation(False, 'Invalid move!')
-            elif previous_board_position[pos_ind] != new_board_position[pos_ind]:
-                num_of_differences = num_of_differences + 1
-        if num_of_differences != 1:
-            return Validation(False, 'Invalid move!')
-
-        if (num_of_empty == 0):
-            return Validation(True, 'Draw! Game Over')
-        elif num_of_Xs == num_of_Os:
-            return Validation(True, 'It is player 1\'s turn now')
-        else:
-            return Validation(True, 'It is player 2\'s turn now')
-
-    @staticmethod
-    def _check_for_win(board_position, player_piece):
-        win_cond = ((1, 2, 3), (4, 5, 6), (7, 8, 9), (1, 4, 7), (2, 5, 8), (3, 6, 9), (1, 5, 9), (3, 5, 7))
-
-        for each in win_cond:
-            print each
-            try:
-                if (board_position[(each[0] - 1)] == player_piece and board_position[
-                        (each[1] - 1)] == player_piece and board_position[(each[2] - 1)] == player_piece):
-                    print "Player with ", player_piece, " win!"
-                    return True
-#                    win = True
-                else:
-                    win = False
-            except:
-                pass
-        return win
-
+        """Makes a move. Returns a game state with message. The move is
+        applied in a transaction, retried with a growing delay when another
+        request changed the game at the same time"""
+        game, message, names = SERVICE.make_move(
+            request.urlsafe_game_key, request.move, request.position,
+            request.move_number, request.version)
+        return _game_form(game, message, names)
 
     @endpoints.method(request_message=GET_GAME_REQUEST,
-                      response_message=StringMessage,
+                      response_message=GameHistoryForm,
                       path='game/{urlsafe_game_key}/history',
                       name='get_game_history',
                       http_method='GET')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def get_game_history(self, request):
-        """Return a Game's move history"""
-        game = get_by_urlsafe(request.urlsafe_game_key, Game)
-        if not game:
-            raise endpoints.NotFoundException('Game not found')
-        return StringMessage(message=str(game.history))
-
-    @endpoints.method(response_message=ScoreForms,
+        """Return a Game's move history, from the archive once the finished
+        Game was archived"""
+        game = SERVICE.game_history(request.urlsafe_game_key)
+        return GameHistoryForm(moves=[
+            MoveForm(move_number=number + 1, piece=piece, position=cell + 1,
+                     board_position=board_position)
+            for number, (cell, piece, board_position) in
+            enumerate(game.replay())])
+
+    @endpoints.method(request_message=SCORES_REQUEST,
+                  response_message=ScoreForms,
                   path='scores',
                   name='get_scores',
                   http_method='GET')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def get_scores(self, request):
-        """Return all scores"""
-        return ScoreForms(items=[score.to_form() for score in Score.query()])
+        """Return a page of scores, the most recent first"""
+        scores, names, next_cursor = SERVICE.scores(request.page_size,
+                                                    request.cursor)
+        return ScoreForms(items=[_score_form(score, names) for score in scores],
+                          next_cursor=next_cursor)
 
     @endpoints.method(request_message=USER_REQUEST,
                       response_message=ScoreForms,
                       path='scores/user/{user_name}',
                       name='get_user_scores',
                       http_method='GET')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def get_user_scores(self, request):
         """Returns all of an individual User's scores"""
-        user = User.query(User.name == request.user_name).get()
-        if not user:
-            raise endpoints.NotFoundException(
-                    'User not exist!')
-        scores = Score.query(Score.user == user.key)
-        return ScoreForms(items=[score.to_form() for score in scores])
+        scores, names = SERVICE.user_scores(request.user_name)
+        return ScoreForms(items=[_score_form(score, names) for score in scores])
 
     @endpoints.method(request_message=USER_REQUEST,
                       response_message=RankingForm,
                       path='scores/user/{user_name}/ranking',
                       name='get_user_rankings',
                       http_method='GET')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
     def get_user_rankings(self, request):
         """Returns an individual User's ranking"""
-        user = User.query(User.name == request.user_name).get()
-        if not user:
-            raise endpoints.NotFoundException(
-                    'A User with that name does not exist!')
-        scores = Score.query()
-        user_to_stats = {}
-        wins = 0
-        losses = 0
-        for score in scores:
-            if score.user not in user_to_stats:
-                user_to_stats[score.user] = {'wins':0, 'losses':0, 'games':0}
-            if score.won == True:
-                user_to_stats[score.user]['wins'] = user_to_stats[score.user]['wins'] + 1
-            elif score.lost == True:
-                user_to_stats[score.user]['losses'] = user_to_stats[score.user]['losses'] + 1
-            user_to_stats[score.user]['games'] = user_to_stats[score.user]['games'] + 1
-
-        # calculate the win_ratio
-        user_to_ratio = {}
-        for user in user_to_stats:
-            user_to_ratio[user] = (user_to_stats[user]['wins'] - user_to_stats[user]['losses']) / float(user_to_stats[score.user]['games'])
-
-        # rank users by ratio
-        ranked_users = sorted(user_to_ratio, key=user_to_ratio.get, reverse=True)
-
-        return RankingForm(user_name=request.user_name, rank=ranked_users.index(user) + 1, net_win_ratio=user_to_ratio[user])
+        ranking = SERVICE.user_ranking(request.user_name)
+        return RankingForm(user_name=ranking.user_name, rank=ranking.rank,
+                           net_win_ratio=ranking.net_win_ratio,
+                           rating=ranking.rating)
+
+    @endpoints.method(request_message=LEADERBOARD_REQUEST,
+                      response_message=RankingForms,
+                      path='scores/leaderboard',
+                      name='get_leaderboard',
+                      http_method='GET')
+    @METRICS.instrument
+    @raises_endpoints_exceptions
+    def get_leaderboard(self, request):
+        """Returns the top users by rating, or by net win ratio in the day,
+        week or month holding date"""
+        day = None
+        if request.date:
+            try:
+                day = datetime.strptime(request.date, '%Y-%m-%d').date()
+            except ValueError:
+                raise endpoints.BadRequestException(
+                        'date should be formatted as YYYY-MM-DD')
+        rankings = SERVICE.leaderboard(min(request.limit,
+                                           MAX_LEADERBOARD_SIZE),
+                                       request.period, day)
+        return RankingForms(items=[
+            RankingForm(user_name=ranking.user_name, rank=ranking.rank,
+                        net_win_ratio=ranking.net_win_ratio,
+                        rating=ranking.rating)
+            for ranking in rankings])
 
     @endpoints.method(response_message=StringMessage,
                       path='games/average_moves_per_game',
                       name='get_average_moves_per_game',
                       http_method='GET')
+    @METRICS.instrument
     def get_average_moves_per_game(self, request):
         """Get the cached average wins"""
         return StringMessage(message=memcache.get(MEMCACHE_AVERAGE_MOVES_PER_GAME)
             or 'Still computing this stat.')
 
+    @endpoints.method(response_message=GameStatsForm,
+                      path='games/stats',
+                      name='get_game_stats',
+                      http_method='GET')
+    @METRICS.instrument
+    def get_game_stats(self, request):
+        """Return the totals of the finished games"""
+        totals = SERVICE.game_totals()
+        return GameStatsForm(finished_games=totals.finished_games,
+                             total_moves=totals.total_moves,
+                             x_wins=totals.x_wins,
+                             o_wins=totals.o_wins,
+                             draws=totals.draws)
+
+    @endpoints.method(request_message=METRICS_REQUEST,
+                      response_message=MetricsForm,
+                      path='metrics',
+                      name='get_metrics',
+                      http_method='GET')
+    def get_metrics(self, request):
+        """Return the latencies and RPCs of the endpoints served by this
+        instance, and the sampled slow calls if traces is set"""
+        snapshot, traces = METRICS.snapshot()
+        items = [EndpointMetricsForm(
+            endpoint=name,
+            calls=endpoint.latency.count,
+            errors=endpoint.errors,
+            client_errors=endpoint.client_errors,
+            mean_ms=endpoint.latency.mean(),
+            p50_ms=endpoint.latency.percentile(0.5),
+            p90_ms=endpoint.latency.percentile(0.9),
+            p99_ms=endpoint.latency.percentile(0.99),
+            max_ms=endpoint.latency.max,
+            rpcs=[RpcCountForm(name=rpc, count=count)
+                  for rpc, count in sorted(endpoint.rpcs.items())],
+            memcache_hits=endpoint.memcache_hits,
+            memcache_misses=endpoint.memcache_misses)
+            for name, endpoint in sorted(snapshot.items())]
+        if not request.traces:
+            traces = []
+        return MetricsForm(endpoints=items, traces=[
+            TraceForm(endpoint=trace.endpoint,
+                      started=datetime.utcfromtimestamp(
+                          trace.started).isoformat(),
+                      latency_ms=trace.latency_ms,
+                      rpcs=['{} +{:.1f}ms'.format(rpc, offset)
+                            for rpc, offset in trace.rpcs])
+            for trace in traces])
+
     @staticmethod
     def _cache_average_moves_per_game():
         """Populates memcache with the average moves made in finished Games"""
-        games = Game.query(Game.game_over == True).fetch()
-        if games:
-            count = len(games)
-            total_moves = sum([game.moves for game in games])
-            average = float(total_moves)/count
+        average = SERVICE.average_moves()
+        if average is not None:
             memcache.set(MEMCACHE_AVERAGE_MOVES_PER_GAME,
                          'The average moves in games is {:.2f}'.format(average))
 
 
 api = endpoints.api_server([TrisApi])
-
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+
+"""archive.py - Moves the finished games out of the hot store into
+compressed segments in a blob store, and reads them back.
+
+A segment is a gzipped NDJSON file, one game per line, of up to
+SEGMENT_SIZE games finished and last moved before a cutoff. It is streamed
+to the blob store under a new name on every attempt, then the repository
+records the segment of each game and deletes the games. A retried run
+archives the games left again into a new segment, so a segment is never
+overwritten. The history of an archived game is read back on demand by
+decompressing its segment.
+
+LocalBlobStore keeps the blobs in a local directory, for the SQLite
+backend. On App Engine, whose file system is read only,
+ndb_storage.CloudStorageBlobStore keeps them in a bucket with the same
+writer and reader methods. On a SQLite database the archival runs from the
+command line:
+
+    python archive.py --database /tmp/load.db --root /tmp/archive --days 90"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import uuid
+from contextlib import closing, contextmanager
+from datetime import datetime, timedelta
+
+import storage
+
+SEGMENT_SIZE = 500
+# Finished games last moved this many days ago are archived
+ARCHIVE_AFTER_DAYS = 90
+
+# Attributes of the games kept in the segments, with the game id and the
+# names of the users
+GAME_FIELDS = ('board_position', 'game_over', 'user1_won', 'user2_won',
+               'moves', 'version', 'move_log', 'history', 'difficulty',
+               'rows', 'cols', 'k')
+
+
+class LocalBlobStore(object):
+    """Blobs in files under a root directory, named after their path. A
+    blob is written under a temporary name and renamed once complete, so
+    readers never see a partial blob."""
+
+    def __init__(self, root):
+        self._root = root
+
+    def _path(self, name):
+        return os.path.join(self._root, *name.split('/'))
+
+    @contextmanager
+    def writer(self, name):
+        """Yields a file to write the blob to"""
+        path = self._path(name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        partial = path + '.partial'
+        with open(partial, 'wb') as blob:
+            yield blob
+        os.rename(partial, path)
+
+    def reader(self, name):
+        """Returns a file reading the blob"""
+        return open(self._path(name), 'rb')
+
+
+class ArchivedGame(storage.GameMoves):
+    """A finished game read back from its segment, with the attributes of
+    models.Game kept in GAME_FIELDS. user1 and user2 hold the names of the
+    users, game_id the id of the game."""
+
+    def __init__(self, record):
+        self.__dict__.update(record)
+
+
+def segment_name(day, page):
+    """Returns a new segment name for a page of the archival of a day"""
+    return 'games/{}/{:05d}-{}.ndjson.gz'.format(day.isoformat(), page,
+                                                 uuid.uuid4().hex[:8])
+
+
+class Archive(object):
+    """Archival of the games of a repository to a blob store"""
+
+    def __init__(self, repository, blob_store):
+        self.repository = repository
+        self.blob_store = blob_store
+
+    def archive_segment(self, cutoff, name):
+        """Moves up to SEGMENT_SIZE games finished and last moved before
+        cutoff into the segment name. Returns the number of games
+        archived."""
+        games = self.repository.finished_games_before(cutoff, SEGMENT_SIZE)
+        if not games:
+            return 0
+        names = self.repository.user_names(
+            [game.user1 for game in games] + [game.user2 for game in games])
+        with self.blob_store.writer(name) as blob:
+            with closing(gzip.GzipFile(fileobj=blob, mode='wb')) as segment:
+                for game in games:
+                    record = dict((field, getattr(game, field))
+                                  for field in GAME_FIELDS)
+                    record.update(game_id=self.repository.game_id(game),
+                                  user1=names.get(game.user1),
+                                  user2=names.get(game.user2),
+                                  last_move=game.last_move and
+                                  game.last_move.isoformat())
+                    segment.write(json.dumps(record, sort_keys=True) + '\n')
+        self.repository.archive_games(games, name)
+        return len(games)
+
+    def read_game(self, game_id):
+        """Returns the ArchivedGame of game_id, or None if it is not
+        archived"""
+        name = self.repository.archived_segment(game_id)
+        if not name:
+            return None
+        with closing(self.blob_store.reader(name)) as blob:
+            with closing(gzip.GzipFile(fileobj=blob, mode='rb')) as segment:
+                for line in segment:
+                    record = json.loads(line)
+                    if record['game_id'] == game_id:
+                        return ArchivedGame(record)
+
+
+def main(argv):
+    import sqlite_storage
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database', required=True,
+                        help='SQLite database file')
+    parser.add_argument('--root', required=True,
+                        help='directory of the blob store')
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help='archive the games last moved days ago')
+    args = parser.parse_args(argv)
+
+    archive = Archive(sqlite_storage.SqliteRepository(args.database),
+                      LocalBlobStore(args.root))
+    now = datetime.now()
+    cutoff = now - timedelta(days=args.days)
+    page = 0
+    archived = SEGMENT_SIZE
+    while archived == SEGMENT_SIZE:
+        archived = archive.archive_segment(cutoff,
+                                           segment_name(now.date(), page))
+        print '{} games archived'.format(archived)
+        page += 1
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
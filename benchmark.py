@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+"""benchmark.py - Micro-benchmarks of the hot paths of the game logic and of
+the rankings, printed as JSON to compare commits.
+
+The move validation and win check run on every reachable 3x3 position. The
+ranking and average moves run through the GameService on a SQLite database
+filled with synthetic games and scores, one dataset per size. The rank is
+read from a Fenwick tree over the rating buckets, like the datastore rating
+index shards, so it costs O(log(RATING_BUCKETS)) whatever the size. Each
+benchmark runs in its own process, so its peak memory is not mixed with the
+others.
+
+    python benchmark.py --sizes 1000,100000,1000000 --output bench.json
+
+Each result has the calls timed, the calls per second, the median and 99th
+percentile latency of a call in microseconds, and the peak resident memory
+of the process in kilobytes, building the dataset included. Calls are timed
+one by one, which adds the cost of the timer to the latencies of the fastest
+ones."""
+
+import argparse
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import sys
+from datetime import date, datetime, timedelta
+from timeit import default_timer
+
+import board
+import pubsub
+import service
+import sqlite_storage
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+# Scores per user in the synthetic datasets
+SCORES_PER_USER = 20
+# Timed calls of each benchmark
+DEFAULT_CALLS = 20000
+DATASET_CALLS = 2000
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1,
+                             int(len(sorted_values) * fraction))]
+
+
+def timed(function, arguments):
+    """Calls function with each tuple of arguments. Returns the result of
+    the benchmark without the peak memory."""
+    latencies = []
+    started = default_timer()
+    for args in arguments:
+        start = default_timer()
+        function(*args)
+        latencies.append(default_timer() - start)
+    elapsed = default_timer() - started
+    latencies.sort()
+    return {'calls': len(latencies),
+            'ops_per_sec': len(latencies) / elapsed,
+            'p50_us': percentile(latencies, 0.5) * 1e6,
+            'p99_us': percentile(latencies, 0.99) * 1e6}
+
+
+def moves():
+    """Returns (previous position, new position) for every move of every
+    reachable 3x3 position, and as many moves adding two stones at once"""
+    pairs = []
+    seen = set()
+    positions = [(0, 0)]
+    while positions:
+        position = positions.pop()
+        if position in seen or board.outcome(*position):
+            continue
+        seen.add(position)
+        for cell in xrange(board.CELLS):
+            new_position = board.play(position, cell)
+            if new_position:
+                pairs.append((position, new_position))
+                positions.append(new_position)
+    cheats = []
+    for previous, new_position in pairs:
+        free = board.FULL_MASK & ~(new_position[0] | new_position[1])
+        if free:
+            cheats.append((previous, (new_position[0] | free & -free,
+                                      new_position[1])))
+    return pairs + cheats
+
+
+def bench_validate_board_position(calls, size):
+    pairs = moves()
+    return timed(service.GameService._validate_board_position,
+                 [pairs[call % len(pairs)] for call in xrange(calls)])
+
+
+def bench_check_for_win(calls, size):
+    positions = [(new_position,) for _, new_position in moves()]
+    return timed(service.GameService._check_for_win,
+                 [positions[call % len(positions)] for call in xrange(calls)])
+
+
+def dataset(size, rng):
+    """Returns a GameService on an in memory database with size scores, of
+    size / 2 finished games, and the names of its users"""
+    repository = sqlite_storage.SqliteRepository()
+    names = ['user{}'.format(index)
+             for index in xrange(max(2, size // SCORES_PER_USER))]
+    keys = repository.import_users(names)
+    today = date.today()
+    games = []
+    scores = []
+    for _ in xrange(size // 2):
+        user1, user2 = rng.sample(keys, 2)
+        outcome = rng.randint(0, 2)
+        game = sqlite_storage.Game(
+            user1=user1, user2=user2, board_position=board.EMPTY_BOARD,
+            game_over=True, user1_won=outcome == 1, user2_won=outcome == 2,
+            moves=rng.randint(5, 9), version=0, move_log=[], difficulty=None,
+            rows=3, cols=3, k=3, last_move=datetime.now())
+        day = today - timedelta(days=rng.randint(0, 365))
+        games.append(game)
+        scores.append(sqlite_storage.Score(key=None, user=user1,
+                                           opponent=user2, date=day, time=None,
+                                           won=game.user1_won,
+                                           lost=game.user2_won))
+        scores.append(sqlite_storage.Score(key=None, user=user2,
+                                           opponent=user1, date=day, time=None,
+                                           won=game.user2_won,
+                                           lost=game.user1_won))
+    repository.import_games(games)
+    repository.import_scores(scores)
+    return service.GameService(repository, pubsub.LocalBroker()), names
+
+
+def bench_user_ranking(calls, size):
+    rng = random.Random(size)
+    game_service, names = dataset(size, rng)
+    return timed(game_service.user_ranking,
+                 [(rng.choice(names),) for _ in xrange(calls)])
+
+
+def bench_average_moves(calls, size):
+    game_service, _ = dataset(size, random.Random(size))
+    return timed(game_service.average_moves, [()] * calls)
+
+
+BENCHMARKS = [
+    ('validate_board_position', bench_validate_board_position, False),
+    ('check_for_win', bench_check_for_win, False),
+    ('user_ranking', bench_user_ranking, True),
+    ('average_moves', bench_average_moves, True),
+]
+
+
+def _run(benchmark, calls, size, results):
+    result = benchmark(calls, size)
+    # kilobytes on Linux
+    result['peak_rss_kb'] = resource.getrusage(
+        resource.RUSAGE_SELF).ru_maxrss
+    results.put(result)
+
+
+def run(name, benchmark, calls, size):
+    """Runs a benchmark in a new process and returns its result"""
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_run,
+                                      args=(benchmark, calls, size, results))
+    process.start()
+    result = results.get()
+    process.join()
+    result.update(name=name, size=size)
+    return result
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated numbers of scores of the '
+                        'synthetic datasets')
+    parser.add_argument('--calls', type=int, default=DEFAULT_CALLS,
+                        help='timed calls of the game logic benchmarks')
+    parser.add_argument('--dataset-calls', type=int, default=DATASET_CALLS,
+                        help='timed calls of the dataset benchmarks')
+    parser.add_argument('--only', help='comma separated benchmarks to run')
+    parser.add_argument('--output', help='file to write, default stdout')
+    args = parser.parse_args(argv)
+
+    only = set(args.only.split(',')) if args.only else None
+    results = []
+    for name, benchmark, on_dataset in BENCHMARKS:
+        if only and name not in only:
+            continue
+        if on_dataset:
+            for size in [int(size) for size in args.sizes.split(',')]:
+                results.append(run(name, benchmark, args.dataset_calls, size))
+        else:
+            results.append(run(name, benchmark, args.calls, None))
+
+    report = json.dumps({'python': platform.python_version(),
+                         'results': results}, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,162 @@
+"""board.py - Bitboard representation of the tris board.
+
+A position is held as two 9-bit masks, one for the 'X' stones and one for the
+'O' stones, where bit i is set when cell i (counted from the top left corner
+to the bottom right corner) is taken. The legacy comma separated string used
+by GameForm.board_position is only produced or parsed at the API edge with
+`encode` and `decode`.
+
+All the positions reachable from the empty board in a legal game are
+enumerated once at import time. STATES holds, for every position index, flags
+telling whether it is legal, whose turn it is and whether it is won or drawn,
+and SUCCESSORS holds the positions reachable from it with a single move, so
+validating a move and finding its outcome are table lookups."""
+
+import string
+
+EMPTY = '-'
+X = 'X'
+O = 'O'
+
+CELLS = 9
+FULL_MASK = (1 << CELLS) - 1
+EMPTY_BOARD = ','.join([EMPTY] * CELLS)
+
+# The 8 winning lines, cells numbered 1-9 as in the versions without api
+WIN_CONDITIONS = ((1, 2, 3), (4, 5, 6), (7, 8, 9), (1, 4, 7), (2, 5, 8),
+                  (3, 6, 9), (1, 5, 9), (3, 5, 7))
+WIN_MASKS = tuple(sum(1 << (cell - 1) for cell in line)
+                  for line in WIN_CONDITIONS)
+
+INVALID_LENGTH = 'Invalid input! Input should be 9 comma seperated chars'
+INVALID_CHARS = "Invalid input. Chars should be '-', 'X', or 'O'"
+
+_X_TABLE = string.maketrans(EMPTY + X + O, '010')
+_O_TABLE = string.maketrans(EMPTY + X + O, '001')
+_SEPARATORS = ',' * (CELLS - 1)
+_PIECES = (EMPTY, X, O)
+
+# Lookup tables indexed by a 9-bit mask
+WINNING = tuple(any(mask & line == line for line in WIN_MASKS)
+                for mask in xrange(1 << CELLS))
+POPCOUNT = tuple(bin(mask).count('1') for mask in xrange(1 << CELLS))
+
+# Flags of the positions in STATES
+LEGAL = 0x01
+O_TO_MOVE = 0x02
+X_WON = 0x04
+O_WON = 0x08
+DRAW = 0x10
+GAME_OVER = X_WON | O_WON | DRAW
+
+
+def decode(board_position):
+    """Returns the (x, o) bitboards of a board position string.
+    Args:
+        board_position: 9 comma separated chars, each one '-', 'X' or 'O'.
+    Returns:
+        A tuple with the 'X' mask and the 'O' mask.
+    Raises:
+        ValueError: if the string is not a well formed board position."""
+    if isinstance(board_position, unicode):
+        try:
+            board_position = board_position.encode('ascii')
+        except UnicodeError:
+            raise ValueError(INVALID_CHARS)
+    if (len(board_position) != 2 * CELLS - 1 or
+            board_position[1::2] != _SEPARATORS):
+        raise ValueError(INVALID_LENGTH)
+    cells = board_position[::2]
+    if cells.translate(None, EMPTY + X + O):
+        raise ValueError(INVALID_CHARS)
+    return (int(cells.translate(_X_TABLE)[::-1], 2),
+            int(cells.translate(_O_TABLE)[::-1], 2))
+
+
+def encode(x, o):
+    """Returns the board position string of the (x, o) bitboards"""
+    return ','.join([_PIECES[(x >> cell & 1) | (o >> cell & 1) << 1]
+                     for cell in xrange(CELLS)])
+
+
+def has_won(mask):
+    """Returns True if the stones in mask complete a line"""
+    return WINNING[mask]
+
+
+def is_full(x, o):
+    """Returns True if there are no empty cells left"""
+    return x | o == FULL_MASK
+
+
+def index(x, o):
+    """Returns the index of the (x, o) position in STATES"""
+    return x << CELLS | o
+
+
+def _build_states():
+    """Enumerates every position reachable from the empty board"""
+    states = bytearray(1 << 2 * CELLS)
+    successors = {}
+    frontier = [(0, 0)]
+    states[0] = LEGAL
+    while frontier:
+        x, o = frontier.pop()
+        current = index(x, o)
+        if states[current] & GAME_OVER:
+            successors[current] = frozenset()
+            continue
+        o_to_move = states[current] & O_TO_MOVE
+        children = set()
+        free = FULL_MASK & ~(x | o)
+        while free:
+            cell = free & -free
+            free ^= cell
+            if o_to_move:
+                child_x, child_o, flags = x, o | cell, LEGAL
+                if WINNING[child_o]:
+                    flags |= O_WON
+            else:
+                child_x, child_o, flags = x | cell, o, LEGAL | O_TO_MOVE
+                if WINNING[child_x]:
+                    flags |= X_WON
+            if not flags & GAME_OVER and is_full(child_x, child_o):
+                flags |= DRAW
+            child = index(child_x, child_o)
+            children.add(child)
+            if not states[child]:
+                states[child] = flags
+                frontier.append((child_x, child_o))
+        successors[current] = frozenset(children)
+    return states, successors
+
+STATES, SUCCESSORS = _build_states()
+
+
+def state(x, o):
+    """Returns the STATES flags of the (x, o) position, 0 if not legal"""
+    return STATES[index(x, o)]
+
+
+def is_successor(previous_position, new_position):
+    """Returns True if new_position follows previous_position with a single
+    legal move"""
+    return (index(*new_position) in
+            SUCCESSORS.get(index(*previous_position), ()))
+
+
+def play(position, cell):
+    """Returns the (x, o) position after the player to move takes cell, or
+    None if the cell is taken or the game is over"""
+    x, o = position
+    flags = STATES[index(x, o)]
+    if not flags or flags & GAME_OVER or (x | o) >> cell & 1:
+        return None
+    if flags & O_TO_MOVE:
+        return x, o | 1 << cell
+    return x | 1 << cell, o
+
+
+def outcome(x, o):
+    """Returns X_WON, O_WON, DRAW or 0 if the game is still running"""
+    return STATES[index(x, o)] & GAME_OVER
@@ -0,0 +1,67 @@
+"""counters.py - Sharded counters for global statistics.
+
+A counter is split in NUM_SHARDS entities, each in its own entity group, and
+every increment picks one shard at random, so concurrent writers rarely
+contend. Reading a counter sums its shards with a single batch get, which is
+O(NUM_SHARDS) no matter how many increments were made."""
+
+import random
+
+from google.appengine.ext import ndb
+
+NUM_SHARDS = 20
+
+FINISHED_GAMES = 'finished_games'
+TOTAL_MOVES = 'total_moves'
+X_WINS = 'x_wins'
+O_WINS = 'o_wins'
+DRAWS = 'draws'
+
+
+class CounterShard(ndb.Model):
+    """Shard of a named counter, keyed by '<name>-<shard index>'"""
+    count = ndb.IntegerProperty(required=True, default=0, indexed=False)
+
+
+def _shard_keys(name):
+    return [ndb.Key(CounterShard, '{}-{}'.format(name, index))
+            for index in xrange(NUM_SHARDS)]
+
+
+@ndb.tasklet
+def incremented_shards_async(deltas):
+    """Returns the shards with the deltas added, to be put in the caller's
+    transaction along with its other writes.
+    Args:
+        deltas: A dict from counter name to the amount to add."""
+    names = list(deltas)
+    keys = [ndb.Key(CounterShard, '{}-{}'.format(
+        name, random.randint(0, NUM_SHARDS - 1))) for name in names]
+    shards = yield ndb.get_multi_async(keys)
+    shards = [shard or CounterShard(key=key)
+              for key, shard in zip(keys, shards)]
+    for name, shard in zip(names, shards):
+        shard.count += deltas[name]
+    raise ndb.Return(shards)
+
+
+def incremented_shards(deltas):
+    return incremented_shards_async(deltas).get_result()
+
+
+@ndb.transactional(xg=True)
+def increment(deltas):
+    """Adds to counters. Joins the current transaction if there is one.
+    Args:
+        deltas: A dict from counter name to the amount to add."""
+    ndb.put_multi(incremented_shards(deltas))
+
+
+def get_counts(names):
+    """Returns a dict from counter name to its total"""
+    keys = [_shard_keys(name) for name in names]
+    shards = ndb.get_multi([key for shard_keys in keys for key in shard_keys])
+    return dict((name, sum(shard.count for shard in
+                           shards[index * NUM_SHARDS:(index + 1) * NUM_SHARDS]
+                           if shard))
+                for index, name in enumerate(names))
@@ -0,0 +1,61 @@
+"""elo.py - Elo ratings of the players, updated from the scores of their
+finished games.
+
+A player's rating only moves by the outcome of a game against the rating of
+its opponent, so finishing a game changes the ratings of its two users in
+O(1). Every user starts at INITIAL_RATING. A win against an opponent rated
+400 points higher is expected once in 11 games, and beating an expected
+winner moves a rating by up to K_FACTOR points.
+
+Scores are rated in chronological order. The two scores of a game share
+their date and time, and the scores with the same date and time are rated
+together: the ratings they use are those before any of them. The scores
+written before the opponent and the time were recorded are rated against an
+opponent at INITIAL_RATING, all the scores of a day together."""
+
+import itertools
+from datetime import datetime
+
+INITIAL_RATING = 1500.0
+K_FACTOR = 32
+
+
+def expected_score(rating, opponent_rating):
+    """Returns the expected score, 1 for a win and 0.5 for a draw, of a
+    player against an opponent"""
+    return 1.0 / (1 + 10 ** ((opponent_rating - rating) / 400.0))
+
+
+def actual_score(score):
+    if score.won:
+        return 1.0
+    elif score.lost:
+        return 0.0
+    return 0.5
+
+
+def chronological(score):
+    """Sort key of the scores in the order they are rated"""
+    return score.date, score.time or datetime.min, score.key
+
+
+def rating_changes(ratings, scores):
+    """Returns the change of the rating of the user of each score, the
+    scores being rated together. ratings maps the user keys to their
+    ratings, the users missing from it are at INITIAL_RATING."""
+    return [K_FACTOR * (actual_score(score) -
+                        expected_score(ratings.get(score.user, INITIAL_RATING),
+                                       ratings.get(score.opponent,
+                                                   INITIAL_RATING)))
+            for score in scores]
+
+
+def replay(scores, ratings):
+    """Rates scores sorted by chronological, updating ratings in place"""
+    for _, group in itertools.groupby(
+            scores, lambda score: (score.date, score.time)):
+        group = list(group)
+        for score, change in zip(group, rating_changes(ratings, group)):
+            ratings[score.user] = ratings.get(score.user,
+                                              INITIAL_RATING) + change
+    return ratings
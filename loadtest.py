@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+
+"""loadtest.py - Load generator playing full games through the game service
+of the API, on a local SQLite database, and printing a JSON report.
+
+Every player is a thread. The players are paired: the first of a pair
+creates the game, then both play random moves on their turn and poll
+get_game, or wait_for_move with --wait, on the opponent's turn. After its
+games a player asks for its ranking.
+
+    python loadtest.py --players 64 --games 5 --database /tmp/load.db
+
+The report has, for each endpoint, the calls, the errors, the polls
+answered Not Modified, the calls per second over the whole run and the
+50th, 90th and 99th percentile latencies in milliseconds. It also counts
+the repository operations made by each endpoint, the datastore RPCs of the
+same calls on App Engine. The endpoints are the GameService methods TrisApi
+calls, one for one."""
+
+import argparse
+import collections
+import json
+import random
+import sys
+import threading
+import time
+import Queue
+from timeit import default_timer
+
+import board
+import pubsub
+import service
+import sqlite_storage
+from benchmark import percentile
+
+# Seconds a player sleeps after a poll answered Not Modified
+POLL_INTERVAL = 0.01
+WAIT_TIMEOUT = 5
+
+
+class Recorder(object):
+    """Collects the latencies of the endpoint calls and the repository
+    operations each endpoint makes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.not_modified = collections.Counter()
+        self.operations = collections.defaultdict(collections.Counter)
+
+    def call(self, endpoint, function, *args, **kwargs):
+        """Calls function as a call to endpoint. Errors are counted and
+        raised again."""
+        self._local.endpoint = endpoint
+        start = default_timer()
+        try:
+            return function(*args, **kwargs)
+        except service.NotModifiedError:
+            with self._lock:
+                self.not_modified[endpoint] += 1
+            raise
+        except Exception:
+            with self._lock:
+                self.errors[endpoint] += 1
+            raise
+        finally:
+            latency = default_timer() - start
+            self._local.endpoint = None
+            with self._lock:
+                self.latencies[endpoint].append(latency)
+
+    def count(self, operation):
+        endpoint = getattr(self._local, 'endpoint', None) or 'other'
+        with self._lock:
+            self.operations[endpoint][operation] += 1
+
+    def report(self, elapsed):
+        endpoints = {}
+        for endpoint, latencies in self.latencies.items():
+            latencies = sorted(latencies)
+            endpoints[endpoint] = {
+                'calls': len(latencies),
+                'errors': self.errors[endpoint],
+                'not_modified': self.not_modified[endpoint],
+                'ops_per_sec': len(latencies) / elapsed,
+                'p50_ms': percentile(latencies, 0.5) * 1e3,
+                'p90_ms': percentile(latencies, 0.9) * 1e3,
+                'p99_ms': percentile(latencies, 0.99) * 1e3}
+        return {'elapsed_sec': elapsed,
+                'endpoints': endpoints,
+                'repository_operations': dict(
+                    (endpoint, dict(counts))
+                    for endpoint, counts in self.operations.items())}
+
+
+class CountingRepository(object):
+    """Passes the calls to a repository, counting them in a Recorder"""
+
+    def __init__(self, repository, recorder):
+        self._repository = repository
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        attribute = getattr(self._repository, name)
+        if not callable(attribute):
+            return attribute
+
+        def counted(*args, **kwargs):
+            self._recorder.count(name)
+            return attribute(*args, **kwargs)
+        return counted
+
+
+class Pair(object):
+    """What the two players of a pair share: the second player tells it
+    exists, the first one passes the ids of the games it creates"""
+
+    def __init__(self):
+        self.opponent_ready = threading.Event()
+        self.game_ids = Queue.Queue()
+
+
+class Player(threading.Thread):
+    """Plays games against the other player of its pair"""
+
+    def __init__(self, game_service, recorder, name, opponent, first, games,
+                 wait, pair, seed):
+        """Args:
+            first: True for the player creating the games and playing X.
+            pair: The Pair of the two players."""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self._service = game_service
+        self._recorder = recorder
+        self.name = name
+        self._opponent = opponent
+        self._first = first
+        self._games = games
+        self._wait = wait
+        self._pair = pair
+        self._rng = random.Random(seed)
+        self.failure = None
+
+    def run(self):
+        try:
+            self._recorder.call('create_user', self._service.create_user,
+                                self.name, None)
+            if self._first:
+                self._pair.opponent_ready.wait()
+            else:
+                self._pair.opponent_ready.set()
+            for _ in xrange(self._games):
+                if self._first:
+                    game, _ = self._recorder.call(
+                        'new_game', self._service.new_game, self.name,
+                        self._opponent)
+                    game_id = self._service.repository.game_id(game)
+                    self._pair.game_ids.put(game_id)
+                else:
+                    game_id = self._pair.game_ids.get()
+                self._play(game_id)
+            try:
+                self._recorder.call('get_user_rankings',
+                                    self._service.user_ranking, self.name)
+            except service.NotFoundError:
+                pass
+        except Exception as e:
+            self.failure = e
+
+    def _play(self, game_id):
+        parity = 0 if self._first else 1
+        game, _ = self._recorder.call('get_game', self._service.game_state,
+                                      game_id)
+        while not game.game_over:
+            if game.moves % 2 == parity:
+                free = [cell for cell, piece in
+                        enumerate(game.board_position.split(','))
+                        if piece == board.EMPTY]
+                game, _, _ = self._recorder.call(
+                    'make_move', self._service.make_move, game_id,
+                    position=self._rng.choice(free) + 1,
+                    version=game.version)
+                continue
+            try:
+                if self._wait:
+                    game, _ = self._recorder.call(
+                        'wait_for_move', self._service.wait_for_move,
+                        game_id, game.version, WAIT_TIMEOUT)
+                else:
+                    game, _ = self._recorder.call(
+                        'get_game', self._service.game_state, game_id,
+                        game.version)
+            except service.NotModifiedError:
+                if not self._wait:
+                    time.sleep(POLL_INTERVAL)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--players', type=int, default=16,
+                        help='concurrent players, paired in games')
+    parser.add_argument('--games', type=int, default=3,
+                        help='games each pair plays')
+    parser.add_argument('--wait', action='store_true',
+                        help='wait_for_move instead of polling get_game')
+    parser.add_argument('--database', default=sqlite_storage.MEMORY,
+                        help='SQLite database file, default in memory')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='file to write, default stdout')
+    args = parser.parse_args(argv)
+    if args.players < 2 or args.players % 2:
+        parser.error('--players should be an even number, at least 2')
+
+    recorder = Recorder()
+    game_service = service.GameService(
+        CountingRepository(sqlite_storage.SqliteRepository(args.database),
+                           recorder),
+        pubsub.LocalBroker())
+    run_id = '{:x}'.format(int(time.time() * 1000))
+
+    players = []
+    for index in xrange(args.players // 2):
+        pair = Pair()
+        first, second = ['load-{}-{}-{}'.format(run_id, index, side)
+                         for side in ('x', 'o')]
+        players.append(Player(game_service, recorder, first, second, True,
+                              args.games, args.wait, pair,
+                              args.seed * args.players + len(players)))
+        players.append(Player(game_service, recorder, second, first, False,
+                              args.games, args.wait, pair,
+                              args.seed * args.players + len(players)))
+
+    started = default_timer()
+    for player in players:
+        player.start()
+    for player in players:
+        player.join()
+    elapsed = default_timer() - started
+
+    report = recorder.report(elapsed)
+    report.update(players=args.players, games=args.games, wait=args.wait,
+                  database=args.database,
+                  failures=[str(player.failure) for player in players
+                            if player.failure])
+    report = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output:
+            output.write(report + '\n')
+    else:
+        print report
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -2,34 +2,114 @@
 
 """main.py - This file contains handlers that are called by taskqueue and/or
 cronjobs."""
+import collections
+import logging
+from datetime import date, datetime, timedelta
 import webapp2
 from google.appengine.api import mail, app_identity
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.datastore.datastore_query import Cursor
 from google.appengine.ext import ndb
-from api import TrisApi
-from utils import get_by_urlsafe
-from models import User, Game
+from api import TrisApi, ARCHIVE
+from models import User, UserName, Game, Score, UserStats, PeriodStats,\
+    backfill_scores, backfill_game_counters, backfill_game_players,\
+    backfill_ratings, remove_computer_stats, replay_ratings_day,\
+    apply_replayed_ratings
+import archive
+import storage
+
+BACKFILL_PAGE_SIZE = 200
+BACKFILL_BATCH_SIZE = 20
+REMINDER_SCAN_PAGE_SIZE = 1000
+REMINDER_MAIL_BATCH_SIZE = 50
+# Seconds the users already mailed in a run are remembered
+REMINDER_RUN_TTL = 12 * 60 * 60
+# Format of the times passed to the tasks, with the microseconds even when
+# they are 0
+TASK_TIME = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def add_task(url, name, params):
+    """Queues a named task. Adding a name already used is a no-op, so a
+    retried task does not queue its follow-up tasks twice."""
+    try:
+        taskqueue.add(url=url, name=name, params=params)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
 
 
 class SendReminderEmail(webapp2.RequestHandler):
     def get(self):
-        """Send a reminder email to each User with an email about games.
-        Called every day using a cron job"""
+        """Starts sending a reminder email to each User with an email and
+        games in progress. Called every 12 hours using a cron job. The work
+        is fanned out to task queue jobs: scan tasks page through the active
+        games and queue mail tasks for chunks of their players."""
+        run_id = datetime.utcnow().strftime('%Y%m%d%H%M')
+        add_task('/tasks/reminders/scan', 'reminders-{}-scan-0'.format(run_id),
+                 {'run_id': run_id, 'page': 0})
+
+
+class ScanActiveGames(webapp2.RequestHandler):
+    def post(self):
+        """Collects the players of a page of active games, queues the mail
+        tasks for them and then the scan of the next page. The cursor of
+        each page is the checkpoint a failed run resumes from."""
+        run_id = self.request.get('run_id')
+        page = int(self.request.get('page'))
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        games, next_cursor, more = Game.query(Game.game_over == False). \
+            fetch_page(REMINDER_SCAN_PAGE_SIZE, start_cursor=cursor,
+                       projection=[Game.user1, Game.user2])
+
+        user_keys = sorted(set([game.user1 for game in games] +
+                               [game.user2 for game in games]))
+        for chunk, start in enumerate(
+                range(0, len(user_keys), REMINDER_MAIL_BATCH_SIZE)):
+            add_task('/tasks/reminders/send',
+                     'reminders-{}-send-{}-{}'.format(run_id, page, chunk),
+                     {'run_id': run_id,
+                      'users': ','.join(key.urlsafe() for key in user_keys[
+                          start:start + REMINDER_MAIL_BATCH_SIZE])})
+
+        if more and next_cursor:
+            add_task('/tasks/reminders/scan',
+                     'reminders-{}-scan-{}'.format(run_id, page + 1),
+                     {'run_id': run_id, 'page': page + 1,
+                      'cursor': next_cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class SendReminderBatch(webapp2.RequestHandler):
+    def post(self):
+        """Sends the reminder email to a chunk of users. A user is mailed
+        once per run even if several scan pages found games of theirs. A user
+        is marked before the send and unmarked if it fails, so the retried
+        task mails them."""
         app_id = app_identity.get_application_id()
-        users = User.query(User.email != None)
+        run_id = self.request.get('run_id')
+        user_keys = [ndb.Key(urlsafe=urlsafe)
+                     for urlsafe in self.request.get('users').split(',')]
 
-        for user in users:
-            games = Game.query(ndb.OR(Game.user1 == user.key,
-                                      Game.user2 == user.key)). \
-                filter(Game.game_over == False)
-            if games.count() > 0:
-                subject = 'Reminder for you!'
-                body = 'Hello {}, you have games in progress'.format(user.name)
-                # This will send test emails, the arguments to send_mail are:
-                #  from, to, subject, body
+        for user in ndb.get_multi(user_keys):
+            if not user or not user.email:
+                continue
+            sent_key = 'reminders-{}-{}'.format(run_id, user.key.urlsafe())
+            if not memcache.add(sent_key, True, time=REMINDER_RUN_TTL):
+                continue
+            subject = 'Reminder for you!'
+            body = 'Hello {}, you have games in progress'.format(user.name)
+            # This will send test emails, the arguments to send_mail are:
+            #  from, to, subject, body
+            try:
                 mail.send_mail('noreply@{}.appspotmail.com'.format(app_id),
-                           user.email,
-                           subject,
-                           body)
+                               user.email,
+                               subject,
+                               body)
+            except Exception:
+                memcache.delete(sent_key)
+                raise
+        self.response.set_status(204)
 
 
 class UpdateAverageMovesPerGame(webapp2.RequestHandler):
@@ -39,7 +119,252 @@ class UpdateAverageMovesPerGame(webapp2.RequestHandler):
         self.response.set_status(204)
 
 
+class BackfillUserStats(webapp2.RequestHandler):
+    def post(self):
+        """Counts a page of the existing Scores in the UserStats and the rank
+        index, then queues the task for the next page. Post it once, without
+        a cursor, to build the stats of the Scores written before them."""
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        scores, next_cursor, more = Score.query().order(Score.key). \
+            fetch_page(BACKFILL_PAGE_SIZE, start_cursor=cursor)
+
+        user_to_score_keys = collections.defaultdict(list)
+        for score in scores:
+            if not score.in_stats:
+                user_to_score_keys[score.user].append(score.key)
+        for score_keys in user_to_score_keys.values():
+            for start in range(0, len(score_keys), BACKFILL_BATCH_SIZE):
+                backfill_scores(score_keys[start:start + BACKFILL_BATCH_SIZE])
+
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/backfill_user_stats',
+                          params={'cursor': next_cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class BackfillGameCounters(webapp2.RequestHandler):
+    def post(self):
+        """Counts a page of the existing finished Games in the global
+        counters, then queues the task for the next page. Post it once,
+        without a cursor, to count the Games finished before the counters."""
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        games, next_cursor, more = Game.query(Game.game_over == True). \
+            order(Game.key).fetch_page(BACKFILL_PAGE_SIZE, start_cursor=cursor)
+
+        for game in games:
+            if not game.in_counters:
+                backfill_game_counters(game.key)
+
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/backfill_game_counters',
+                          params={'cursor': next_cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class BackfillGamePlayers(webapp2.RequestHandler):
+    def post(self):
+        """Sets the players of a page of the existing Games, then queues the
+        task for the next page. Post it once, without a cursor, to list the
+        Games created before the players in the games of their users."""
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        games, next_cursor, more = Game.query().order(Game.key). \
+            fetch_page(BACKFILL_PAGE_SIZE, start_cursor=cursor)
+
+        for game in games:
+            if not game.players:
+                backfill_game_players(game.key)
+
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/backfill_game_players',
+                          params={'cursor': next_cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class BackfillRatings(webapp2.RequestHandler):
+    def post(self):
+        """Counts a page of the existing UserStats in the rating index at the
+        initial rating, then queues the task for the next page. Post it
+        once, without a cursor, to rank the users who finished games before
+        the ratings."""
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        keys, next_cursor, more = UserStats.query().order(UserStats.key). \
+            fetch_page(BACKFILL_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+
+        for start in range(0, len(keys), BACKFILL_BATCH_SIZE):
+            backfill_ratings(keys[start:start + BACKFILL_BATCH_SIZE])
+
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/backfill_ratings',
+                          params={'cursor': next_cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class RemoveComputerStats(webapp2.RequestHandler):
+    def post(self):
+        """Deletes the stats of the Computer and takes it out of the rating
+        index. Post it once to drop the stats written before the Computer
+        was left out of them."""
+        remove_computer_stats()
+        self.response.set_status(204)
+
+
+class RecomputeRatings(webapp2.RequestHandler):
+    def post(self):
+        """Replays the Scores of a day into the ratings of a run, then queues
+        the task for the next day with Scores, and after the last day the
+        tasks writing the ratings. Post it once, without parameters, to
+        recompute all the ratings, e.g. after a change of elo.K_FACTOR. The
+        games finishing during the run only count if their day has not been
+        replayed yet."""
+        run_id = self.request.get('run_id')
+        if run_id:
+            day = datetime.strptime(self.request.get('day'),
+                                    '%Y-%m-%d').date()
+            replay_ratings_day(run_id, day)
+            query = Score.query(Score.date > day)
+        else:
+            run_id = datetime.utcnow().strftime('%Y%m%d%H%M')
+            remove_computer_stats()
+            query = Score.query()
+        next_score = query.order(Score.date).get()
+        if next_score:
+            add_task('/tasks/recompute_ratings',
+                     'ratings-{}-{}'.format(run_id, next_score.date),
+                     {'run_id': run_id, 'day': next_score.date.isoformat()})
+        else:
+            add_task('/tasks/recompute_ratings/apply',
+                     'ratings-{}-apply-0'.format(run_id),
+                     {'run_id': run_id, 'page': 0})
+        self.response.set_status(204)
+
+
+class ApplyRecomputedRatings(webapp2.RequestHandler):
+    def post(self):
+        """Sets a page of the UserStats to the ratings replayed by a run,
+        moving them in the rating index, then queues the task for the next
+        page"""
+        run_id = self.request.get('run_id')
+        page = int(self.request.get('page'))
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        keys, next_cursor, more = UserStats.query().order(UserStats.key). \
+            fetch_page(BACKFILL_PAGE_SIZE, start_cursor=cursor, keys_only=True)
+
+        for start in range(0, len(keys), BACKFILL_BATCH_SIZE):
+            apply_replayed_ratings(run_id,
+                                   keys[start:start + BACKFILL_BATCH_SIZE])
+
+        if more and next_cursor:
+            add_task('/tasks/recompute_ratings/apply',
+                     'ratings-{}-apply-{}'.format(run_id, page + 1),
+                     {'run_id': run_id, 'page': page + 1,
+                      'cursor': next_cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class BackfillUserNames(webapp2.RequestHandler):
+    def post(self):
+        """Indexes the names of a page of the existing Users, then queues the
+        task for the next page. Post it once, without a cursor, to index the
+        Users created before the name index. Users indexed already are
+        skipped. Of the Users sharing a name, only the first indexed can be
+        found by name: the others are logged."""
+        cursor = Cursor(urlsafe=self.request.get('cursor') or None)
+        users, next_cursor, more = User.query().order(User.key). \
+            fetch_page(BACKFILL_PAGE_SIZE, start_cursor=cursor)
+
+        for user in users:
+            if not UserName.index(user):
+                logging.warning('User %s has the name %s of another User',
+                                user.key.urlsafe(), user.name)
+
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/backfill_user_names',
+                          params={'cursor': next_cursor.urlsafe()})
+        self.response.set_status(204)
+
+
+class CompactLeaderboards(webapp2.RequestHandler):
+    def get(self):
+        """Starts deleting the buckets of the period leaderboards older than
+        their retention, storage.PERIOD_RETENTION_DAYS. The all time stats
+        keep counting the games. Called every day using a cron job."""
+        today = date.today()
+        for period in storage.PERIODS:
+            add_task('/tasks/compact_leaderboards',
+                     'compact-{}-{}-0'.format(today.isoformat(), period),
+                     {'period': period, 'page': 0,
+                      'before': storage.oldest_kept_bucket(period, today),
+                      'day': today.isoformat()})
+
+
+class CompactPeriodBuckets(webapp2.RequestHandler):
+    def post(self):
+        """Deletes a page of the PeriodStats of a period in the buckets
+        before the given one, then queues the task for the next page. day
+        is the day of the run, naming its tasks: the week and month buckets
+        to keep are the same for days, and a task name cannot be reused."""
+        period = self.request.get('period')
+        before = self.request.get('before')
+        day = self.request.get('day')
+        page = int(self.request.get('page'))
+        keys = PeriodStats.query(PeriodStats.period == period,
+                                 PeriodStats.bucket < before).fetch(
+            BACKFILL_PAGE_SIZE, keys_only=True)
+        ndb.delete_multi(keys)
+        if len(keys) == BACKFILL_PAGE_SIZE:
+            add_task('/tasks/compact_leaderboards',
+                     'compact-{}-{}-{}'.format(day, period, page + 1),
+                     {'period': period, 'page': page + 1, 'before': before,
+                      'day': day})
+        self.response.set_status(204)
+
+
+class ArchiveGames(webapp2.RequestHandler):
+    def get(self):
+        """Starts moving the Games finished and last moved more than
+        archive.ARCHIVE_AFTER_DAYS days ago to the archive. Called every day
+        using a cron job."""
+        now = datetime.now()
+        cutoff = now - timedelta(days=archive.ARCHIVE_AFTER_DAYS)
+        add_task('/tasks/archive_games',
+                 'archive-{}-0'.format(now.date().isoformat()),
+                 {'cutoff': cutoff.strftime(TASK_TIME),
+                  'day': now.date().isoformat(), 'page': 0})
+
+
+class ArchiveSegment(webapp2.RequestHandler):
+    def post(self):
+        """Archives a segment of the Games finished before the cutoff, then
+        queues the task for the next segment while the segments are full.
+        day is the day of the run, naming its tasks and segments."""
+        cutoff = datetime.strptime(self.request.get('cutoff'), TASK_TIME)
+        day = datetime.strptime(self.request.get('day'), '%Y-%m-%d').date()
+        page = int(self.request.get('page'))
+        archived = ARCHIVE.archive_segment(
+            cutoff, archive.segment_name(day, page))
+        if archived == archive.SEGMENT_SIZE:
+            add_task('/tasks/archive_games',
+                     'archive-{}-{}'.format(day.isoformat(), page + 1),
+                     {'cutoff': cutoff.strftime(TASK_TIME),
+                      'day': day.isoformat(), 'page': page + 1})
+        self.response.set_status(204)
+
+
 app = webapp2.WSGIApplication([
     ('/crons/send_reminder', SendReminderEmail),
+    ('/tasks/reminders/scan', ScanActiveGames),
+    ('/tasks/reminders/send', SendReminderBatch),
     ('/tasks/cache_average_moves_per_game', UpdateAverageMovesPerGame),
+    ('/tasks/backfill_user_stats', BackfillUserStats),
+    ('/tasks/backfill_game_counters', BackfillGameCounters),
+    ('/tasks/backfill_game_players', BackfillGamePlayers),
+    ('/tasks/backfill_ratings', BackfillRatings),
+    ('/tasks/remove_computer_stats', RemoveComputerStats),
+    ('/tasks/recompute_ratings', RecomputeRatings),
+    ('/tasks/recompute_ratings/apply', ApplyRecomputedRatings),
+    ('/tasks/backfill_user_names', BackfillUserNames),
+    ('/crons/compact_leaderboards', CompactLeaderboards),
+    ('/tasks/compact_leaderboards', CompactPeriodBuckets),
+    ('/crons/archive_games', ArchiveGames),
+    ('/tasks/archive_games', ArchiveSegment),
 ], debug=True)
@@ -0,0 +1,163 @@
+"""metrics.py - In process latency histograms and RPC counts of the endpoints.
+
+Registry.instrument wraps an endpoint method: every call is timed into the
+histogram of the endpoint, and the RPCs it makes are counted while it runs.
+The RPCs are reported by the caller through record_rpc, on App Engine from
+an apiproxy hook (see api.py). The calls slower than a threshold are sampled
+as traces listing their RPCs in order.
+
+Each instance keeps its own metrics since it started, nothing is shared
+between instances."""
+
+import collections
+import copy
+import functools
+import random
+import threading
+import time
+
+# Upper bounds of the latency buckets in milliseconds, the last bucket holds
+# the slower calls
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+                      10000, 30000)
+SLOW_REQUEST_MS = 500
+# Share of the slow calls kept as traces, and how many are kept
+TRACE_SAMPLE_RATE = 0.2
+MAX_TRACES = 50
+
+Trace = collections.namedtuple('Trace', ['endpoint', 'started', 'latency_ms',
+                                         'rpcs'])
+
+
+class Histogram(object):
+    """Counts of values in the LATENCY_BUCKETS_MS buckets"""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        index = 0
+        while (index < len(LATENCY_BUCKETS_MS) and
+               value > LATENCY_BUCKETS_MS[index]):
+            index += 1
+        self.counts[index] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    def percentile(self, fraction):
+        """Returns the upper bound of the bucket holding the percentile, or
+        the largest value if it is in the last bucket"""
+        if not self.count:
+            return 0.0
+        rank = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                if index < len(LATENCY_BUCKETS_MS):
+                    return min(float(LATENCY_BUCKETS_MS[index]), self.max)
+                return self.max
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class EndpointMetrics(object):
+    """What a Registry knows about one endpoint"""
+
+    def __init__(self):
+        self.latency = Histogram()
+        self.errors = 0
+        self.client_errors = 0
+        # 'service.call' to the number of RPCs
+        self.rpcs = collections.Counter()
+        self.memcache_hits = 0
+        self.memcache_misses = 0
+
+
+class _Request(object):
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.time()
+        self.rpcs = []
+        self.memcache_hits = 0
+        self.memcache_misses = 0
+        self.error = False
+        self.client_error = False
+
+
+class Registry(object):
+    """Metrics of the endpoints of this instance"""
+
+    def __init__(self, slow_request_ms=SLOW_REQUEST_MS,
+                 trace_sample_rate=TRACE_SAMPLE_RATE, max_traces=MAX_TRACES,
+                 rng=random):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._endpoints = collections.defaultdict(EndpointMetrics)
+        self._traces = collections.deque(maxlen=max_traces)
+        self._slow_request_ms = slow_request_ms
+        self._trace_sample_rate = trace_sample_rate
+        self._rng = rng
+
+    def instrument(self, method):
+        """Decorator timing the calls of an endpoint method. An exception
+        with an http_status of 4xx counts as a client error, one of 5xx or
+        without a status as an error. An unchanged game raises no exception:
+        the method catches the NotModifiedError and returns a GameForm with
+        not_modified set (api._not_modified_form), which counts as a
+        success."""
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            request = _Request(method.__name__)
+            self._local.request = request
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                status = getattr(e, 'http_status', 500)
+                if 400 <= status < 500:
+                    request.client_error = True
+                elif status >= 500:
+                    request.error = True
+                raise
+            finally:
+                self._local.request = None
+                self._finish(request,
+                             (time.time() - request.started) * 1000)
+        return wrapper
+
+    def record_rpc(self, service, call, memcache_hits=0, memcache_misses=0):
+        """Counts an RPC of the call being timed on this thread, if any"""
+        request = getattr(self._local, 'request', None)
+        if request is not None:
+            request.rpcs.append(('{}.{}'.format(service, call),
+                                 (time.time() - request.started) * 1000))
+            request.memcache_hits += memcache_hits
+            request.memcache_misses += memcache_misses
+
+    def _finish(self, request, latency_ms):
+        with self._lock:
+            endpoint = self._endpoints[request.endpoint]
+            endpoint.latency.add(latency_ms)
+            if request.error:
+                endpoint.errors += 1
+            elif request.client_error:
+                endpoint.client_errors += 1
+            endpoint.rpcs.update(rpc for rpc, _ in request.rpcs)
+            endpoint.memcache_hits += request.memcache_hits
+            endpoint.memcache_misses += request.memcache_misses
+            if (latency_ms >= self._slow_request_ms and
+                    self._rng.random() < self._trace_sample_rate):
+                self._traces.append(Trace(request.endpoint, request.started,
+                                          latency_ms, request.rpcs))
+
+    def snapshot(self):
+        """Returns a dict from endpoint name to a copy of its
+        EndpointMetrics, and the traces from the oldest"""
+        with self._lock:
+            return (copy.deepcopy(dict(self._endpoints)), list(self._traces))
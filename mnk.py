@@ -0,0 +1,270 @@
+"""mnk.py - Board engine for m,n,k games: k stones in a row on a board with
+rows x cols cells, such as 15x15 five in a row.
+
+Every window of k consecutive cells (horizontal, vertical or diagonal) is
+enumerated once per board size. Placing a stone only updates the windows
+through that cell, which both tells whether the stone completed a line and
+keeps a running evaluation of the position for the search. The computer
+opponent searches with alpha-beta pruning, move ordering and iterative
+deepening, and stops when its wall-clock budget runs out."""
+
+import time
+
+import board
+
+EMPTY = board.EMPTY
+X = board.X
+O = board.O
+
+MIN_SIZE = 3
+MAX_SIZE = 19
+
+# Search depth limit and seconds per move for each difficulty
+SEARCH_LEVELS = {'easy': (1, 0.1), 'medium': (2, 0.5), 'hard': (8, 2.0)}
+
+# Cells farther than this from every stone are not searched
+NEIGHBOURHOOD = 2
+
+_DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+_WIN_SCORE = 1 << 40
+
+_windows_cache = {}
+
+
+def validate_size(rows, cols, k):
+    """Raises ValueError if the board size or k are not supported"""
+    if not (MIN_SIZE <= rows <= MAX_SIZE and MIN_SIZE <= cols <= MAX_SIZE):
+        raise ValueError('Rows and cols should be between {} and {}'.format(
+            MIN_SIZE, MAX_SIZE))
+    if not MIN_SIZE <= k <= max(rows, cols):
+        raise ValueError('k should be between {} and {}'.format(
+            MIN_SIZE, max(rows, cols)))
+
+
+def windows(rows, cols, k):
+    """Returns the windows of k cells and, for every cell, the indexes of
+    the windows through it"""
+    key = (rows, cols, k)
+    if key not in _windows_cache:
+        all_windows = []
+        for row in xrange(rows):
+            for col in xrange(cols):
+                for d_row, d_col in _DIRECTIONS:
+                    end_row = row + d_row * (k - 1)
+                    end_col = col + d_col * (k - 1)
+                    if 0 <= end_row < rows and 0 <= end_col < cols:
+                        all_windows.append(tuple(
+                            (row + d_row * step) * cols + col + d_col * step
+                            for step in xrange(k)))
+        by_cell = [[] for _ in xrange(rows * cols)]
+        for index, window in enumerate(all_windows):
+            for cell in window:
+                by_cell[cell].append(index)
+        _windows_cache[key] = (tuple(all_windows),
+                               tuple(tuple(w) for w in by_cell))
+    return _windows_cache[key]
+
+
+class MNKBoard(object):
+    """A position on a rows x cols board where k in a row wins"""
+
+    def __init__(self, rows, cols, k):
+        validate_size(rows, cols, k)
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.cells = [EMPTY] * (rows * cols)
+        self.stones = 0
+        self.winner = None
+        self.score = 0
+        self._windows, self._by_cell = windows(rows, cols, k)
+        self._counts = {X: [0] * len(self._windows),
+                        O: [0] * len(self._windows)}
+        self._weights = ([0] + [4 ** count for count in xrange(1, k + 1)] +
+                         [0])
+
+    @classmethod
+    def from_string(cls, board_position, rows, cols, k):
+        """Returns the board of a comma separated board position string.
+        Raises:
+            ValueError: if the string is not a well formed board position."""
+        cells = board_position.split(',')
+        if len(cells) != rows * cols:
+            raise ValueError('Invalid input! Input should be {} comma '
+                             'seperated chars'.format(rows * cols))
+        position = cls(rows, cols, k)
+        for cell, piece in enumerate(cells):
+            if piece == X or piece == O:
+                position.place(cell, piece)
+            elif piece != EMPTY:
+                raise ValueError(board.INVALID_CHARS)
+        return position
+
+    def to_string(self):
+        """Returns the comma separated board position string"""
+        return ','.join(self.cells)
+
+    def to_move(self):
+        """Returns the piece of the player to move"""
+        return X if self.stones % 2 == 0 else O
+
+    def is_full(self):
+        return self.stones == len(self.cells)
+
+    def _contribution(self, window):
+        x_count = self._counts[X][window]
+        o_count = self._counts[O][window]
+        if o_count == 0:
+            return self._weights[x_count]
+        elif x_count == 0:
+            return -self._weights[o_count]
+        return 0
+
+    def place(self, cell, piece):
+        """Puts a stone on an empty cell. Returns True if it completes k in a
+        row. Only the windows through cell are looked at."""
+        counts = self._counts[piece]
+        won = False
+        for window in self._by_cell[cell]:
+            self.score -= self._contribution(window)
+            counts[window] += 1
+            if counts[window] == self.k:
+                won = True
+            self.score += self._contribution(window)
+        self.cells[cell] = piece
+        self.stones += 1
+        if won and self.winner is None:
+            self.winner = piece
+        return won
+
+    def remove(self, cell):
+        """Takes back the stone on cell, the reverse of place"""
+        piece = self.cells[cell]
+        counts = self._counts[piece]
+        for window in self._by_cell[cell]:
+            if counts[window] == self.k:
+                self.winner = None
+            self.score -= self._contribution(window)
+            counts[window] -= 1
+            self.score += self._contribution(window)
+        self.cells[cell] = EMPTY
+        self.stones -= 1
+
+    def outcome(self):
+        """Returns board.X_WON, board.O_WON, board.DRAW or 0 if the game is
+        still running"""
+        if self.winner == X:
+            return board.X_WON
+        elif self.winner == O:
+            return board.O_WON
+        elif self.is_full():
+            return board.DRAW
+        return 0
+
+    def candidates(self):
+        """Returns the empty cells near the stones on the board, the most
+        promising ones first"""
+        if not self.stones:
+            return [(self.rows // 2) * self.cols + self.cols // 2]
+        near = set()
+        for cell, piece in enumerate(self.cells):
+            if piece == EMPTY:
+                continue
+            row, col = divmod(cell, self.cols)
+            for near_row in xrange(max(0, row - NEIGHBOURHOOD),
+                                   min(self.rows, row + NEIGHBOURHOOD + 1)):
+                for near_col in xrange(max(0, col - NEIGHBOURHOOD),
+                                       min(self.cols,
+                                           col + NEIGHBOURHOOD + 1)):
+                    near_cell = near_row * self.cols + near_col
+                    if self.cells[near_cell] == EMPTY:
+                        near.add(near_cell)
+        return sorted(near, key=self._urgency, reverse=True)
+
+    def _urgency(self, cell):
+        """Scores a cell by the windows it would extend for both players"""
+        x_counts = self._counts[X]
+        o_counts = self._counts[O]
+        urgency = 0
+        for window in self._by_cell[cell]:
+            if not o_counts[window]:
+                urgency += self._weights[x_counts[window] + 1]
+            if not x_counts[window]:
+                urgency += self._weights[o_counts[window] + 1]
+        return urgency
+
+
+class _Timeout(Exception):
+    pass
+
+
+def search(position, max_depth, time_budget, clock=time.time):
+    """Returns the cell the player to move should play.
+    Args:
+        position: A running MNKBoard, restored to its state on return.
+        max_depth: The deepest iteration of the iterative deepening.
+        time_budget: The seconds the search may take. The best move of the
+            last completed iteration is returned when they run out.
+        clock: Returns the current time in seconds.
+    Raises:
+        ValueError: if the game is over."""
+    if position.outcome():
+        raise ValueError('No move to play')
+    deadline = clock() + time_budget
+    moves = position.candidates()
+    best_move = moves[0]
+    for depth in xrange(1, max_depth + 1):
+        try:
+            value, move = _root(position, moves, depth, deadline, clock)
+        except _Timeout:
+            break
+        best_move = move
+        # search the best move first in the next iteration
+        moves.remove(move)
+        moves.insert(0, move)
+        if abs(value) >= _WIN_SCORE:
+            break
+    return best_move
+
+
+def _root(position, moves, depth, deadline, clock):
+    piece = position.to_move()
+    alpha = -_WIN_SCORE * 2
+    best_move = moves[0]
+    for move in moves:
+        position.place(move, piece)
+        try:
+            value = -_negamax(position, depth - 1, -_WIN_SCORE * 2, -alpha,
+                              deadline, clock)
+        finally:
+            position.remove(move)
+        if value > alpha:
+            alpha = value
+            best_move = move
+    return alpha, best_move
+
+
+def _negamax(position, depth, alpha, beta, deadline, clock):
+    piece = position.to_move()
+    sign = 1 if piece == X else -1
+    if position.winner is not None:
+        # the previous player completed a line, earlier wins score higher
+        return -(_WIN_SCORE + depth)
+    if position.is_full():
+        return 0
+    if depth == 0:
+        return sign * position.score
+    if clock() > deadline:
+        raise _Timeout()
+    for move in position.candidates():
+        position.place(move, piece)
+        try:
+            value = -_negamax(position, depth - 1, -beta, -alpha,
+                              deadline, clock)
+        finally:
+            position.remove(move)
+        if value > alpha:
+            alpha = value
+            if alpha >= beta:
+                break
+    return alpha
@@ -1,18 +1,113 @@
 """models.py - This file contains the class definitions for the Datastore
 entities used by the Game. Because these classes are also regular Python
-classes they can include methods (such as 'to_form' and 'new_game')."""
+classes they can include methods (such as 'new_game'). The methods shared
+with the SQLite records come from storage.py."""
 
+import os
 import random
-from datetime import date
+from datetime import datetime
 from protorpc import messages
 from google.appengine.ext import ndb
 
+import counters
+import elo
+from storage import COMPUTER_NAME, RATING_BUCKETS, PERIODS, GameMoves,\
+    add_ratings, add_score, period_bucket, ranked_scores, rated_scores,\
+    rating_bucket, rating_index_nodes, rating_prefix_nodes
+
+# The Users created before the UserName index are found with queries until
+# /tasks/backfill_user_names has indexed them. Set LEGACY_USER_NAMES to
+# 'false' in app.yaml once it has run.
+LEGACY_USER_NAMES = os.environ.get('LEGACY_USER_NAMES', 'true') == 'true'
+
+
+@ndb.tasklet
+def user_names_async(user_keys):
+    """Returns a dict from User key to name, resolved with one batch get"""
+    unique_keys = list(set(user_keys))
+    users = yield ndb.get_multi_async(unique_keys)
+    raise ndb.Return(dict((key, user.name) for key, user in
+                          zip(unique_keys, users) if user))
+
+
+def user_names(user_keys):
+    return user_names_async(user_keys).get_result()
+
 
 class User(ndb.Model):
     """User profile"""
     name = ndb.StringProperty(required=True)
     email = ndb.StringProperty()
 
+    @classmethod
+    @ndb.tasklet
+    def computer_async(cls):
+        """Returns the User playing for the computer opponent, claiming its
+        name in the index when it is created. Once it exists it is read with
+        a key get, without a transaction."""
+        user = yield ndb.Key(cls, COMPUTER_NAME).get_async()
+        if not user:
+            user = yield cls.get_or_insert_async(COMPUTER_NAME,
+                                                 name=COMPUTER_NAME)
+            yield UserName.index_async(user)
+        raise ndb.Return(user)
+
+    @classmethod
+    def computer(cls):
+        return cls.computer_async().get_result()
+
+    @classmethod
+    def computer_key(cls):
+        return ndb.Key(cls, COMPUTER_NAME)
+
+    @classmethod
+    def create(cls, name, email):
+        """Creates a User and claims its name in one transaction. Returns
+        the User, or None if the name is taken"""
+        legacy = cls.query(cls.name == name).get_async(keys_only=True) \
+            if LEGACY_USER_NAMES else None
+        ids = cls.allocate_ids_async(1)
+        if legacy and legacy.get_result():
+            # a User created before the name index, not backfilled yet
+            return None
+        user = cls(key=ndb.Key(cls, ids.get_result()[0]), name=name,
+                   email=email)
+
+        @ndb.transactional(xg=True)
+        def claim():
+            if UserName.key_for(name).get():
+                return None
+            ndb.put_multi([user, UserName(key=UserName.key_for(name),
+                                          user=user.key)])
+            return user
+        return claim()
+
+    @classmethod
+    @ndb.tasklet
+    def get_by_names_async(cls, names):
+        """Returns a dict from name to User for the names found, resolved
+        with two batches of key gets. Until LEGACY_USER_NAMES is turned off,
+        the Users created before the name index are found with queries, run
+        at the same time, and indexed."""
+        names = list(set(name for name in names if name))
+        entries = yield ndb.get_multi_async(
+            [UserName.key_for(name) for name in names])
+        found = yield ndb.get_multi_async(
+            [entry.user for entry in entries if entry])
+        users = dict((user.name, user) for user in found if user)
+        if not LEGACY_USER_NAMES:
+            raise ndb.Return(users)
+        legacy = yield [cls.query(cls.name == name).get_async()
+                        for name in names if name not in users]
+        legacy = [user for user in legacy if user]
+        yield [UserName.index_async(user) for user in legacy]
+        users.update((user.name, user) for user in legacy)
+        raise ndb.Return(users)
+
+    @classmethod
+    def get_by_names(cls, names):
+        return cls.get_by_names_async(names).get_result()
+
 
     def email_form(self):
         form = EmailPreferenceForm()
@@ -20,7 +115,30 @@ class User(ndb.Model):
         return form
 
 
-class Game(ndb.Model):
+class UserName(ndb.Model):
+    """Index from a user name to its User, keyed by the name: the name of a
+    new User is claimed in the transaction creating it, and names are
+    resolved with key gets, cached by ndb, instead of queries"""
+    user = ndb.KeyProperty(required=True, kind='User', indexed=False)
+
+    @classmethod
+    def key_for(cls, name):
+        return ndb.Key(cls, name)
+
+    @classmethod
+    @ndb.tasklet
+    def index_async(cls, user):
+        """Indexes the name of an existing User. Returns False if the name
+        is already claimed by another User."""
+        entry = yield cls.get_or_insert_async(user.name, user=user.key)
+        raise ndb.Return(entry.user == user.key)
+
+    @classmethod
+    def index(cls, user):
+        return cls.index_async(user).get_result()
+
+
+class Game(GameMoves, ndb.Model):
     """Game object"""
     board_position = ndb.StringProperty(required=True, 
         default="-,-,-,-,-,-,-,-,-")
@@ -30,42 +148,86 @@ class Game(ndb.Model):
     user1 = ndb.KeyProperty(required=True, kind='User')
     user2 = ndb.KeyProperty(required=True, kind='User')
     moves = ndb.IntegerProperty(required=True, default=0)
-    history = ndb.PickleProperty(required=True)
+    # Incremented on every accepted move, to detect concurrent changes
+    version = ndb.IntegerProperty(required=True, default=0)
+    # Cell index of each accepted move, the boards are rebuilt from it
+    move_log = ndb.IntegerProperty(repeated=True, indexed=False)
+    # Boards of the games played before move_log, read only
+    history = ndb.PickleProperty()
+    # True once the finished game is counted in the global counters
+    in_counters = ndb.BooleanProperty(default=False)
+    difficulty = ndb.StringProperty()
+    # user1 and user2, so that the games of a user are found with one query
+    players = ndb.KeyProperty(kind='User', repeated=True)
+    # When the game was created or last moved, None for the games moved
+    # before it was recorded
+    last_move = ndb.DateTimeProperty()
+    rows = ndb.IntegerProperty(required=True, default=3)
+    cols = ndb.IntegerProperty(required=True, default=3)
+    k = ndb.IntegerProperty(required=True, default=3)
 
     @classmethod
-    def new_game(cls, user1, user2):
-        """Creates and returns a new game"""
+    def new_game(cls, user1, user2, difficulty=None, rows=3, cols=3, k=3):
+        """Creates and returns a new game on a rows x cols board where k in
+        a row wins. If difficulty is set user2 is the computer opponent"""
         game = Game(user1=user1,
-                    user2=user2)
-        game.history = []
+                    user2=user2,
+                    players=[user1, user2],
+                    last_move=datetime.now(),
+                    difficulty=difficulty,
+                    rows=rows,
+                    cols=cols,
+                    k=k,
+                    board_position=','.join(['-'] * (rows * cols)))
         game.put()
         return game
 
-    def to_form(self, message):
-        """Returns a GameForm representation of the Game"""
-        form = GameForm()
-        form.urlsafe_key = self.key.urlsafe()
-        form.user_name1 = self.user1.get().name
-        form.user_name2 = self.user2.get().name
-        form.board_position = self.board_position
-        form.game_over = self.game_over
-        form.message = message
-
-        return form
-
-    def end_game(self, user1_won, user2_won, user1_lost, user2_lost):
+    @ndb.tasklet
+    def end_game_async(self, user1_won, user2_won, user1_lost, user2_lost):
         """Ends the game - if won is True, the player won. - if won is False,
-        the player lost."""
+        the player lost. Returns the scores, user stats, rating index shard
+        and counter shards to put in the same transaction as the game, all
+        read at the same time."""
         self.game_over = True
         self.user1_won = user1_won
         self.user2_won = user2_won
         # Add the game to the score 'board'
-        score1 = Score(user=self.user1,date=date.today(), 
-            won=user1_won, lost=user1_lost)
-        score2 = Score(user=self.user2,date=date.today(), 
-            won=user2_won, lost=user2_lost)
-        score1.put()
-        score2.put()
+        now = datetime.now()
+        score1 = Score(user=self.user1, opponent=self.user2, date=now.date(),
+            time=now, won=user1_won, lost=user1_lost, in_stats=True)
+        score2 = Score(user=self.user2, opponent=self.user1, date=now.date(),
+            time=now, won=user2_won, lost=user2_lost, in_stats=True)
+        self.in_counters = True
+        scored, shards = yield (
+            scored_entities_async([score1, score2]),
+            counters.incremented_shards_async(self.counter_deltas()))
+        raise ndb.Return(scored + shards)
+
+    def end_game(self, user1_won, user2_won, user1_lost, user2_lost):
+        return self.end_game_async(user1_won, user2_won, user1_lost,
+                                   user2_lost).get_result()
+
+    def counter_deltas(self):
+        """Returns what the finished game adds to the global counters"""
+        if self.user1_won:
+            outcome = counters.X_WINS
+        elif self.user2_won:
+            outcome = counters.O_WINS
+        else:
+            outcome = counters.DRAWS
+        return {counters.FINISHED_GAMES: 1,
+                counters.TOTAL_MOVES: self.moves,
+                outcome: 1}
+
+
+class ArchiveEntry(ndb.Model):
+    """Segment of the archive holding a deleted Game, keyed by the id of the
+    Game key"""
+    segment = ndb.StringProperty(required=True, indexed=False)
+
+    @classmethod
+    def key_for(cls, game_key):
+        return ndb.Key(cls, game_key.id())
 
 
 class Score(ndb.Model):
@@ -74,46 +236,416 @@ class Score(ndb.Model):
     date = ndb.DateProperty(required=True)
     won = ndb.BooleanProperty(required=True)
     lost = ndb.BooleanProperty(required=True)
+    # The other player and when the game ended, to replay the ratings. Not
+    # set on the scores written before the ratings
+    opponent = ndb.KeyProperty(kind='User')
+    time = ndb.DateTimeProperty(indexed=False)
+    # True once the score is counted in the UserStats of the user
+    in_stats = ndb.BooleanProperty(default=False)
+
+
+@ndb.transactional
+def backfill_game_players(game_key):
+    """Sets the players of a game created before they were recorded, so
+    that it is found in the games of its users. The time of its last move
+    is left empty if unknown, which sorts it after the others."""
+    game = game_key.get()
+    if game and not game.players:
+        game.players = [game.user1, game.user2]
+        game.put()
+
+
+@ndb.transactional(xg=True)
+def backfill_game_counters(game_key):
+    """Counts a game finished before the global counters existed. Games
+    already counted are skipped."""
+    game = game_key.get()
+    if game and game.game_over and not game.in_counters:
+        counters.increment(game.counter_deltas())
+        game.in_counters = True
+        game.put()
 
-    def to_form(self):
-        print "self.won = " + str(self.won) 
-        return ScoreForm(user_name=self.user.get().name, 
-            date=str(self.date),
-            won=self.won,
-            lost=self.lost)
+
+class UserStats(ndb.Model):
+    """Running totals of the finished games of a User, keyed by the id of
+    the User key"""
+    user = ndb.KeyProperty(required=True, kind='User')
+    wins = ndb.IntegerProperty(required=True, default=0)
+    losses = ndb.IntegerProperty(required=True, default=0)
+    games = ndb.IntegerProperty(required=True, default=0)
+    ratio = ndb.FloatProperty(required=True, default=0.0)
+    # Elo rating, None until the stats are counted in the rating index
+    rating = ndb.FloatProperty()
+
+    @classmethod
+    def key_for(cls, user_key):
+        return ndb.Key(cls, user_key.id())
+
+    def add_score(self, score):
+        """Counts a finished game and updates the net win ratio"""
+        add_score(self, score)
+
+
+class PeriodStats(ndb.Model):
+    """Totals of the games a User finished in one day, week or month, a
+    child of the UserStats of the User so that they are updated in the same
+    entity group. Keyed by '<period>/<bucket>', see storage.period_bucket"""
+    period = ndb.StringProperty(required=True)
+    bucket = ndb.StringProperty(required=True)
+    user = ndb.KeyProperty(required=True, kind='User')
+    wins = ndb.IntegerProperty(required=True, default=0, indexed=False)
+    losses = ndb.IntegerProperty(required=True, default=0, indexed=False)
+    games = ndb.IntegerProperty(required=True, default=0, indexed=False)
+    ratio = ndb.FloatProperty(required=True, default=0.0)
+
+    @classmethod
+    def key_for(cls, user_key, period, bucket):
+        return ndb.Key(cls, '{}/{}'.format(period, bucket),
+                       parent=UserStats.key_for(user_key))
+
+    def add_score(self, score):
+        add_score(self, score)
+
+
+RATING_INDEX_SHARDS = 10
+
+
+class RatingIndexShard(ndb.Model):
+    """Shard of the rating index: a Fenwick tree counting the rated users
+    in each rating bucket. A user is counted once across all the shards, so
+    the rank of a rating sums every shard in
+    O(RATING_INDEX_SHARDS * log(RATING_BUCKETS)). Writes go to a random
+    shard to spread the contention. The shards are keyed from 1, as 0 is not
+    a valid id."""
+    tree = ndb.PickleProperty(required=True)
+
+    @classmethod
+    @ndb.tasklet
+    def random_shard_async(cls):
+        """Returns a random shard, to be changed and put in a transaction"""
+        key = ndb.Key(cls, random.randint(1, RATING_INDEX_SHARDS))
+        shard = yield key.get_async()
+        raise ndb.Return(shard or
+                         cls(key=key, tree=[0] * (RATING_BUCKETS + 1)))
+
+    @classmethod
+    def random_shard(cls):
+        return cls.random_shard_async().get_result()
+
+    def add(self, bucket, delta):
+        for node in rating_index_nodes(bucket):
+            self.tree[node] += delta
+
+    def count_up_to(self, bucket):
+        """Returns the users of this shard in the buckets up to bucket"""
+        return sum(self.tree[node] for node in rating_prefix_nodes(bucket))
+
+    @classmethod
+    def rank(cls, rating):
+        """Returns 1 + the number of users with a higher rating bucket"""
+        bucket = rating_bucket(rating)
+        shards = [shard for shard in ndb.get_multi(
+            [ndb.Key(cls, index)
+             for index in xrange(1, RATING_INDEX_SHARDS + 1)])
+                  if shard]
+        return 1 + sum(shard.count_up_to(RATING_BUCKETS - 1) -
+                       shard.count_up_to(bucket) for shard in shards)
+
+
+@ndb.tasklet
+def scored_entities_async(scores):
+    """Counts new scores in the UserStats of their users, rates them and
+    counts them in the PeriodStats of their day, week and month. The
+    Computer gets no stats, and the games against it move no rating.
+    Returns the scores, the stats and the rating index shard to put in the
+    caller's transaction. The stats and the shard are read at the same
+    time."""
+    computer = User.computer_key()
+    ranked = ranked_scores(scores, computer)
+    keys = [UserStats.key_for(score.user) for score in ranked]
+    period_keys = [
+        (PeriodStats.key_for(score.user, period,
+                             period_bucket(period, score.date)), period, score)
+        for score in ranked for period in PERIODS]
+    entities, shard = yield (
+        ndb.get_multi_async(keys + [key for key, _, _ in period_keys]),
+        RatingIndexShard.random_shard_async())
+    stats = dict(zip(keys, entities[:len(keys)]))
+    period_stats = dict(zip([key for key, _, _ in period_keys],
+                            entities[len(keys):]))
+    for key, period, score in period_keys:
+        if period_stats[key] is None:
+            period_stats[key] = PeriodStats(
+                key=key, period=period,
+                bucket=period_bucket(period, score.date), user=score.user)
+        period_stats[key].add_score(score)
+    for key, score in zip(keys, ranked):
+        if stats[key] is None:
+            stats[key] = UserStats(key=key, user=score.user)
+        stats[key].add_score(score)
+    for score in scores:
+        score.in_stats = True
+    for user_stats in stats.values():
+        if user_stats.rating is None:
+            user_stats.rating = elo.INITIAL_RATING
+        else:
+            shard.add(rating_bucket(user_stats.rating), -1)
+    add_ratings(dict((user_stats.user, user_stats)
+                     for user_stats in stats.values()),
+                rated_scores(ranked, computer))
+    for user_stats in stats.values():
+        shard.add(rating_bucket(user_stats.rating), 1)
+    raise ndb.Return(scores + stats.values() + period_stats.values() +
+                     [shard])
+
+
+def scored_entities(scores):
+    return scored_entities_async(scores).get_result()
+
+
+@ndb.transactional(xg=True)
+def record_scores(scores):
+    """Puts new scores and counts them in the UserStats of their users and
+    in the rating index, all in one transaction"""
+    ndb.put_multi(scored_entities(scores))
+
+
+@ndb.transactional(xg=True)
+def backfill_scores(score_keys):
+    """Counts the scores written before UserStats existed. Scores already
+    counted are skipped, so a page can safely be processed again. Pass at
+    most 20 scores of a single user to stay within the entity groups
+    allowed in a cross group transaction."""
+    scores = [score for score in ndb.get_multi(score_keys)
+              if score and not score.in_stats]
+    if scores:
+        record_scores(scores)
+
+
+@ndb.transactional(xg=True)
+def backfill_ratings(stats_keys):
+    """Counts the UserStats written before the ratings in the rating index,
+    at the initial rating. Stats already rated are skipped."""
+    unrated = [stats for stats in ndb.get_multi(stats_keys)
+               if stats and stats.rating is None]
+    if unrated:
+        shard = RatingIndexShard.random_shard()
+        for stats in unrated:
+            stats.rating = elo.INITIAL_RATING
+            shard.add(rating_bucket(stats.rating), 1)
+        ndb.put_multi(unrated + [shard])
+
+
+class ReplayedRating(ndb.Model):
+    """Rating of a User replayed by a run recomputing the ratings, keyed by
+    '<run id>/<user id>'. Kept apart from the UserStats, which the games
+    finishing during the run update. previous is the rating before the
+    replay of day, so a day replayed again by a retried task starts from
+    it."""
+    rating = ndb.FloatProperty(required=True, indexed=False)
+    previous = ndb.FloatProperty(indexed=False)
+    day = ndb.DateProperty(indexed=False)
+
+    @classmethod
+    def key_for(cls, run_id, user_id):
+        return ndb.Key(cls, '{}/{}'.format(run_id, user_id))
+
+
+def replay_ratings_day(run_id, day):
+    """Rates the Scores of a day in chronological order, from the ratings
+    replayed by run_id for the days before. Games against the Computer are
+    skipped, like when they end."""
+    scores = rated_scores(Score.query(Score.date == day).fetch(),
+                          User.computer_key())
+    users = list(set(score.user for score in scores))
+    keys = [ReplayedRating.key_for(run_id, user.id()) for user in users]
+    replayed = dict(zip(users, ndb.get_multi(keys)))
+    ratings = {}
+    for user, replayed_rating in replayed.items():
+        if not replayed_rating:
+            continue
+        if replayed_rating.day == day:
+            rating = replayed_rating.previous
+        else:
+            rating = replayed_rating.rating
+        if rating is not None:
+            ratings[user] = rating
+    # the two Scores of a game end the same day, so every opponent is one
+    # of the users
+    previous = dict(ratings)
+    elo.replay(sorted(scores, key=elo.chronological), ratings)
+    ndb.put_multi([ReplayedRating(key=key, rating=ratings[user],
+                                  previous=previous.get(user), day=day)
+                   for user, key in zip(users, keys)])
+
+
+def apply_replayed_ratings(run_id, stats_keys):
+    """Sets the ratings of UserStats to those replayed by run_id, the
+    initial rating for the users without a rated game, then deletes the
+    replayed ratings. Pass at most 20 keys to stay within the entity groups
+    allowed in a cross group transaction."""
+    keys = [ReplayedRating.key_for(run_id, stats_key.id())
+            for stats_key in stats_keys]
+    ratings = dict(
+        (stats_key, replayed_rating.rating if replayed_rating
+         else elo.INITIAL_RATING)
+        for stats_key, replayed_rating in zip(stats_keys,
+                                              ndb.get_multi(keys)))
+    set_ratings(ratings)
+    ndb.delete_multi(keys)
+
+
+@ndb.transactional(xg=True)
+def set_ratings(ratings):
+    """Sets the ratings of UserStats, a dict from their keys to the new
+    rating, and moves them in the rating index"""
+    stats = [user_stats for user_stats in ndb.get_multi(ratings.keys())
+             if user_stats]
+    if stats:
+        shard = RatingIndexShard.random_shard()
+        for user_stats in stats:
+            if user_stats.rating is not None:
+                shard.add(rating_bucket(user_stats.rating), -1)
+            user_stats.rating = ratings[user_stats.key]
+            shard.add(rating_bucket(user_stats.rating), 1)
+        ndb.put_multi(stats + [shard])
+
+
+@ndb.transactional(xg=True)
+def remove_computer_stats():
+    """Deletes the UserStats and PeriodStats of the Computer written before
+    it was left out of the stats, and takes it out of the rating index"""
+    stats = UserStats.key_for(User.computer_key()).get()
+    if not stats:
+        return
+    if stats.rating is not None:
+        shard = RatingIndexShard.random_shard()
+        shard.add(rating_bucket(stats.rating), -1)
+        shard.put()
+    ndb.delete_multi([stats.key] + PeriodStats.query(
+        ancestor=stats.key).fetch(keys_only=True))
 
 
 class GameForm(messages.Message):
-    """GameForm for outbound game state information"""
+    """GameForm for outbound game state information. With not_modified set
+    the game is still at version and only urlsafe_key, message and version
+    are sent"""
     urlsafe_key = messages.StringField(1, required=True)
-    board_position = messages.StringField(2, required=True)
-    game_over = messages.BooleanField(3, required=True)
+    board_position = messages.StringField(2)
+    game_over = messages.BooleanField(3)
     message = messages.StringField(4, required=True)
-    user_name1 = messages.StringField(5, required=True)
-    user_name2 = messages.StringField(6, required=True)
+    user_name1 = messages.StringField(5)
+    user_name2 = messages.StringField(6)
+    rows = messages.IntegerField(7)
+    cols = messages.IntegerField(8)
+    k = messages.IntegerField(9)
+    version = messages.IntegerField(10)
+    not_modified = messages.BooleanField(11, default=False)
 
 
 class GameForms(messages.Message):
-    """Return multiple GameForms"""
+    """Return multiple GameForms, next_cursor fetches the next page"""
     game_forms = messages.MessageField(GameForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
+
+
+class MoveForm(messages.Message):
+    """MoveForm for outbound information about one move. position counts
+    the cells from 1, from the top left to the bottom right corner"""
+    move_number = messages.IntegerField(1, required=True)
+    piece = messages.StringField(2, required=True)
+    position = messages.IntegerField(3, required=True)
+    board_position = messages.StringField(4, required=True)
+
+
+class GameHistoryForm(messages.Message):
+    """Return the moves of a game"""
+    moves = messages.MessageField(MoveForm, 1, repeated=True)
 
 
 class NewGameForm(messages.Message):
-    """Used to create a new game"""
+    """Used to create a new game. Leave user_name2 empty and choose a
+    difficulty ('easy', 'medium' or 'hard') to play against the computer.
+    rows, cols and k choose a bigger board, e.g. 15, 15 and 5"""
     user_name1 = messages.StringField(1, required=True)
-    user_name2 = messages.StringField(2, required=True)
+    user_name2 = messages.StringField(2)
+    difficulty = messages.StringField(3)
+    rows = messages.IntegerField(4, default=3)
+    cols = messages.IntegerField(5, default=3)
+    k = messages.IntegerField(6, default=3)
 
 
 class MakeMoveForm(messages.Message):
-    """Used to make a move in an existing game"""
-    move = messages.StringField(1, required=True)
+    """Used to make a move in an existing game. Send either the whole board
+    position in move or the cell taken in position, counted from 1 at the
+    top left corner. move_number, the number of the move being made, is
+    optional: the move is rejected if the game is already past it. So is
+    version, the GameForm version the move was chosen from."""
+    move = messages.StringField(1)
+    position = messages.IntegerField(2)
+    move_number = messages.IntegerField(3)
+    version = messages.IntegerField(4)
 
 
 class RankingForm(messages.Message):
-    """RankingForm for outbound Ranking information"""
+    """RankingForm for outbound Ranking information. rating is the Elo
+    rating, not set on the leaderboards of a period"""
     user_name = messages.StringField(1, required=True)
     rank = messages.IntegerField(2, required=True)
     net_win_ratio = messages.FloatField(3, required=True)
+    rating = messages.FloatField(4)
+
+
+class RankingForms(messages.Message):
+    """Return multiple RankingForms"""
+    items = messages.MessageField(RankingForm, 1, repeated=True)
+
+
+class GameStatsForm(messages.Message):
+    """GameStatsForm for outbound statistics of the finished games"""
+    finished_games = messages.IntegerField(1, required=True)
+    total_moves = messages.IntegerField(2, required=True)
+    x_wins = messages.IntegerField(3, required=True)
+    o_wins = messages.IntegerField(4, required=True)
+    draws = messages.IntegerField(5, required=True)
+
+
+class RpcCountForm(messages.Message):
+    """Number of RPCs of one kind, e.g. 'datastore_v3.Get'"""
+    name = messages.StringField(1, required=True)
+    count = messages.IntegerField(2, required=True)
+
+
+class EndpointMetricsForm(messages.Message):
+    """Latencies in milliseconds and RPCs of an endpoint since the instance
+    started. The percentiles are the upper bounds of histogram buckets."""
+    endpoint = messages.StringField(1, required=True)
+    calls = messages.IntegerField(2, required=True)
+    errors = messages.IntegerField(3, required=True)
+    client_errors = messages.IntegerField(4, required=True)
+    mean_ms = messages.FloatField(5, required=True)
+    p50_ms = messages.FloatField(6, required=True)
+    p90_ms = messages.FloatField(7, required=True)
+    p99_ms = messages.FloatField(8, required=True)
+    max_ms = messages.FloatField(9, required=True)
+    rpcs = messages.MessageField(RpcCountForm, 10, repeated=True)
+    memcache_hits = messages.IntegerField(11, required=True)
+    memcache_misses = messages.IntegerField(12, required=True)
+
+
+class TraceForm(messages.Message):
+    """A sampled slow call: its RPCs in order, each with the milliseconds
+    elapsed since the call started"""
+    endpoint = messages.StringField(1, required=True)
+    started = messages.StringField(2, required=True)
+    latency_ms = messages.FloatField(3, required=True)
+    rpcs = messages.StringField(4, repeated=True)
+
+
+class MetricsForm(messages.Message):
+    """Return the metrics of the endpoints on the instance answering"""
+    endpoints = messages.MessageField(EndpointMetricsForm, 1, repeated=True)
+    traces = messages.MessageField(TraceForm, 2, repeated=True)
 
 
 class ScoreForm(messages.Message):
@@ -125,8 +657,9 @@ class ScoreForm(messages.Message):
 
 
 class ScoreForms(messages.Message):
-    """Return multiple ScoreForms"""
+    """Return multiple ScoreForms, next_cursor fetches the next page"""
     items = messages.MessageField(ScoreForm, 1, repeated=True)
+    next_cursor = messages.StringField(2)
 
 '''
 class EmailPreferenceForm(messages.Message):
@@ -0,0 +1,250 @@
+"""ndb_storage.py - Repository keeping the game in the App Engine datastore,
+with the models of models.py, and the blob store of the archive on Cloud
+Storage."""
+
+import httplib
+import urllib
+from contextlib import contextmanager
+from datetime import datetime
+from cStringIO import StringIO
+
+from google.appengine.api import app_identity
+from google.appengine.api import taskqueue
+from google.appengine.api import urlfetch
+from google.appengine.api import datastore_errors
+from google.appengine.datastore.datastore_query import Cursor
+from google.appengine.ext import ndb
+
+import counters
+import storage
+from models import User, Game, Score, UserStats, PeriodStats,\
+    RatingIndexShard, ArchiveEntry, user_names, user_names_async
+
+# Before any last_move: the datastore orders None before the datetimes, so
+# an upper bound alone would also match the Games without a last_move
+EPOCH = datetime(1970, 1, 1)
+GCS_SCOPE = 'https://www.googleapis.com/auth/devstorage.read_write'
+GCS_UPLOAD_URL = ('https://www.googleapis.com/upload/storage/v1/b/{}/o'
+                  '?uploadType=media&name={}')
+GCS_MEDIA_URL = 'https://www.googleapis.com/storage/v1/b/{}/o/{}?alt=media'
+# Seconds a request to Cloud Storage may take
+GCS_DEADLINE = 60
+
+
+class NdbRepository(storage.Repository):
+    """Repository on the datastore. Transactions are cross group, so a
+    finished game is written with the scores, stats, rating index shard and
+    counter shards it changes."""
+
+    def transaction(self, function, *args):
+        """Calls function(*args) in a cross group transaction, which is not
+        retried: the caller decides how to back off."""
+        try:
+            return ndb.transaction(lambda: function(*args), xg=True,
+                                   retries=0)
+        except datastore_errors.TransactionFailedError as e:
+            raise storage.ConflictError(str(e))
+
+    def get_user(self, name):
+        return User.get_by_names([name]).get(name)
+
+    def get_users(self, names):
+        return User.get_by_names(names)
+
+    def get_users_async(self, names):
+        return User.get_by_names_async(names)
+
+    def create_user(self, name, email):
+        user = User.create(name, email)
+        if not user:
+            raise storage.ConflictError(
+                'A User with that name already exists!')
+        return user
+
+    def computer_user(self):
+        return User.computer()
+
+    def computer_user_async(self):
+        return User.computer_async()
+
+    def user_names(self, user_keys):
+        return user_names(user_keys)
+
+    def user_names_async(self, user_keys):
+        return user_names_async(user_keys)
+
+    def new_game(self, user1, user2, difficulty, rows, cols, k):
+        return Game.new_game(user1, user2, difficulty, rows, cols, k)
+
+    def game_id(self, game):
+        return game.key.urlsafe()
+
+    def get_game(self, game_id):
+        """Returns the Game the urlsafe key points to or None. The context
+        cache is skipped: make_move plays on the Game it read, and reads it
+        again when the move is retried."""
+        return self._game_key(game_id).get(use_cache=False)
+
+    @staticmethod
+    def _game_key(game_id):
+        """Returns the Game key of a urlsafe key"""
+        try:
+            key = ndb.Key(urlsafe=game_id)
+        except TypeError:
+            raise storage.InvalidRequestError('Invalid Key')
+        except Exception, e:
+            if e.__class__.__name__ == 'ProtocolBufferDecodeError':
+                raise storage.InvalidRequestError('Invalid Key')
+            else:
+                raise
+        if key.kind() != Game._get_kind():
+            raise storage.InvalidRequestError('Incorrect Kind')
+        return key
+
+    def save_game(self, game, ended=False):
+        """Puts the game, and when it just ended its scores, stats, rating
+        index shard and counter shards in the same batch. The average moves are
+        then refreshed by a task queued with the transaction, at the same time
+        as the put."""
+        entities = [game]
+        if ended:
+            entities.extend(game.end_game(user1_won=game.user1_won,
+                                          user2_won=game.user2_won,
+                                          user1_lost=game.user2_won,
+                                          user2_lost=game.user1_won))
+        rpcs = ndb.put_multi_async(entities)
+        if ended:
+            rpcs.append(taskqueue.Queue().add_async(
+                taskqueue.Task(url='/tasks/cache_average_moves_per_game'),
+                transactional=ndb.in_transaction()))
+        for rpc in rpcs:
+            rpc.get_result()
+
+    def delete_game(self, game):
+        game.key.delete()
+
+    def finished_games_before(self, cutoff, limit):
+        """The Games finished before last_move was recorded are kept: their
+        age is unknown"""
+        return Game.query(Game.game_over == True, Game.last_move > EPOCH,
+                          Game.last_move < cutoff).order(
+            Game.last_move).fetch(limit)
+
+    def archive_games(self, games, segment):
+        ndb.put_multi([ArchiveEntry(key=ArchiveEntry.key_for(game.key),
+                                    segment=segment) for game in games])
+        ndb.delete_multi([game.key for game in games])
+
+    def archived_segment(self, game_id):
+        entry = ArchiveEntry.key_for(self._game_key(game_id)).get()
+        if entry:
+            return entry.segment
+
+    def user_games(self, user, page_size, cursor, active=False):
+        query = Game.query(Game.players == user)
+        if active:
+            query = query.filter(Game.game_over == False)
+        return self._fetch_page(query.order(-Game.last_move), page_size,
+                                cursor)
+
+    def scores(self, page_size, cursor):
+        return self._fetch_page(Score.query().order(-Score.date, Score.key),
+                                page_size, cursor)
+
+    def user_scores(self, user):
+        return Score.query(Score.user == user).fetch()
+
+    def user_stats(self, user):
+        stats = UserStats.key_for(user).get()
+        if stats and stats.games:
+            return stats
+
+    def rank(self, rating):
+        return RatingIndexShard.rank(rating)
+
+    def top_stats(self, limit):
+        return UserStats.query().order(-UserStats.rating).fetch(limit)
+
+    def top_period_stats(self, period, bucket, limit):
+        return PeriodStats.query(PeriodStats.period == period,
+                                 PeriodStats.bucket == bucket).order(
+            -PeriodStats.ratio).fetch(limit)
+
+    def game_totals(self):
+        totals = counters.get_counts([counters.FINISHED_GAMES,
+                                      counters.TOTAL_MOVES, counters.X_WINS,
+                                      counters.O_WINS, counters.DRAWS])
+        return storage.GameTotals(
+            finished_games=totals[counters.FINISHED_GAMES],
+            total_moves=totals[counters.TOTAL_MOVES],
+            x_wins=totals[counters.X_WINS],
+            o_wins=totals[counters.O_WINS],
+            draws=totals[counters.DRAWS])
+
+    @staticmethod
+    def _fetch_page(query, page_size, urlsafe_cursor):
+        """Fetches one page of a query with a stable sort order. Returns the
+        results and the urlsafe cursor of the next page, or None if this is
+        the last page."""
+        size = storage.page_size(page_size)
+        try:
+            cursor = Cursor(urlsafe=urlsafe_cursor) if urlsafe_cursor else None
+        except Exception:
+            raise storage.InvalidRequestError('Invalid cursor')
+        results, next_cursor, more = query.fetch_page(size,
+                                                      start_cursor=cursor)
+        if more and next_cursor:
+            return results, next_cursor.urlsafe()
+        return results, None
+
+
+class CloudStorageBlobStore(object):
+    """Blobs in a Cloud Storage bucket, with the writer and reader of
+    archive.LocalBlobStore. A blob is uploaded in one request once written,
+    so it only exists complete. Requests are authorized as the app's service
+    account."""
+
+    def __init__(self, bucket=None):
+        """Args:
+            bucket: The bucket name, the app's default bucket if None. The
+                default bucket is looked up on the first request, not when
+                the store is built."""
+        self._bucket = bucket
+
+    def _bucket_name(self):
+        if not self._bucket:
+            self._bucket = app_identity.get_default_gcs_bucket_name()
+            if not self._bucket:
+                raise IOError('No Cloud Storage bucket for the archive: set '
+                              'ARCHIVE_BUCKET or create the default bucket '
+                              'of the app')
+        return self._bucket
+
+    def _fetch(self, url, name, **kwargs):
+        """Requests url, formatted with the quoted bucket and blob name"""
+        url = url.format(urllib.quote(self._bucket_name(), safe=''),
+                         urllib.quote(name, safe=''))
+        token, _ = app_identity.get_access_token(GCS_SCOPE)
+        response = urlfetch.fetch(
+            url, deadline=GCS_DEADLINE,
+            headers=dict(kwargs.pop('headers', {}),
+                         Authorization='Bearer {}'.format(token)),
+            **kwargs)
+        if response.status_code != httplib.OK:
+            raise IOError('Cloud Storage answered {}: {}'.format(
+                response.status_code, response.content[:200]))
+        return response
+
+    @contextmanager
+    def writer(self, name):
+        """Yields a file to write the blob to, uploaded when the block
+        ends without an error"""
+        blob = StringIO()
+        yield blob
+        self._fetch(GCS_UPLOAD_URL, name, method=urlfetch.POST,
+                    payload=blob.getvalue(),
+                    headers={'Content-Type': 'application/octet-stream'})
+
+    def reader(self, name):
+        """Returns a file reading the blob"""
+        return StringIO(self._fetch(GCS_MEDIA_URL, name).content)
@@ -0,0 +1,113 @@
+"""pubsub.py - Publishes the version of games as they change, for the
+requests waiting for the opponent to move.
+
+A channel is named after a game and carries its latest version. Versions only
+go up: publishing an older version than the one already published is a no-op.
+MemcacheBroker shares the versions between all the instances of the app,
+LocalBroker keeps them in process for tests and local runs."""
+
+import threading
+import time
+
+
+class MemcacheBroker(object):
+    """Broker keeping the versions in memcache. Waiting requests poll
+    memcache, which is far cheaper than clients polling the API."""
+
+    def __init__(self, client_factory, key_format='GAME_VERSION_{}', ttl=60,
+                 poll_interval=0.25):
+        """Args:
+            client_factory: Returns a memcache client, e.g. memcache.Client.
+            key_format: Format of the memcache key of a channel.
+            ttl: Seconds a published version is kept.
+            poll_interval: Seconds between two reads of a waiting request."""
+        self._client_factory = client_factory
+        self._key_format = key_format
+        self._ttl = ttl
+        self._poll_interval = poll_interval
+
+    def publish(self, channel, version):
+        """Publishes version unless a newer one was already published"""
+        client = self._client_factory()
+        key = self._key_format.format(channel)
+        for _ in xrange(3):
+            latest = client.gets(key)
+            if latest is None:
+                if client.add(key, version, time=self._ttl):
+                    return
+            elif latest >= version or client.cas(key, version,
+                                                 time=self._ttl):
+                return
+
+    def latest(self, channel):
+        """Returns the latest published version or None if unknown"""
+        return self._client_factory().get(self._key_format.format(channel))
+
+    def discard(self, channel):
+        self._client_factory().delete(self._key_format.format(channel))
+
+    def wait(self, channel, version, timeout):
+        """Waits up to timeout seconds for a version newer than version.
+        Returns it, or None on timeout or if the channel is unknown."""
+        deadline = time.time() + timeout
+        client = self._client_factory()
+        key = self._key_format.format(channel)
+        while True:
+            latest = client.get(key)
+            if latest is None:
+                return None
+            if latest > version:
+                return latest
+            if time.time() + self._poll_interval > deadline:
+                return None
+            time.sleep(self._poll_interval)
+
+
+class LocalBroker(object):
+    """In process broker: waiting threads sleep on a condition of their
+    channel and are woken up as soon as a new version is published"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._conditions = {}
+
+    def _condition(self, channel):
+        if channel not in self._conditions:
+            self._conditions[channel] = threading.Condition(self._lock)
+        return self._conditions[channel]
+
+    def publish(self, channel, version):
+        """Publishes version unless a newer one was already published"""
+        with self._lock:
+            if version > self._versions.get(channel, version - 1):
+                self._versions[channel] = version
+                self._condition(channel).notify_all()
+
+    def latest(self, channel):
+        """Returns the latest published version or None if unknown"""
+        with self._lock:
+            return self._versions.get(channel)
+
+    def discard(self, channel):
+        with self._lock:
+            self._versions.pop(channel, None)
+            condition = self._conditions.pop(channel, None)
+            if condition:
+                condition.notify_all()
+
+    def wait(self, channel, version, timeout):
+        """Waits up to timeout seconds for a version newer than version.
+        Returns it, or None on timeout or if the channel is unknown."""
+        deadline = time.time() + timeout
+        with self._lock:
+            while True:
+                latest = self._versions.get(channel)
+                if latest is None:
+                    return None
+                if latest > version:
+                    return latest
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return None
+                self._condition(channel).wait(remaining)
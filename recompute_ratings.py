@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""recompute_ratings.py - Recomputes the Elo ratings of every user of a
+SQLite database by replaying all the scores in chronological order, e.g.
+after a change of the K factor in elo.py. Prints a JSON report.
+
+Ratings only move between users who played each other, so the users are
+split into the connected components of the graph of their games and every
+component is replayed on its own. The components are spread over a pool of
+worker processes by number of scores, each worker replaying its components
+in chronological order, and the ratings are written back in one
+transaction. On App Engine, /tasks/recompute_ratings in main.py replays
+the Scores of the datastore day by day instead.
+
+    python recompute_ratings.py --database /tmp/load.db --processes 4"""
+
+import argparse
+import heapq
+import json
+import multiprocessing
+import sys
+from timeit import default_timer
+
+import elo
+import sqlite_storage
+
+
+def components(scores):
+    """Returns the scores of each connected component of the users, in the
+    order of scores"""
+    parents = {}
+
+    def root(user):
+        parents.setdefault(user, user)
+        while parents[user] != user:
+            parents[user] = parents[parents[user]]
+            user = parents[user]
+        return user
+
+    for score in scores:
+        if score.opponent is not None:
+            parents[root(score.user)] = root(score.opponent)
+    groups = {}
+    for score in scores:
+        groups.setdefault(root(score.user), []).append(score)
+    return groups.values()
+
+
+def batches(groups, count):
+    """Spreads the groups of scores over count batches of about the same
+    number of scores, keeping the order of the scores in each group"""
+    heap = [(0, index) for index in xrange(count)]
+    assigned = [[] for _ in xrange(count)]
+    for group in sorted(groups, key=len, reverse=True):
+        size, index = heapq.heappop(heap)
+        assigned[index].append(group)
+        heapq.heappush(heap, (size + len(group), index))
+    return [batch for batch in assigned if batch]
+
+
+def replay(groups):
+    """Returns the ratings of the users of the groups of scores"""
+    ratings = {}
+    for group in groups:
+        elo.replay(group, ratings)
+    return ratings
+
+
+def recompute(repository, pool, processes):
+    """Replays all the scores of the repository on the pool. Returns the new
+    ratings and the statistics of the run."""
+    started = default_timer()
+    scores = repository.chronological_scores()
+    loaded = default_timer()
+    groups = components(scores)
+    ratings = {}
+    for batch_ratings in pool.imap_unordered(replay,
+                                             batches(groups, processes)):
+        ratings.update(batch_ratings)
+    return ratings, {'scores': len(scores),
+                     'users': len(ratings),
+                     'components': len(groups),
+                     'largest_component_scores': max([0] + map(len, groups)),
+                     'load_sec': loaded - started,
+                     'replay_sec': default_timer() - loaded}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--database', required=True,
+                        help='SQLite database file')
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--dry-run', action='store_true',
+                        help='report the changes without writing them')
+    args = parser.parse_args(argv)
+
+    repository = sqlite_storage.SqliteRepository(args.database)
+    previous = repository.ratings()
+    pool = multiprocessing.Pool(args.processes)
+    try:
+        ratings, report = recompute(repository, pool, args.processes)
+    finally:
+        pool.close()
+        pool.join()
+    # the users who only played the computer are back at the initial rating
+    for user in previous:
+        ratings.setdefault(user, elo.INITIAL_RATING)
+    changes = [abs(rating - previous.get(user, elo.INITIAL_RATING))
+               for user, rating in ratings.items()]
+    report.update(database=args.database, processes=args.processes,
+                  dry_run=args.dry_run,
+                  changed_users=sum(1 for change in changes if change >= 0.5),
+                  max_change=max([0.0] + changes))
+    if not args.dry_run:
+        started = default_timer()
+        repository.update_ratings(ratings)
+        report['write_sec'] = default_timer() - started
+    print json.dumps(report, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,43 @@
+#!/usr/bin/env python
+
+"""runner.py - Runs the unit tests with the App Engine SDK on the path, for
+the tests of the modules using the datastore, memcache or the task queue
+through the testbed stubs. With no test names, runs every test_ module.
+
+    python runner.py ~/google_appengine
+    python runner.py ~/google_appengine test_counters"""
+
+import argparse
+import glob
+import os
+import sys
+import unittest
+
+# An older copy of api.py, not a test module
+NOT_TESTS = ('test_api',)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('sdk_path', help='directory of the App Engine SDK')
+    parser.add_argument('tests', nargs='*', help='test modules or cases')
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, args.sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, root)
+    names = args.tests or sorted(
+        name for name in (os.path.splitext(os.path.basename(path))[0]
+                          for path in glob.glob(os.path.join(root,
+                                                             'test_*.py')))
+        if name not in NOT_TESTS)
+    suite = unittest.defaultTestLoader.loadTestsFromNames(names)
+    result = unittest.TextTestRunner(verbosity=2).run(suite)
+    return 0 if result.wasSuccessful() else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,448 @@
+"""service.py - The game logic behind the API, written against the storage
+layer of storage.py and a version broker of pubsub.py only. TrisApi turns
+requests into calls to a GameService and its results into messages; the same
+service runs outside App Engine on a SqliteRepository and a LocalBroker."""
+
+import collections
+import random
+import time
+from datetime import date
+
+import board
+import mnk
+import solver
+import storage
+
+MOVE_ATTEMPTS = 5
+# Seconds waited after the first conflicting move, doubled on each retry
+MOVE_RETRY_DELAY = 0.05
+
+Validation = collections.namedtuple('Validation', ['valid', 'message'])
+
+Ranking = collections.namedtuple('Ranking', ['user_name', 'rank',
+                                             'net_win_ratio', 'rating'])
+
+
+class ServiceError(Exception):
+    pass
+
+
+class NotFoundError(ServiceError):
+    pass
+
+
+class BadRequestError(ServiceError):
+    pass
+
+
+class ConflictError(ServiceError):
+    pass
+
+
+class NotModifiedError(ServiceError):
+    """The game is still at the version the client already has"""
+
+
+class GameService(object):
+    """Game logic on a repository. The versions of the games are published
+    to broker as they change, for the clients polling or waiting for a
+    move."""
+
+    def __init__(self, repository, broker, sleep=time.sleep, archive=None):
+        """Args:
+            repository: A storage.Repository.
+            broker: A pubsub broker.
+            sleep: Waits for the given seconds between conflicting moves.
+            archive: The archive.Archive of the finished games moved out of
+                the repository, if any."""
+        self.repository = repository
+        self.broker = broker
+        self._sleep = sleep
+        self.archive = archive
+
+    def _user(self, name, message='User not exist!'):
+        user = self.repository.get_user(name)
+        if not user:
+            raise NotFoundError(message)
+        return user
+
+    def _game(self, game_id, message='Game not found!'):
+        game = self.repository.get_game(game_id)
+        if not game:
+            raise NotFoundError(message)
+        return game
+
+    def create_user(self, name, email):
+        """Creates a user, the repository checks the name is unique in the
+        same transaction. The name of the computer opponent is reserved."""
+        if name == storage.COMPUTER_NAME:
+            raise ConflictError('A User with that name already exists!')
+        try:
+            return self.repository.create_user(name, email)
+        except storage.ConflictError:
+            raise ConflictError('A User with that name already exists!')
+
+    def new_game(self, user_name1, user_name2, difficulty=None, rows=3,
+                 cols=3, k=3):
+        """Creates a game. Without user_name2 the second player is the
+        computer opponent, playing at difficulty. Returns the game and the
+        names of its users."""
+        if difficulty and difficulty not in solver.DIFFICULTY_LEVELS:
+            raise BadRequestError('Difficulty should be one of {}'.format(
+                ', '.join(sorted(solver.DIFFICULTY_LEVELS))))
+        # the players and the computer are looked up at the same time
+        users = self.repository.get_users_async(
+            [user_name1] if difficulty else [user_name1, user_name2])
+        computer = self.repository.computer_user_async() if difficulty \
+            else None
+        users = users.get_result()
+        if user_name1 not in users:
+            raise NotFoundError('User1 with that name does not exist!')
+        user1 = users[user_name1]
+        if difficulty:
+            user2 = computer.get_result()
+        elif user_name2 in users:
+            user2 = users[user_name2]
+        else:
+            raise NotFoundError('User2 with that name does not exist!')
+
+        try:
+            mnk.validate_size(rows, cols, k)
+        except ValueError as e:
+            raise BadRequestError(e.message)
+
+        game = self.repository.new_game(user1.key, user2.key, difficulty,
+                                        rows, cols, k)
+        return game, {user1.key: user1.name, user2.key: user2.name}
+
+    def game_state(self, game_id, version=None):
+        """Returns the game and the names of its users. Raises a
+        NotModifiedError if the game is at version, checked against the
+        published version without reading the game when possible."""
+        if version is not None and self.broker.latest(game_id) == version:
+            raise NotModifiedError('Game not modified')
+        game = self._game(game_id)
+        names = self.repository.user_names_async([game.user1, game.user2])
+        self.broker.publish(game_id, game.version)
+        if version == game.version:
+            raise NotModifiedError('Game not modified')
+        return game, names.get_result()
+
+    def wait_for_move(self, game_id, version, timeout):
+        """Waits up to timeout seconds for the game to move past version,
+        then returns it like game_state"""
+        self.broker.wait(game_id, version, timeout)
+        return self.game_state(game_id, version)
+
+    def cancel_game(self, game_id):
+        """Deletes a game still in progress"""
+        game = self._game(game_id)
+        if game.game_over:
+            raise BadRequestError('Game is over!')
+        self.repository.delete_game(game)
+        self.broker.discard(game_id)
+
+    def user_games(self, user_name, page_size=None, cursor=None,
+                   active=False):
+        """Returns a page of the games of a user, only those in progress if
+        active is True, the names of their users and the cursor of the next
+        page"""
+        user = self._user(user_name)
+        games, next_cursor = self.repository.user_games(user.key, page_size,
+                                                        cursor, active)
+        names = self.repository.user_names(
+            [game.user1 for game in games] + [game.user2 for game in games])
+        return games, names, next_cursor
+
+    def game_history(self, game_id):
+        """Returns the game, read back from the archive if it was moved
+        there"""
+        game = self.repository.get_game(game_id)
+        if not game and self.archive:
+            game = self.archive.read_game(game_id)
+        if not game:
+            raise NotFoundError('Game not found')
+        return game
+
+    def make_move(self, game_id, move=None, position=None, move_number=None,
+                  version=None):
+        """Makes a move. Returns the game, the response message and the
+        names of the users. The move and the reply of the computer are
+        played outside any transaction, so the search never holds a lock;
+        the transaction only checks that the game is still at the version
+        played on and writes it. When another request changed the game in
+        the meantime the move is played again, after a growing delay."""
+        delay = MOVE_RETRY_DELAY
+        for attempt in xrange(MOVE_ATTEMPTS):
+            game = self._game(game_id)
+            message, played = self._play_move(game, move, position,
+                                              move_number, version)
+            if not played:
+                break
+            try:
+                self.repository.transaction(self._save_move, game_id, game)
+                break
+            except storage.ConflictError:
+                if attempt == MOVE_ATTEMPTS - 1:
+                    raise ConflictError('The game is too busy, try again!')
+                self._sleep(delay * (1 + random.random()))
+                delay *= 2
+        names = self.repository.user_names_async([game.user1, game.user2])
+        self.broker.publish(game_id, game.version)
+        return game, message, names.get_result()
+
+    def _save_move(self, game_id, game):
+        """Writes the game played on together with the scores, stats and
+        totals of a finished game, if the stored game is still at the
+        version the move was played on.
+        Raises:
+            storage.ConflictError: if the game changed since it was read."""
+        if self._game(game_id).version != game.version - 1:
+            raise storage.ConflictError('The game has changed')
+        self.repository.save_game(game, ended=game.game_over)
+
+    @staticmethod
+    def _play_move(game, move, position, move_number, version):
+        """Plays the move, and the reply of the computer opponent if any, on
+        the game and moves it to the next version.
+        Returns the response message and whether the game was played on"""
+        if game.game_over:
+            if game.user1_won:
+                return 'Game finished! Player 1 Won', False
+            elif game.user2_won:
+                return 'Game finished! Player 2 Won', False
+            else:
+                return 'Game finished! It is a draw', False
+
+        if version is not None and version != game.version:
+            return 'The game has changed! It is at version {}'.format(
+                game.version), False
+        if move_number is not None and move_number != game.moves + 1:
+            return ('The game has changed! The next move is '
+                    'number {}'.format(game.moves + 1)), False
+        if position is not None:
+            cell = position - 1
+            if not 0 <= cell < game.rows * game.cols:
+                return ('Invalid position! It should be between '
+                        '1 and {}'.format(game.rows * game.cols)), False
+        elif move:
+            cell = None
+        else:
+            return 'Send a move or a position!', False
+
+        if game.is_classic:
+            validation = GameService._play_classic(game, move, cell)
+        else:
+            validation = GameService._play_mnk(game, move, cell)
+        if validation.valid == False:
+            return validation.message, False
+
+        game.version = game.version + 1
+        return validation.message, True
+
+    @staticmethod
+    def _play_classic(game, move, cell):
+        """Plays a move on the 3x3 board, and the reply of the computer
+        opponent if any. The move is either the whole board position string
+        or the index of the cell taken by the player to move.
+        Returns a Validation with the response message"""
+        previous_position = board.decode(game.board_position)
+        if cell is None:
+            try:
+                new_position = board.decode(move)
+            except ValueError as e:
+                return Validation(False, e.message)
+        else:
+            new_position = board.play(previous_position, cell)
+            if new_position is None:
+                return Validation(False, 'Invalid move!')
+        validation = GameService._validate_board_position(new_position,
+            previous_position)
+        if validation.valid == False:
+            return validation
+
+        added = (new_position[0] | new_position[1]) ^ (
+            previous_position[0] | previous_position[1])
+        game.add_move(added.bit_length() - 1, board.encode(*new_position))
+        response_message = (GameService._end_game_on_outcome(
+            game, GameService._check_for_win(new_position)) or
+            validation.message)
+
+        if not game.game_over and game.difficulty:
+            # the computer replies in the same request
+            cell = solver.choose_move(new_position[0], new_position[1],
+                                      game.difficulty)
+            new_position = (new_position[0], new_position[1] | 1 << cell)
+            game.add_move(cell, board.encode(*new_position))
+            response_message = (
+                GameService._end_game_on_outcome(
+                    game, GameService._check_for_win(new_position)) or
+                'Computer played position {}. It is your turn now'.format(
+                    cell + 1))
+
+        return Validation(True, response_message)
+
+    @staticmethod
+    def _play_mnk(game, move, cell):
+        """Plays a move on a bigger board, and the reply of the computer
+        opponent if any. The move is either the whole board position string
+        or the index of the cell taken by the player to move. Only the stone
+        just placed is checked for a win.
+        Returns a Validation with the response message"""
+        position = mnk.MNKBoard.from_string(game.board_position, game.rows,
+                                            game.cols, game.k)
+        piece = position.to_move()
+        if cell is not None:
+            if position.cells[cell] != board.EMPTY:
+                return Validation(False, 'Invalid move!')
+            new_cells = {cell: piece}
+        else:
+            new_cells = move.split(',')
+            if len(new_cells) != len(position.cells):
+                return Validation(False, 'Invalid input! Input should be {} '
+                                  'comma seperated chars'.format(
+                                      len(position.cells)))
+            changed = [changed_cell for changed_cell in xrange(len(new_cells))
+                       if new_cells[changed_cell] !=
+                       position.cells[changed_cell]]
+            if len(changed) != 1 or position.cells[changed[0]] != board.EMPTY:
+                return Validation(False, 'Invalid move!')
+            cell = changed[0]
+
+        if new_cells[cell] not in (board.X, board.O):
+            return Validation(False, board.INVALID_CHARS)
+        elif new_cells[cell] != piece and piece == board.X:
+            return Validation(False, "It is player 1\'s turn to play a 'X'!")
+        elif new_cells[cell] != piece:
+            return Validation(False, "It is player 2\'s turn to play an 'O'!")
+
+        position.place(cell, piece)
+        game.add_move(cell, position.to_string())
+        response_message = GameService._end_game_on_outcome(
+            game, position.outcome())
+        if response_message:
+            return Validation(True, response_message)
+
+        if game.difficulty:
+            # the computer replies in the same request
+            max_depth, time_budget = mnk.SEARCH_LEVELS[game.difficulty]
+            cell = mnk.search(position, max_depth, time_budget)
+            position.place(cell, position.to_move())
+            game.add_move(cell, position.to_string())
+            return Validation(True,
+                GameService._end_game_on_outcome(game, position.outcome()) or
+                'Computer played position {}. It is your turn now'.format(
+                    cell + 1))
+
+        if position.to_move() == board.X:
+            return Validation(True, 'It is player 1\'s turn now')
+        else:
+            return Validation(True, 'It is player 2\'s turn now')
+
+    @staticmethod
+    def _end_game_on_outcome(game, outcome):
+        """Ends the game if outcome is board.X_WON, board.O_WON or
+        board.DRAW. Returns the message announcing the result or None if the
+        game goes on"""
+        if outcome == board.X_WON:
+            game.game_over, game.user1_won, game.user2_won = True, True, False
+            return "Player 1 won!"
+        elif outcome == board.O_WON:
+            game.game_over, game.user1_won, game.user2_won = True, False, True
+            return "Player 2 won!"
+        elif outcome == board.DRAW:
+            game.game_over, game.user1_won, game.user2_won = True, False, False
+            return "It is a draw!"
+
+    @staticmethod
+    def _validate_board_position(new_position, previous_position):
+        """Validates the board position and the move. Both positions are
+        (x, o) bitboard tuples as returned by board.decode"""
+        state = board.state(*new_position)
+        if not state:
+            x, o = new_position
+            if board.POPCOUNT[x] - board.POPCOUNT[o] == 2:
+                return Validation(False,
+                                  "It is player 2\'s turn to play an 'O'!")
+            elif board.POPCOUNT[x] - board.POPCOUNT[o] == -1:
+                return Validation(False,
+                                  "It is player 1\'s turn to play a 'X'!")
+            return Validation(False, 'Invalid move!')
+
+        # check that the move is valid: the new position must follow the
+        # previous one with a single stone added
+        if not board.is_successor(previous_position, new_position):
+            return Validation(False, 'Invalid move!')
+
+        if state & board.DRAW:
+            return Validation(True, 'Draw! Game Over')
+        elif state & board.O_TO_MOVE:
+            return Validation(True, 'It is player 2\'s turn now')
+        else:
+            return Validation(True, 'It is player 1\'s turn now')
+
+    @staticmethod
+    def _check_for_win(position):
+        """Returns board.X_WON, board.O_WON, board.DRAW or 0 for a (x, o)
+        bitboard position"""
+        x, o = position
+        return board.outcome(x, o)
+
+    def scores(self, page_size=None, cursor=None):
+        """Returns a page of scores, the most recent first, the names of
+        their users and the cursor of the next page"""
+        scores, next_cursor = self.repository.scores(page_size, cursor)
+        names = self.repository.user_names([score.user for score in scores])
+        return scores, names, next_cursor
+
+    def user_scores(self, user_name):
+        """Returns all the scores of a user and the names of their users"""
+        user = self._user(user_name)
+        return (self.repository.user_scores(user.key), {user.key: user.name})
+
+    def user_ranking(self, user_name):
+        """Returns the Ranking of a user by rating"""
+        user = self._user(user_name, 'A User with that name does not exist!')
+        stats = self.repository.user_stats(user.key)
+        if not stats:
+            raise NotFoundError('The User has not finished any game yet!')
+        return Ranking(user_name, self.repository.rank(stats.rating),
+                       stats.ratio, stats.rating)
+
+    def leaderboard(self, limit, period=None, day=None):
+        """Returns the Rankings of the top users by rating, users in the same
+        rating bucket share a rank. With a period, 'day', 'week' or 'month',
+        the users are ranked by the net win ratio of the games they finished
+        in the period holding day, today by default, and users in the same
+        ratio bucket share a rank."""
+        if period is None:
+            top = self.repository.top_stats(limit)
+            bucket = lambda stats: storage.rating_bucket(stats.rating)
+        elif period in storage.PERIODS:
+            top = self.repository.top_period_stats(
+                period, storage.period_bucket(period, day or date.today()),
+                limit)
+            bucket = lambda stats: storage.ratio_bucket(stats.ratio)
+        else:
+            raise BadRequestError('Period should be one of {}'.format(
+                ', '.join(storage.PERIODS)))
+        names = self.repository.user_names([stats.user for stats in top])
+        rankings = []
+        for index, stats in enumerate(top):
+            if index and bucket(stats) == bucket(top[index - 1]):
+                rank = rankings[-1].rank
+            else:
+                rank = len(rankings) + 1
+            rankings.append(Ranking(names[stats.user], rank, stats.ratio,
+                                    stats.rating if period is None else None))
+        return rankings
+
+    def game_totals(self):
+        return self.repository.game_totals()
+
+    def average_moves(self):
+        """Returns the average moves of the finished games, or None if no
+        game is finished"""
+        totals = self.repository.game_totals()
+        if totals.finished_games:
+            return float(totals.total_moves) / totals.finished_games
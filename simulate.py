@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+
+"""simulate.py - Headless self-play of 3x3 games between policies, to get
+outcome distributions and check the difficulty levels of the computer
+opponent offline. Needs NumPy, which the app itself does not use.
+
+A batch of games is a (games, 9) array of cells, 1 for 'X', -1 for 'O' and
+0 for empty, and every turn plays one move in all the running games at once:
+the policies pick a cell for each board with array operations, and the 8
+lines of every board are summed together to find the winners. Batches run
+in parallel on a process pool.
+
+    python simulate.py --x perfect,greedy --o random,easy --games 1000000
+
+Policies: random, greedy (wins, else blocks, else takes the center), perfect
+(a random perfect move from solver.py), and the difficulty levels of the
+computer opponent, easy, medium and hard, which play perfectly with the
+probability of solver.DIFFICULTY_LEVELS and randomly otherwise."""
+
+import argparse
+import json
+import multiprocessing
+import sys
+from timeit import default_timer
+
+import numpy as np
+
+import board
+import solver
+
+# Cell indexes of the 8 lines
+LINES = np.array(board.WIN_CONDITIONS) - 1
+# Maps the 24 (line, position in the line) pairs to their cells
+LINE_CELLS = np.zeros((LINES.size, board.CELLS), dtype=np.int32)
+LINE_CELLS[np.arange(LINES.size), LINES.ravel()] = 1
+# Base 3 weights of the cells, to index the boards in PERFECT_MOVES
+POWERS = 3 ** np.arange(board.CELLS)
+CENTER = 4
+
+DEFAULT_BATCH_SIZE = 100000
+
+_perfect_moves = None
+
+
+def perfect_moves():
+    """Returns a (3 ** 9, 9) boolean array: row sum(code * POWERS), with
+    code 1 for 'X' and 2 for 'O', holds the perfect moves of that board"""
+    global _perfect_moves
+    if _perfect_moves is None:
+        table = np.zeros((3 ** board.CELLS, board.CELLS), dtype=bool)
+        for x in xrange(1 << board.CELLS):
+            for o in xrange(1 << board.CELLS):
+                if x & o or not board.state(x, o) or board.outcome(x, o):
+                    continue
+                row = sum((1 if x >> cell & 1 else 2 if o >> cell & 1 else 0)
+                          * 3 ** cell for cell in xrange(board.CELLS))
+                table[row, solver.best_moves(x, o)] = True
+        _perfect_moves = table
+    return _perfect_moves
+
+
+def _pick(scores, boards):
+    """Returns the empty cell with the highest score of each board"""
+    scores[boards != 0] = -1
+    return scores.argmax(axis=1)
+
+
+def random_policy(boards, piece, rng):
+    return _pick(rng.random_sample(boards.shape), boards)
+
+
+def _completing_cells(lines, empty, piece):
+    """Returns a (games, 9) boolean array of the cells completing a line of
+    piece"""
+    counts = (lines == piece).sum(axis=2)
+    open_lines = (counts == 2) & (empty.sum(axis=2) == 1)
+    return np.dot((open_lines[:, :, None] & empty).reshape(len(lines), -1),
+                  LINE_CELLS) > 0
+
+
+def greedy_policy(boards, piece, rng):
+    lines = boards[:, LINES]
+    empty = lines == 0
+    scores = (4.0 * _completing_cells(lines, empty, piece) +
+              2.0 * _completing_cells(lines, empty, -piece) +
+              rng.random_sample(boards.shape))
+    scores[:, CENTER] += 1
+    return _pick(scores, boards)
+
+
+def perfect_policy(boards, piece, rng):
+    rows = np.dot(boards % 3, POWERS)
+    scores = rng.random_sample(boards.shape)
+    scores[~perfect_moves()[rows]] = -1
+    return _pick(scores, boards)
+
+
+def difficulty_policy(level):
+    """Returns the policy of the computer opponent at a difficulty level"""
+    probability = solver.DIFFICULTY_LEVELS[level]
+
+    def policy(boards, piece, rng):
+        perfect = rng.random_sample(len(boards)) < probability
+        return np.where(perfect, perfect_policy(boards, piece, rng),
+                        random_policy(boards, piece, rng))
+    return policy
+
+
+POLICIES = {'random': random_policy,
+            'greedy': greedy_policy,
+            'perfect': perfect_policy}
+for _level in solver.DIFFICULTY_LEVELS:
+    POLICIES[_level] = difficulty_policy(_level)
+
+
+def simulate(x_policy, o_policy, games, seed):
+    """Plays a batch of games between two policies named in POLICIES.
+    Returns the 'X' wins, the 'O' wins, the draws and the number of finished
+    games by number of moves."""
+    rng = np.random.RandomState(seed)
+    policies = (POLICIES[x_policy], POLICIES[o_policy])
+    boards = np.zeros((games, board.CELLS), dtype=np.int8)
+    running = np.arange(games)
+    wins = [0, 0]
+    lengths = [0] * (board.CELLS + 1)
+    for turn in xrange(board.CELLS):
+        piece = 1 if turn % 2 == 0 else -1
+        playing = boards[running]
+        cells = policies[turn % 2](playing, piece, rng)
+        playing[np.arange(len(running)), cells] = piece
+        boards[running] = playing
+        # only the player who just moved can have completed a line
+        won = (playing[:, LINES].sum(axis=2) == 3 * piece).any(axis=1)
+        wins[turn % 2] += int(won.sum())
+        lengths[turn + 1] += int(won.sum())
+        running = running[~won]
+        if not len(running):
+            break
+    lengths[board.CELLS] += len(running)
+    return wins[0], wins[1], len(running), lengths
+
+
+def _simulate(args):
+    return simulate(*args)
+
+
+def run(pool, x_policy, o_policy, games, batch_size, seed):
+    """Plays games in batches on the pool and returns their statistics"""
+    batches = [(x_policy, o_policy, min(batch_size, games - start),
+                seed + index)
+               for index, start in enumerate(xrange(0, games, batch_size))]
+    started = default_timer()
+    x_wins = o_wins = draws = 0
+    lengths = [0] * (board.CELLS + 1)
+    for batch in pool.imap_unordered(_simulate, batches):
+        x_wins += batch[0]
+        o_wins += batch[1]
+        draws += batch[2]
+        lengths = [total + count for total, count in zip(lengths, batch[3])]
+    elapsed = default_timer() - started
+    return {'x': x_policy,
+            'o': o_policy,
+            'games': games,
+            'x_wins': x_wins,
+            'o_wins': o_wins,
+            'draws': draws,
+            'x_win_rate': float(x_wins) / games,
+            'o_win_rate': float(o_wins) / games,
+            'draw_rate': float(draws) / games,
+            'games_by_moves': dict((moves, count) for moves, count in
+                                   enumerate(lengths) if count),
+            'games_per_sec': games / elapsed}
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--x', default='perfect',
+                        help='comma separated policies playing X')
+    parser.add_argument('--o', default='random',
+                        help='comma separated policies playing O')
+    parser.add_argument('--games', type=int, default=100000,
+                        help='games of each pair of policies')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--processes', type=int,
+                        default=multiprocessing.cpu_count())
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    for policy in args.x.split(',') + args.o.split(','):
+        if policy not in POLICIES:
+            parser.error('Unknown policy {}, should be one of {}'.format(
+                policy, ', '.join(sorted(POLICIES))))
+
+    pool = multiprocessing.Pool(args.processes)
+    try:
+        results = [run(pool, x_policy, o_policy, args.games, args.batch_size,
+                       args.seed)
+                   for x_policy in args.x.split(',')
+                   for o_policy in args.o.split(',')]
+    finally:
+        pool.close()
+        pool.join()
+    print json.dumps(results, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,118 @@
+"""solver.py - Perfect play computer opponent.
+
+Positions are solved with negamax over the bitboards of board.py. The
+transposition table is keyed on the canonical form of a position under the 8
+symmetries of the board (rotations and reflections), so each unique position
+is evaluated at most once per process."""
+
+import random
+
+import board
+
+# Cell permutations of the 8 symmetries, cell i moves to SYMMETRIES[s][i]
+_IDENTITY = (0, 1, 2, 3, 4, 5, 6, 7, 8)
+_ROTATE = (2, 5, 8, 1, 4, 7, 0, 3, 6)
+_REFLECT = (2, 1, 0, 5, 4, 3, 8, 7, 6)
+
+
+def _compose(first, second):
+    return tuple(second[first[cell]] for cell in xrange(board.CELLS))
+
+
+def _symmetries():
+    rotations = [_IDENTITY]
+    for _ in xrange(3):
+        rotations.append(_compose(rotations[-1], _ROTATE))
+    return tuple(rotations + [_compose(rotation, _REFLECT)
+                              for rotation in rotations])
+
+SYMMETRIES = _symmetries()
+
+# TRANSFORMS[s][mask] is mask transformed by the symmetry s
+TRANSFORMS = tuple(
+    tuple(sum(1 << symmetry[cell] for cell in xrange(board.CELLS)
+              if mask >> cell & 1)
+          for mask in xrange(1 << board.CELLS))
+    for symmetry in SYMMETRIES)
+
+# Probability of playing a perfect move instead of a random one
+DIFFICULTY_LEVELS = {'easy': 0.2, 'medium': 0.6, 'hard': 1.0}
+
+_transposition_table = {}
+
+
+def canonical(x, o):
+    """Returns the smallest STATES index of the symmetric positions"""
+    return min(board.index(transform[x], transform[o])
+               for transform in TRANSFORMS)
+
+
+def negamax(x, o):
+    """Returns the value of a position for the player to move: 0 for a draw,
+    positive for a win and negative for a loss. Quicker wins and slower
+    losses score higher in absolute value."""
+    key = canonical(x, o)
+    value = _transposition_table.get(key)
+    if value is not None:
+        return value
+
+    state = board.state(x, o)
+    free = board.FULL_MASK & ~(x | o)
+    if state & (board.X_WON | board.O_WON):
+        # the previous player completed a line
+        value = -(1 + board.POPCOUNT[free])
+    elif state & board.DRAW:
+        value = 0
+    else:
+        value = -board.CELLS - 1
+        o_to_move = state & board.O_TO_MOVE
+        while free:
+            cell = free & -free
+            free ^= cell
+            if o_to_move:
+                child = -negamax(x, o | cell)
+            else:
+                child = -negamax(x | cell, o)
+            if child > value:
+                value = child
+    _transposition_table[key] = value
+    return value
+
+
+def free_cells(x, o):
+    """Returns the indexes of the empty cells"""
+    return [cell for cell in xrange(board.CELLS) if not (x | o) >> cell & 1]
+
+
+def best_moves(x, o):
+    """Returns the cell indexes of all the perfect moves for the player to
+    move"""
+    o_to_move = board.state(x, o) & board.O_TO_MOVE
+    scores = {}
+    for cell in free_cells(x, o):
+        if o_to_move:
+            scores[cell] = -negamax(x, o | 1 << cell)
+        else:
+            scores[cell] = -negamax(x | 1 << cell, o)
+    best = max(scores.values())
+    return [cell for cell in scores if scores[cell] == best]
+
+
+def choose_move(x, o, difficulty, rng=random):
+    """Returns the cell index the computer plays in a running game.
+    Args:
+        x, o: The bitboards of the position.
+        difficulty: One of the keys of DIFFICULTY_LEVELS.
+        rng: The random number generator to use.
+    Raises:
+        ValueError: if the difficulty is unknown or the game is over."""
+    if difficulty not in DIFFICULTY_LEVELS:
+        raise ValueError('Unknown difficulty {}'.format(difficulty))
+    if board.outcome(x, o) or not board.state(x, o):
+        raise ValueError('No move to play')
+    if rng.random() < DIFFICULTY_LEVELS[difficulty]:
+        return rng.choice(best_moves(x, o))
+    return rng.choice(free_cells(x, o))
+
+# Solving the empty board fills the table with every reachable position
+negamax(0, 0)
@@ -0,0 +1,749 @@
+"""sqlite_storage.py - Repository keeping the game in a local SQLite database,
+to run and load test the game outside App Engine.
+
+A database file is opened in WAL mode with one connection per thread, so
+readers never wait for the writer. ':memory:' gives a private in memory
+database, shared by the threads through a single connection behind a lock.
+Statements are constant SQL strings with parameters, compiled once per
+connection and reused from the sqlite3 statement cache. The import_* methods
+load many rows at once with executemany in a single transaction."""
+
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import elo
+import storage
+
+MEMORY = ':memory:'
+# Format of the times in the cursors
+CURSOR_TIME = '%Y-%m-%dT%H:%M:%S.%f'
+# Statements kept compiled by each connection
+CACHED_STATEMENTS = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    email TEXT);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    user1 INTEGER NOT NULL,
+    user2 INTEGER NOT NULL,
+    board_position TEXT NOT NULL,
+    game_over INTEGER NOT NULL DEFAULT 0,
+    user1_won INTEGER NOT NULL DEFAULT 0,
+    user2_won INTEGER NOT NULL DEFAULT 0,
+    moves INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    move_log TEXT NOT NULL DEFAULT '',
+    difficulty TEXT,
+    n_rows INTEGER NOT NULL DEFAULT 3,
+    n_cols INTEGER NOT NULL DEFAULT 3,
+    k INTEGER NOT NULL DEFAULT 3,
+    last_move TIMESTAMP NOT NULL);
+CREATE TABLE IF NOT EXISTS game_players (
+    game_id INTEGER NOT NULL,
+    user INTEGER NOT NULL,
+    game_over INTEGER NOT NULL,
+    last_move TIMESTAMP NOT NULL,
+    PRIMARY KEY (game_id, user));
+CREATE INDEX IF NOT EXISTS game_players_user
+    ON game_players (user, last_move DESC, game_id);
+CREATE INDEX IF NOT EXISTS game_players_active
+    ON game_players (user, game_over, last_move DESC, game_id);
+CREATE INDEX IF NOT EXISTS games_finished ON games (game_over, last_move);
+CREATE TABLE IF NOT EXISTS archived_games (
+    id INTEGER PRIMARY KEY,
+    segment TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS scores (
+    id INTEGER PRIMARY KEY,
+    user INTEGER NOT NULL,
+    date DATE NOT NULL,
+    won INTEGER NOT NULL,
+    lost INTEGER NOT NULL,
+    opponent INTEGER,
+    time TIMESTAMP);
+CREATE INDEX IF NOT EXISTS scores_date ON scores (date DESC, id);
+CREATE INDEX IF NOT EXISTS scores_user ON scores (user, id);
+CREATE TABLE IF NOT EXISTS user_stats (
+    user INTEGER PRIMARY KEY,
+    wins INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    ratio REAL NOT NULL,
+    rating REAL NOT NULL,
+    bucket INTEGER NOT NULL);
+CREATE INDEX IF NOT EXISTS user_stats_rating ON user_stats (rating);
+CREATE INDEX IF NOT EXISTS user_stats_bucket ON user_stats (bucket);
+CREATE TABLE IF NOT EXISTS rating_index (
+    node INTEGER PRIMARY KEY,
+    count INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS period_stats (
+    period TEXT NOT NULL,
+    bucket TEXT NOT NULL,
+    user INTEGER NOT NULL,
+    wins INTEGER NOT NULL,
+    losses INTEGER NOT NULL,
+    games INTEGER NOT NULL,
+    ratio REAL NOT NULL,
+    PRIMARY KEY (period, bucket, user));
+CREATE INDEX IF NOT EXISTS period_stats_ratio
+    ON period_stats (period, bucket, ratio DESC);
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    finished_games INTEGER NOT NULL DEFAULT 0,
+    total_moves INTEGER NOT NULL DEFAULT 0,
+    x_wins INTEGER NOT NULL DEFAULT 0,
+    o_wins INTEGER NOT NULL DEFAULT 0,
+    draws INTEGER NOT NULL DEFAULT 0);
+INSERT OR IGNORE INTO totals (id) VALUES (0);
+"""
+
+GAME_COLUMNS = ('id, user1, user2, board_position, game_over, user1_won, '
+                'user2_won, moves, version, move_log, difficulty, n_rows, '
+                'n_cols, k, last_move')
+SCORE_COLUMNS = 'id, user, date, won, lost, opponent, time'
+STATS_COLUMNS = 'user, wins, losses, games, ratio, rating'
+
+SELECT_USER = 'SELECT id, name, email FROM users WHERE name = ?'
+SELECT_USERS = 'SELECT id, name, email FROM users WHERE name IN ({})'
+INSERT_USER = 'INSERT INTO users (name, email) VALUES (?, ?)'
+SELECT_USER_NAMES = 'SELECT id, name FROM users WHERE id IN ({})'
+SELECT_LAST_USER = 'SELECT MAX(id) FROM users'
+INSERT_GAME = ('INSERT INTO games (user1, user2, board_position, game_over, '
+               'user1_won, user2_won, moves, version, move_log, difficulty, '
+               'n_rows, n_cols, k, last_move) '
+               'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)')
+SELECT_GAME = 'SELECT {} FROM games WHERE id = ?'.format(GAME_COLUMNS)
+UPDATE_GAME = ('UPDATE games SET board_position = ?, game_over = ?, '
+               'user1_won = ?, user2_won = ?, moves = ?, version = ?, '
+               'move_log = ?, last_move = ? WHERE id = ?')
+DELETE_GAME = 'DELETE FROM games WHERE id = ?'
+SELECT_LAST_GAME = 'SELECT MAX(id) FROM games'
+# A row per player of each game, written with the game, so that the games of
+# a user are paged on one index
+INSERT_GAME_PLAYERS = ('INSERT OR IGNORE INTO game_players (game_id, user, '
+                       'game_over, last_move) VALUES (?, ?, ?, ?)')
+UPDATE_GAME_PLAYERS = ('UPDATE game_players SET game_over = ?, last_move = ? '
+                       'WHERE game_id = ?')
+DELETE_GAME_PLAYERS = 'DELETE FROM game_players WHERE game_id = ?'
+COUNT_GAME_PLAYERS = 'SELECT COUNT(*) FROM game_players'
+FILL_GAME_PLAYERS = """
+INSERT OR IGNORE INTO game_players (game_id, user, game_over, last_move)
+SELECT id, user1, game_over, last_move FROM games
+UNION ALL SELECT id, user2, game_over, last_move FROM games"""
+SELECT_FINISHED_GAMES = ('SELECT {} FROM games WHERE game_over = 1 AND '
+                         'last_move < ? ORDER BY last_move '
+                         'LIMIT ?'.format(GAME_COLUMNS))
+REPLACE_ARCHIVED_GAME = ('INSERT OR REPLACE INTO archived_games (id, segment) '
+                         'VALUES (?, ?)')
+SELECT_ARCHIVED_GAME = 'SELECT segment FROM archived_games WHERE id = ?'
+# The games of a user, the last moved first, from the start or after a
+# cursor, and the same for the games in progress only
+USER_GAMES = ('SELECT {} FROM game_players JOIN games ON '
+              'games.id = game_players.game_id WHERE game_players.user = ? '
+              '{{}}ORDER BY game_players.last_move DESC, game_players.game_id '
+              'LIMIT ?'.format(', '.join('games.' + column.strip() for column
+                                         in GAME_COLUMNS.split(','))))
+AFTER_CURSOR = ('AND game_players.last_move <= ? AND (game_players.last_move '
+                '< ? OR game_players.game_id > ?) ')
+ACTIVE = 'AND game_players.game_over = 0 '
+SELECT_USER_GAMES = USER_GAMES.format('')
+SELECT_USER_GAMES_AFTER = USER_GAMES.format(AFTER_CURSOR)
+SELECT_ACTIVE_USER_GAMES = USER_GAMES.format(ACTIVE)
+SELECT_ACTIVE_USER_GAMES_AFTER = USER_GAMES.format(ACTIVE + AFTER_CURSOR)
+INSERT_SCORE = ('INSERT INTO scores (user, date, won, lost, opponent, time) '
+                'VALUES (?, ?, ?, ?, ?, ?)')
+SELECT_SCORES = 'SELECT {} FROM scores ORDER BY date DESC, id LIMIT ?'.format(
+    SCORE_COLUMNS)
+# The bound on date alone lets the scores_date index seek to the cursor
+SELECT_SCORES_AFTER = ('SELECT {} FROM scores WHERE date <= ? AND '
+                       '(date < ? OR id > ?) ORDER BY date DESC, id '
+                       'LIMIT ?'.format(SCORE_COLUMNS))
+SELECT_USER_SCORES = 'SELECT {} FROM scores WHERE user = ? ORDER BY id'.format(
+    SCORE_COLUMNS)
+# NULL times, of the scores written before the ratings, sort first
+SELECT_CHRONOLOGICAL_SCORES = ('SELECT {} FROM scores ORDER BY date, time, '
+                               'id'.format(SCORE_COLUMNS))
+SELECT_STATS = 'SELECT {} FROM user_stats WHERE user = ?'.format(STATS_COLUMNS)
+REPLACE_STATS = ('INSERT OR REPLACE INTO user_stats (user, wins, losses, '
+                 'games, ratio, rating, bucket) VALUES (?, ?, ?, ?, ?, ?, ?)')
+SELECT_RATINGS = 'SELECT user, rating FROM user_stats'
+UPDATE_RATING = 'UPDATE user_stats SET rating = ?, bucket = ? WHERE user = ?'
+COUNT_RATING_BUCKETS = ('SELECT bucket, COUNT(*) FROM user_stats '
+                        'GROUP BY bucket')
+COUNT_RATING_INDEX = 'SELECT COUNT(*) FROM rating_index'
+REPLACE_RATING_INDEX = ('INSERT OR REPLACE INTO rating_index (node, count) '
+                        'VALUES (?, ?)')
+ADD_RATING_INDEX = 'UPDATE rating_index SET count = count + ? WHERE node = ?'
+SELECT_RATING_INDEX = 'SELECT node, count FROM rating_index WHERE node IN ({})'
+SELECT_TOP_STATS = ('SELECT {} FROM user_stats ORDER BY rating DESC '
+                    'LIMIT ?'.format(STATS_COLUMNS))
+# Counts the games of every user but the computer again, keeping their
+# ratings
+REBUILD_STATS = """
+INSERT OR REPLACE INTO user_stats (user, wins, losses, games, ratio, rating,
+                                   bucket)
+SELECT totals.user, totals.wins, totals.losses, totals.games,
+       totals.ratio, COALESCE(user_stats.rating, {rating}),
+       COALESCE(user_stats.bucket, {bucket})
+FROM (SELECT user, SUM(won) AS wins, SUM(lost AND NOT won) AS losses,
+             COUNT(*) AS games,
+             (SUM(won) - SUM(lost AND NOT won)) * 1.0 / COUNT(*) AS ratio
+      FROM scores WHERE user IS NOT ? GROUP BY user) AS totals
+LEFT JOIN user_stats ON user_stats.user = totals.user""".format(
+    rating=elo.INITIAL_RATING,
+    bucket=storage.rating_bucket(elo.INITIAL_RATING))
+SELECT_PERIOD_STATS = ('SELECT user, wins, losses, games, ratio FROM '
+                       'period_stats WHERE period = ? AND bucket = ? AND '
+                       'user = ?')
+REPLACE_PERIOD_STATS = ('INSERT OR REPLACE INTO period_stats (period, bucket, '
+                        'user, wins, losses, games, ratio) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)')
+INSERT_NEW_PERIOD_STATS = ('INSERT OR IGNORE INTO period_stats (period, '
+                           'bucket, user, wins, losses, games, ratio) '
+                           'VALUES (?, ?, ?, ?, ?, ?, ?)')
+ADD_PERIOD_STATS = ('UPDATE period_stats SET wins = wins + ?, '
+                    'losses = losses + ?, games = games + ?, '
+                    'ratio = (wins + ? - losses - ?) * 1.0 / (games + ?) '
+                    'WHERE period = ? AND bucket = ? AND user = ?')
+SELECT_TOP_PERIOD_STATS = ('SELECT user, wins, losses, games, ratio FROM '
+                           'period_stats WHERE period = ? AND bucket = ? '
+                           'ORDER BY ratio DESC LIMIT ?')
+DELETE_PERIOD_BUCKETS = ('DELETE FROM period_stats WHERE period = ? AND '
+                         'bucket < ?')
+ADD_TOTALS = ('UPDATE totals SET finished_games = finished_games + ?, '
+              'total_moves = total_moves + ?, x_wins = x_wins + ?, '
+              'o_wins = o_wins + ?, draws = draws + ? WHERE id = 0')
+SELECT_TOTALS = ('SELECT finished_games, total_moves, x_wins, o_wins, draws '
+                 'FROM totals WHERE id = 0')
+
+
+class Record(object):
+    """A row handed out by the repository"""
+
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+class User(Record):
+    """User with key, name and email"""
+
+
+class Game(storage.GameMoves, Record):
+    """Game with the attributes of models.Game"""
+    history = None
+
+
+class Score(Record):
+    """Score with key, user, date, won, lost, opponent and time"""
+
+
+class UserStats(Record):
+    """Stats with user, wins, losses, games, ratio and rating"""
+
+
+class PeriodStats(Record):
+    """Stats of a period bucket with user, wins, losses, games and ratio"""
+
+
+def _game(row):
+    return Game(key=row[0], user1=row[1], user2=row[2], board_position=row[3],
+                game_over=bool(row[4]), user1_won=bool(row[5]),
+                user2_won=bool(row[6]), moves=row[7], version=row[8],
+                move_log=[int(cell) for cell in row[9].split(',') if cell],
+                difficulty=row[10], rows=row[11], cols=row[12], k=row[13],
+                last_move=row[14])
+
+
+def _score(row):
+    return Score(key=row[0], user=row[1], date=row[2], won=bool(row[3]),
+                 lost=bool(row[4]), opponent=row[5], time=row[6])
+
+
+def _score_values(score):
+    return (score.user, score.date, score.won, score.lost, score.opponent,
+            score.time)
+
+
+def _stats(row):
+    return UserStats(user=row[0], wins=row[1], losses=row[2], games=row[3],
+                     ratio=row[4], rating=row[5])
+
+
+def _period_stats(row):
+    return PeriodStats(user=row[0], wins=row[1], losses=row[2], games=row[3],
+                       ratio=row[4])
+
+
+def _game_values(game):
+    return (game.user1, game.user2, game.board_position, game.game_over,
+            game.user1_won, game.user2_won, game.moves, game.version,
+            ','.join(str(cell) for cell in game.move_log), game.difficulty,
+            game.rows, game.cols, game.k, game.last_move)
+
+
+def _rebuild_rating_index(connection):
+    """Writes every node of the rating index from the buckets of the user
+    stats"""
+    tree = [0] * (storage.RATING_BUCKETS + 1)
+    for bucket, count in connection.execute(COUNT_RATING_BUCKETS):
+        for node in storage.rating_index_nodes(bucket):
+            tree[node] += count
+    connection.executemany(REPLACE_RATING_INDEX, (
+        (node, tree[node]) for node in xrange(1, len(tree))))
+
+
+def _game_players_values(game):
+    """Returns the game_players rows of a game"""
+    return [(game.key, user, game.game_over, game.last_move)
+            for user in (game.user1, game.user2)]
+
+
+def _game_deltas(game):
+    """Returns what a finished game adds to the columns of the totals"""
+    return (1, game.moves, int(game.user1_won), int(game.user2_won),
+            int(not game.user1_won and not game.user2_won))
+
+
+class SqliteRepository(storage.Repository):
+    """Repository on a SQLite database file, or in memory by default"""
+
+    def __init__(self, path=MEMORY, timeout=5.0):
+        """Args:
+            path: The database file, created if missing, or ':memory:'.
+            timeout: Seconds a writer waits for the database lock before
+                its transaction fails with a ConflictError."""
+        self._path = path
+        self._timeout = timeout
+        self._local = threading.local()
+        if path == MEMORY:
+            self._lock = threading.RLock()
+            self._shared = self._connect()
+        else:
+            self._lock = None
+            self._shared = None
+        with self._connection() as connection:
+            connection.executescript(SCHEMA)
+            if not connection.execute(COUNT_GAME_PLAYERS).fetchone()[0]:
+                # a database written before the game_players table
+                connection.execute(FILL_GAME_PLAYERS)
+            if not connection.execute(COUNT_RATING_INDEX).fetchone()[0]:
+                _rebuild_rating_index(connection)
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self._path, timeout=self._timeout, isolation_level=None,
+            check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES,
+            cached_statements=CACHED_STATEMENTS)
+        if self._path != MEMORY:
+            connection.execute('PRAGMA journal_mode = WAL')
+            # WAL stays consistent on a crash, only the last commits may
+            # be lost when the machine goes down
+            connection.execute('PRAGMA synchronous = NORMAL')
+        return connection
+
+    @contextmanager
+    def _connection(self):
+        """Yields the connection of the calling thread"""
+        if self._lock is not None:
+            with self._lock:
+                yield self._shared
+        else:
+            if getattr(self._local, 'connection', None) is None:
+                self._local.connection = self._connect()
+            yield self._local.connection
+
+    def transaction(self, function, *args):
+        """Calls function(*args) in a transaction holding the write lock of
+        the database. Joins the current transaction if there is one."""
+        with self._connection() as connection:
+            if getattr(self._local, 'in_transaction', False):
+                return function(*args)
+            try:
+                connection.execute('BEGIN IMMEDIATE')
+            except sqlite3.OperationalError as e:
+                raise storage.ConflictError(str(e))
+            self._local.in_transaction = True
+            try:
+                result = function(*args)
+                connection.execute('COMMIT')
+                return result
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+            finally:
+                self._local.in_transaction = False
+
+    def get_user(self, name):
+        with self._connection() as connection:
+            row = connection.execute(SELECT_USER, (name,)).fetchone()
+        if row:
+            return User(key=row[0], name=row[1], email=row[2])
+
+    def get_users(self, names):
+        unique_names = list(set(names))
+        if not unique_names:
+            return {}
+        with self._connection() as connection:
+            rows = connection.execute(
+                SELECT_USERS.format(','.join('?' * len(unique_names))),
+                unique_names).fetchall()
+        return dict((row[1], User(key=row[0], name=row[1], email=row[2]))
+                    for row in rows)
+
+    def create_user(self, name, email):
+        with self._connection() as connection:
+            try:
+                key = connection.execute(INSERT_USER, (name, email)).lastrowid
+            except sqlite3.IntegrityError:
+                raise storage.ConflictError(
+                    'A User with that name already exists!')
+        return User(key=key, name=name, email=email)
+
+    def computer_user(self):
+        return (self.get_user(storage.COMPUTER_NAME) or
+                self.create_user(storage.COMPUTER_NAME, None))
+
+    def _computer_key(self):
+        """Returns the key of the computer user, or None before its first
+        game"""
+        computer = self.get_user(storage.COMPUTER_NAME)
+        return computer.key if computer else None
+
+    def user_names(self, user_keys):
+        unique_keys = list(set(user_keys))
+        if not unique_keys:
+            return {}
+        with self._connection() as connection:
+            return dict(connection.execute(
+                SELECT_USER_NAMES.format(','.join('?' * len(unique_keys))),
+                unique_keys))
+
+    def new_game(self, user1, user2, difficulty, rows, cols, k):
+        game = Game(key=None, user1=user1, user2=user2,
+                    board_position=','.join(['-'] * (rows * cols)),
+                    game_over=False, user1_won=False, user2_won=False,
+                    moves=0, version=0, move_log=[], difficulty=difficulty,
+                    rows=rows, cols=cols, k=k, last_move=datetime.now())
+
+        def insert():
+            with self._connection() as connection:
+                game.key = connection.execute(INSERT_GAME,
+                                              _game_values(game)).lastrowid
+                connection.executemany(INSERT_GAME_PLAYERS,
+                                       _game_players_values(game))
+        self.transaction(insert)
+        return game
+
+    def game_id(self, game):
+        return str(game.key)
+
+    @staticmethod
+    def _game_key(game_id):
+        try:
+            return int(game_id)
+        except (TypeError, ValueError):
+            raise storage.InvalidRequestError('Invalid Key')
+
+    def get_game(self, game_id):
+        with self._connection() as connection:
+            row = connection.execute(SELECT_GAME,
+                                     (self._game_key(game_id),)).fetchone()
+        if row:
+            return _game(row)
+
+    def save_game(self, game, ended=False):
+        self.transaction(self._save_game, game, ended)
+
+    def _save_game(self, game, ended):
+        with self._connection() as connection:
+            connection.execute(UPDATE_GAME, (
+                game.board_position, game.game_over, game.user1_won,
+                game.user2_won, game.moves, game.version,
+                ','.join(str(cell) for cell in game.move_log),
+                game.last_move, game.key))
+            connection.execute(UPDATE_GAME_PLAYERS, (
+                game.game_over, game.last_move, game.key))
+            if not ended:
+                return
+            now = datetime.now()
+            computer = game.user2 if game.difficulty else None
+            scores = [Score(key=None, user=game.user1, opponent=game.user2,
+                            date=now.date(), time=now, won=game.user1_won,
+                            lost=game.user2_won),
+                      Score(key=None, user=game.user2, opponent=game.user1,
+                            date=now.date(), time=now, won=game.user2_won,
+                            lost=game.user1_won)]
+            connection.executemany(INSERT_SCORE,
+                                   [_score_values(score) for score in scores])
+            user_stats = {}
+            # the changes of the nodes of the rating index
+            index_deltas = {}
+            ranked = storage.ranked_scores(scores, computer)
+            for score in ranked:
+                row = connection.execute(SELECT_STATS,
+                                         (score.user,)).fetchone()
+                if row:
+                    stats = _stats(row)
+                    for node in storage.rating_index_nodes(
+                            storage.rating_bucket(stats.rating)):
+                        index_deltas[node] = index_deltas.get(node, 0) - 1
+                else:
+                    stats = UserStats(user=score.user, wins=0, losses=0,
+                                      games=0, ratio=0.0,
+                                      rating=elo.INITIAL_RATING)
+                user_stats[score.user] = stats
+                storage.add_score(stats, score)
+            storage.add_ratings(user_stats,
+                                storage.rated_scores(ranked, computer))
+            for stats in user_stats.values():
+                bucket = storage.rating_bucket(stats.rating)
+                connection.execute(REPLACE_STATS, (
+                    stats.user, stats.wins, stats.losses, stats.games,
+                    stats.ratio, stats.rating, bucket))
+                for node in storage.rating_index_nodes(bucket):
+                    index_deltas[node] = index_deltas.get(node, 0) + 1
+            connection.executemany(ADD_RATING_INDEX, (
+                (delta, node) for node, delta in index_deltas.items()
+                if delta))
+            for score in ranked:
+                for period in storage.PERIODS:
+                    bucket = storage.period_bucket(period, score.date)
+                    row = connection.execute(
+                        SELECT_PERIOD_STATS,
+                        (period, bucket, score.user)).fetchone()
+                    stats = _period_stats(row) if row else PeriodStats(
+                        user=score.user, wins=0, losses=0, games=0,
+                        ratio=0.0)
+                    storage.add_score(stats, score)
+                    connection.execute(REPLACE_PERIOD_STATS, (
+                        period, bucket, stats.user, stats.wins, stats.losses,
+                        stats.games, stats.ratio))
+            connection.execute(ADD_TOTALS, _game_deltas(game))
+
+    def delete_game(self, game):
+        def delete():
+            with self._connection() as connection:
+                connection.execute(DELETE_GAME, (game.key,))
+                connection.execute(DELETE_GAME_PLAYERS, (game.key,))
+        self.transaction(delete)
+
+    def finished_games_before(self, cutoff, limit):
+        with self._connection() as connection:
+            return [_game(row) for row in connection.execute(
+                SELECT_FINISHED_GAMES, (cutoff, limit))]
+
+    def archive_games(self, games, segment):
+        def archive():
+            with self._connection() as connection:
+                connection.executemany(REPLACE_ARCHIVED_GAME, (
+                    (game.key, segment) for game in games))
+                connection.executemany(DELETE_GAME, (
+                    (game.key,) for game in games))
+                connection.executemany(DELETE_GAME_PLAYERS, (
+                    (game.key,) for game in games))
+        self.transaction(archive)
+
+    def archived_segment(self, game_id):
+        with self._connection() as connection:
+            row = connection.execute(SELECT_ARCHIVED_GAME,
+                                     (self._game_key(game_id),)).fetchone()
+        if row:
+            return row[0]
+
+    def user_games(self, user, page_size, cursor, active=False):
+        size = storage.page_size(page_size)
+        with self._connection() as connection:
+            if cursor:
+                try:
+                    last_move, key = cursor.split('/')
+                    last_move = datetime.strptime(last_move, CURSOR_TIME)
+                    key = int(key)
+                except ValueError:
+                    raise storage.InvalidRequestError('Invalid cursor')
+                rows = connection.execute(
+                    SELECT_ACTIVE_USER_GAMES_AFTER if active
+                    else SELECT_USER_GAMES_AFTER,
+                    (user, last_move, last_move, key, size + 1))
+            else:
+                rows = connection.execute(
+                    SELECT_ACTIVE_USER_GAMES if active else SELECT_USER_GAMES,
+                    (user, size + 1))
+            games = [_game(row) for row in rows]
+        if len(games) > size:
+            last = games[size - 1]
+            return games[:size], '{}/{}'.format(
+                last.last_move.strftime(CURSOR_TIME), last.key)
+        return games, None
+
+    def scores(self, page_size, cursor):
+        size = storage.page_size(page_size)
+        with self._connection() as connection:
+            if cursor:
+                try:
+                    day, key = cursor.split('/')
+                    day = datetime.strptime(day, '%Y-%m-%d').date()
+                    key = int(key)
+                except ValueError:
+                    raise storage.InvalidRequestError('Invalid cursor')
+                rows = connection.execute(SELECT_SCORES_AFTER,
+                                          (day, day, key, size + 1))
+            else:
+                rows = connection.execute(SELECT_SCORES, (size + 1,))
+            scores = [_score(row) for row in rows]
+        if len(scores) > size:
+            last = scores[size - 1]
+            return scores[:size], '{}/{}'.format(last.date.isoformat(),
+                                                 last.key)
+        return scores, None
+
+    def user_scores(self, user):
+        with self._connection() as connection:
+            return [_score(row) for row in
+                    connection.execute(SELECT_USER_SCORES, (user,))]
+
+    def user_stats(self, user):
+        with self._connection() as connection:
+            row = connection.execute(SELECT_STATS, (user,)).fetchone()
+        if row:
+            return _stats(row)
+
+    def rank(self, rating):
+        """Sums the nodes of the rating index counting all the users and
+        those up to the bucket of rating, in O(log(RATING_BUCKETS))"""
+        all_nodes = storage.rating_prefix_nodes(storage.RATING_BUCKETS - 1)
+        nodes = storage.rating_prefix_nodes(storage.rating_bucket(rating))
+        with self._connection() as connection:
+            counts = dict(connection.execute(
+                SELECT_RATING_INDEX.format(
+                    ','.join('?' * len(all_nodes + nodes))),
+                all_nodes + nodes))
+        return 1 + (sum(counts[node] for node in all_nodes) -
+                    sum(counts[node] for node in nodes))
+
+    def top_stats(self, limit):
+        with self._connection() as connection:
+            return [_stats(row) for row in
+                    connection.execute(SELECT_TOP_STATS, (limit,))]
+
+    def top_period_stats(self, period, bucket, limit):
+        with self._connection() as connection:
+            return [_period_stats(row) for row in connection.execute(
+                SELECT_TOP_PERIOD_STATS, (period, bucket, limit))]
+
+    def compact_period_stats(self, today):
+        """Deletes the period buckets older than their retention, like the
+        compaction cron does on App Engine"""
+        with self._connection() as connection:
+            for period in storage.PERIODS:
+                connection.execute(DELETE_PERIOD_BUCKETS, (
+                    period, storage.oldest_kept_bucket(period, today)))
+
+    def game_totals(self):
+        with self._connection() as connection:
+            return storage.GameTotals(
+                *connection.execute(SELECT_TOTALS).fetchone())
+
+    def chronological_scores(self):
+        """Returns all the scores moving the ratings in the order they are
+        rated"""
+        computer = self._computer_key()
+        with self._connection() as connection:
+            return storage.rated_scores(
+                [_score(row) for row in
+                 connection.execute(SELECT_CHRONOLOGICAL_SCORES)], computer)
+
+    def ratings(self):
+        """Returns a dict from the key of every user with stats to its
+        rating"""
+        with self._connection() as connection:
+            return dict(connection.execute(SELECT_RATINGS))
+
+    def update_ratings(self, ratings):
+        """Sets the ratings of users with stats, from a dict from user key
+        to rating"""
+        def update():
+            with self._connection() as connection:
+                connection.executemany(UPDATE_RATING, (
+                    (rating, storage.rating_bucket(rating), user)
+                    for user, rating in ratings.items()))
+                _rebuild_rating_index(connection)
+        self.transaction(update)
+
+    def import_users(self, names):
+        """Bulk inserts users without email. Returns their keys in order."""
+        def insert():
+            with self._connection() as connection:
+                # the transaction holds the write lock, so the new rows get
+                # the ids following the last one
+                last = connection.execute(SELECT_LAST_USER).fetchone()[0] or 0
+                connection.executemany(INSERT_USER,
+                                       ((name, None) for name in names))
+                return range(last + 1, last + 1 + len(names))
+        return self.transaction(insert)
+
+    def import_games(self, games):
+        """Bulk inserts games, counting the finished ones in the totals"""
+        def insert():
+            with self._connection() as connection:
+                # the transaction holds the write lock, so the new rows get
+                # the ids following the last one
+                last = connection.execute(SELECT_LAST_GAME).fetchone()[0] or 0
+                for key, game in enumerate(games, last + 1):
+                    game.key = key
+                connection.executemany(INSERT_GAME,
+                                       (_game_values(game) for game in games))
+                connection.executemany(INSERT_GAME_PLAYERS, (
+                    row for game in games
+                    for row in _game_players_values(game)))
+                totals = [0] * 5
+                for game in games:
+                    if game.game_over:
+                        totals = [total + delta for total, delta in
+                                  zip(totals, _game_deltas(game))]
+                connection.execute(ADD_TOTALS, totals)
+        self.transaction(insert)
+
+    def import_scores(self, scores):
+        """Bulk inserts scores, then rebuilds the stats of every user from
+        all the scores with one aggregate query. The period stats of the
+        scores are summed in memory and merged in bulk. The scores are rated
+        after the ones already in the database."""
+        computer = self._computer_key()
+        rated = storage.rated_scores(scores, computer)
+        periods = {}
+        for score in storage.ranked_scores(scores, computer):
+            won = int(score.won)
+            lost = int(score.lost and not score.won)
+            for period in storage.PERIODS:
+                key = (period, storage.period_bucket(period, score.date),
+                       score.user)
+                totals = periods.setdefault(key, [0, 0, 0])
+                totals[0] += won
+                totals[1] += lost
+                totals[2] += 1
+
+        def insert():
+            with self._connection() as connection:
+                connection.executemany(INSERT_SCORE, (
+                    _score_values(score) for score in scores))
+                connection.execute(REBUILD_STATS, (computer,))
+                ratings = elo.replay(
+                    sorted(rated, key=elo.chronological),
+                    dict(connection.execute(SELECT_RATINGS)))
+                connection.executemany(UPDATE_RATING, (
+                    (ratings[user], storage.rating_bucket(ratings[user]), user)
+                    for user in set(score.user for score in rated)))
+                _rebuild_rating_index(connection)
+                # add to the existing rows, then insert the missing ones
+                connection.executemany(ADD_PERIOD_STATS, (
+                    (wins, losses, games, wins, losses, games) + key
+                    for key, (wins, losses, games) in periods.items()))
+                connection.executemany(INSERT_NEW_PERIOD_STATS, (
+                    key + (wins, losses, games,
+                           (wins - losses) / float(games))
+                    for key, (wins, losses, games) in periods.items()))
+        self.transaction(insert)
@@ -0,0 +1,344 @@
+"""storage.py - The storage layer the game logic is written against.
+
+A Repository reads and writes the users, games, scores and statistics of the
+game. NdbRepository (ndb_storage.py) keeps them in the App Engine datastore,
+SqliteRepository (sqlite_storage.py) in a local SQLite database, so the game
+can run and be load tested outside App Engine. Nothing in this module imports
+App Engine.
+
+Entities are handed out as objects with the attributes of the models in
+models.py. Each has a key identifying it within its repository: game.user1,
+score.user, score.opponent and stats.user hold the key of a user."""
+
+import collections
+from datetime import datetime, timedelta
+
+import elo
+
+COMPUTER_NAME = 'Computer'
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+RANK_BUCKETS = 2001
+# Ratings are ranked by whole points, from 0 to RATING_BUCKETS - 1
+RATING_BUCKETS = 4001
+
+# Leaderboard periods and the days their buckets are kept for
+DAY = 'day'
+WEEK = 'week'
+MONTH = 'month'
+PERIODS = (DAY, WEEK, MONTH)
+PERIOD_RETENTION_DAYS = {DAY: 35, WEEK: 26 * 7, MONTH: 2 * 366}
+
+GameTotals = collections.namedtuple(
+    'GameTotals', ['finished_games', 'total_moves', 'x_wins', 'o_wins',
+                   'draws'])
+
+
+class StorageError(Exception):
+    pass
+
+
+class InvalidRequestError(StorageError):
+    """A game id, cursor or page size sent by a client is malformed"""
+
+
+class ConflictError(StorageError):
+    """A transaction lost against a concurrent change, or a unique name is
+    taken"""
+
+
+def ratio_bucket(ratio):
+    """Maps a net win ratio in [-1, 1] to one of RANK_BUCKETS buckets"""
+    return int(round((ratio + 1) * (RANK_BUCKETS - 1) / 2.0))
+
+
+def rating_bucket(rating):
+    """Maps an Elo rating to one of RATING_BUCKETS buckets"""
+    return min(max(int(round(rating)), 0), RATING_BUCKETS - 1)
+
+
+def rating_index_nodes(bucket):
+    """Returns the nodes, numbered from 1, of a Fenwick tree over the rating
+    buckets that count the users of bucket"""
+    nodes = []
+    node = bucket + 1
+    while node <= RATING_BUCKETS:
+        nodes.append(node)
+        node += node & -node
+    return nodes
+
+
+def rating_prefix_nodes(bucket):
+    """Returns the nodes of a Fenwick tree over the rating buckets summing
+    to the users in the buckets up to bucket"""
+    nodes = []
+    node = bucket + 1
+    while node > 0:
+        nodes.append(node)
+        node -= node & -node
+    return nodes
+
+
+def add_score(stats, score):
+    """Counts a finished game in the stats of its user and updates the net
+    win ratio"""
+    if score.won:
+        stats.wins += 1
+    elif score.lost:
+        stats.losses += 1
+    stats.games += 1
+    stats.ratio = (stats.wins - stats.losses) / float(stats.games)
+
+
+def ranked_scores(scores, computer):
+    """Returns the scores counted in the stats of their users. The computer
+    opponent is a single user playing at every difficulty, so it has no
+    stats. computer is its key, or None if it does not exist."""
+    return [score for score in scores
+            if computer is None or score.user != computer]
+
+
+def rated_scores(scores, computer):
+    """Returns the scores moving the ratings: the games against the
+    computer opponent count in the stats of the player only"""
+    return [score for score in scores if computer is None or
+            computer not in (score.user, score.opponent)]
+
+
+def add_ratings(stats, scores):
+    """Rates new scores in the stats of their users, a dict from user key to
+    stats with a rating. The opponents missing from stats count at their
+    initial rating."""
+    ratings = dict((user, user_stats.rating)
+                   for user, user_stats in stats.items())
+    elo.replay(sorted(scores, key=elo.chronological), ratings)
+    for user, user_stats in stats.items():
+        user_stats.rating = ratings[user]
+
+
+def period_bucket(period, day):
+    """Returns the bucket of a period holding a date: '2016-03-21' for a
+    day, the ISO week '2016-W12' for a week and '2016-03' for a month. The
+    buckets of a period sort in time order."""
+    if period == DAY:
+        return day.isoformat()
+    elif period == WEEK:
+        year, week, _ = day.isocalendar()
+        return '{}-W{:02d}'.format(year, week)
+    elif period == MONTH:
+        return '{}-{:02d}'.format(day.year, day.month)
+    raise ValueError('Unknown period {}'.format(period))
+
+
+def oldest_kept_bucket(period, today):
+    """Returns the first bucket of a period still kept: the older ones are
+    compacted away"""
+    return period_bucket(period, today - timedelta(
+        days=PERIOD_RETENTION_DAYS[period]))
+
+
+def page_size(requested):
+    """Returns the number of results to fetch for a requested page size.
+    Raises:
+        InvalidRequestError: if the page size is not positive."""
+    if requested is None:
+        return DEFAULT_PAGE_SIZE
+    if requested < 1:
+        raise InvalidRequestError('Invalid page size')
+    return min(requested, MAX_PAGE_SIZE)
+
+
+class Done(object):
+    """Future of a result already computed, returned by the *_async
+    methods of the repositories making synchronous calls"""
+
+    def __init__(self, result):
+        self._result = result
+
+    def get_result(self):
+        return self._result
+
+
+class GameMoves(object):
+    """Move log of a game, shared by the Game model and the SQLite game
+    record. Expects the attributes of models.Game."""
+
+    @property
+    def is_classic(self):
+        """True for the 3x3 board with 3 in a row"""
+        return self.rows == 3 and self.cols == 3 and self.k == 3
+
+    def add_move(self, cell, board_position):
+        """Records an accepted move and the board position after it"""
+        if not self.move_log and self.history:
+            # move the game over from the pickled history
+            self.move_log = [logged for logged, _, _ in
+                             self._replay_legacy_history()]
+            self.history = None
+        self.move_log.append(cell)
+        self.board_position = board_position
+        self.moves = self.moves + 1
+        self.last_move = datetime.now()
+
+    def replay(self):
+        """Yields (cell index, piece, board position) for every move, the
+        boards are rebuilt from move_log"""
+        if not self.move_log and self.history:
+            for move in self._replay_legacy_history():
+                yield move
+            return
+        cells = ['-'] * (self.rows * self.cols)
+        for number, cell in enumerate(self.move_log):
+            cells[cell] = 'X' if number % 2 == 0 else 'O'
+            yield cell, cells[cell], ','.join(cells)
+
+    def _replay_legacy_history(self):
+        """Yields the moves of a pickled history, which also holds the boards
+        of the rejected moves: only boards adding one stone of the player to
+        move are kept"""
+        previous = ['-'] * (self.rows * self.cols)
+        piece = 'X'
+        for cells in self.history:
+            if len(cells) != len(previous):
+                continue
+            changed = [cell for cell in xrange(len(cells))
+                       if cells[cell] != previous[cell]]
+            if (len(changed) == 1 and previous[changed[0]] == '-' and
+                    cells[changed[0]] == piece):
+                previous = list(cells)
+                piece = 'O' if piece == 'X' else 'X'
+                yield changed[0], cells[changed[0]], ','.join(cells)
+
+    def turn_message(self, names):
+        """Returns the message telling whose turn it is"""
+        if self.moves % 2 == 0:
+            return 'It is player1 {} to make a move!'.format(names[self.user1])
+        else:
+            return 'It is player2 {} to make a move!'.format(names[self.user2])
+
+
+class Repository(object):
+    """Interface of the storage backends. Methods taking a user take its
+    key."""
+
+    def transaction(self, function, *args):
+        """Calls function(*args) in a transaction and returns its result.
+        Raises:
+            ConflictError: if a concurrent change made the transaction
+            fail. The caller may retry."""
+        raise NotImplementedError
+
+    def get_user(self, name):
+        """Returns the user with that name or None"""
+        raise NotImplementedError
+
+    def get_users(self, names):
+        """Returns a dict from name to user for the names found, resolved in
+        one batch"""
+        raise NotImplementedError
+
+    def get_users_async(self, names):
+        """Starts get_users and returns a future of its result, with a
+        get_result method. The *_async methods let the caller overlap
+        independent calls: a backend with asynchronous RPCs returns before
+        they are done, the others return a Done future."""
+        return Done(self.get_users(names))
+
+    def create_user(self, name, email):
+        """Creates and returns a user.
+        Raises:
+            ConflictError: if the name is taken. The name is claimed in the
+            transaction creating the user."""
+        raise NotImplementedError
+
+    def computer_user(self):
+        """Returns the user playing for the computer opponent"""
+        raise NotImplementedError
+
+    def computer_user_async(self):
+        return Done(self.computer_user())
+
+    def user_names(self, user_keys):
+        """Returns a dict from user key to name, resolved in one batch"""
+        raise NotImplementedError
+
+    def user_names_async(self, user_keys):
+        return Done(self.user_names(user_keys))
+
+    def new_game(self, user1, user2, difficulty, rows, cols, k):
+        """Creates and returns a game"""
+        raise NotImplementedError
+
+    def game_id(self, game):
+        """Returns the string identifying the game to the clients"""
+        raise NotImplementedError
+
+    def get_game(self, game_id):
+        """Returns the game or None.
+        Raises:
+            InvalidRequestError: if game_id is malformed."""
+        raise NotImplementedError
+
+    def save_game(self, game, ended=False):
+        """Writes the game. When ended is True the game just finished: its
+        scores, the stats, ratings and ranks of its users and the global
+        totals are written in the same transaction."""
+        raise NotImplementedError
+
+    def delete_game(self, game):
+        raise NotImplementedError
+
+    def finished_games_before(self, cutoff, limit):
+        """Returns up to limit finished games last moved before the cutoff
+        datetime, the oldest first"""
+        raise NotImplementedError
+
+    def archive_games(self, games, segment):
+        """Records the archive segment holding each game, then deletes the
+        games"""
+        raise NotImplementedError
+
+    def archived_segment(self, game_id):
+        """Returns the archive segment holding a deleted game, or None.
+        Raises:
+            InvalidRequestError: if game_id is malformed."""
+        raise NotImplementedError
+
+    def user_games(self, user, page_size, cursor, active=False):
+        """Returns a page of the games of a user, or of its games in progress
+        if active is True, the last moved first, and the cursor of the next
+        page or None if it is the last one"""
+        raise NotImplementedError
+
+    def scores(self, page_size, cursor):
+        """Returns a page of the scores, the most recent first, and the
+        cursor of the next page or None if it is the last one"""
+        raise NotImplementedError
+
+    def user_scores(self, user):
+        raise NotImplementedError
+
+    def user_stats(self, user):
+        """Returns the stats of a user, with wins, losses, games, ratio and
+        rating, or None if the user has not finished any game"""
+        raise NotImplementedError
+
+    def rank(self, rating):
+        """Returns 1 + the number of users with a higher rating bucket"""
+        raise NotImplementedError
+
+    def top_stats(self, limit):
+        """Returns the stats with the highest ratings, the highest first"""
+        raise NotImplementedError
+
+    def top_period_stats(self, period, bucket, limit):
+        """Returns the stats of a period bucket with the highest ratios, the
+        highest first. The stats of the users in one day, week or month are
+        rolled up when their games end, like the all time stats."""
+        raise NotImplementedError
+
+    def game_totals(self):
+        """Returns the GameTotals of the finished games"""
+        raise NotImplementedError
@@ -0,0 +1,90 @@
+"""test_archive.py - Unit tests of the archival of the finished games to a
+local blob store. Run with python -m unittest test_archive"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+import archive
+import pubsub
+import service
+import sqlite_storage
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.database = os.path.join(self.root, 'games.db')
+        self.repository = sqlite_storage.SqliteRepository(self.database)
+        self.archive = archive.Archive(
+            self.repository,
+            archive.LocalBlobStore(os.path.join(self.root, 'blobs')))
+        self.service = service.GameService(self.repository,
+                                           pubsub.LocalBroker(),
+                                           archive=self.archive)
+        self.service.create_user('alice', None)
+        self.service.create_user('bob', None)
+        self.segment_size = archive.SEGMENT_SIZE
+
+    def tearDown(self):
+        archive.SEGMENT_SIZE = self.segment_size
+        shutil.rmtree(self.root)
+
+    def play(self, positions):
+        """Returns the id of a new game played on positions"""
+        game, names = self.service.new_game('alice', 'bob')
+        game_id = self.repository.game_id(game)
+        for position in positions:
+            self.service.make_move(game_id, position=position)
+        return game_id
+
+    def backdate(self, game_ids, last_move):
+        connection = sqlite3.connect(self.database)
+        connection.executemany('UPDATE games SET last_move = ? WHERE id = ?',
+                               [(last_move, game_id) for game_id in game_ids])
+        connection.commit()
+        connection.close()
+
+    def history(self, game_id):
+        return list(self.service.game_history(game_id).replay())
+
+    def test_round_trip(self):
+        finished = [self.play([1, 4, 2, 5, 3]) for _ in xrange(3)]
+        running = self.play([1])
+        recent = self.play([5, 1, 9, 3, 2, 8, 4, 6, 7])
+        self.assertTrue(self.repository.get_game(recent).game_over)
+        histories = dict((game_id, self.history(game_id))
+                         for game_id in finished + [running, recent])
+        self.backdate(finished + [running], datetime(2000, 1, 1))
+
+        archive.SEGMENT_SIZE = 2
+        cutoff = datetime.now() - timedelta(days=archive.ARCHIVE_AFTER_DAYS)
+        today = datetime.now().date()
+        counts = [self.archive.archive_segment(
+            cutoff, archive.segment_name(today, page)) for page in xrange(3)]
+        self.assertEqual(counts, [2, 1, 0])
+
+        for game_id in finished:
+            self.assertIsNone(self.repository.get_game(game_id))
+            self.assertIsNotNone(self.repository.archived_segment(game_id))
+            game = self.service.game_history(game_id)
+            self.assertTrue(game.game_over and game.user1_won)
+        # the running game and the one finished lately stay in the store
+        for game_id in (running, recent):
+            self.assertIsNotNone(self.repository.get_game(game_id))
+            self.assertIsNone(self.repository.archived_segment(game_id))
+        for game_id, history in histories.items():
+            self.assertEqual(self.history(game_id), history)
+
+    def test_not_archived(self):
+        self.assertIsNone(self.archive.read_game('12345'))
+        with self.assertRaises(service.NotFoundError):
+            self.service.game_history('12345')
+
+
+if __name__ == '__main__':
+    unittest.main()
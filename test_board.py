@@ -0,0 +1,95 @@
+"""test_board.py - Unit tests of the bitboards, the board position strings
+and the table of the reachable positions. Run with
+python -m unittest test_board"""
+
+import unittest
+
+import board
+
+
+class BoardTest(unittest.TestCase):
+
+    def test_encode_decode(self):
+        position = 'X,O,-,-,X,-,-,-,O'
+        x, o = board.decode(position)
+        self.assertEqual((x, o), (0b000010001, 0b100000010))
+        self.assertEqual(board.encode(x, o), position)
+        self.assertEqual(board.decode(unicode(board.EMPTY_BOARD)), (0, 0))
+
+    def test_decode_invalid(self):
+        for position, message in (('X,O,-', board.INVALID_LENGTH),
+                                  ('X;O;-;-;-;-;-;-;-', board.INVALID_LENGTH),
+                                  ('X,O,-,-,A,-,-,-,-', board.INVALID_CHARS),
+                                  (u'X,O,-,-,\xe9,-,-,-,-',
+                                   board.INVALID_CHARS)):
+            with self.assertRaises(ValueError) as context:
+                board.decode(position)
+            self.assertEqual(context.exception.message, message)
+
+    def test_has_won(self):
+        for line in board.WIN_CONDITIONS:
+            x, o = board.decode(','.join(
+                board.X if cell in line else board.EMPTY
+                for cell in xrange(1, board.CELLS + 1)))
+            self.assertTrue(board.has_won(x))
+            self.assertFalse(board.has_won(o))
+        x, o = board.decode('X,X,O,O,O,X,X,X,O')
+        self.assertFalse(board.has_won(x) or board.has_won(o))
+
+    def test_is_full(self):
+        self.assertTrue(board.is_full(*board.decode('X,X,O,O,O,X,X,X,O')))
+        self.assertFalse(board.is_full(*board.decode('X,X,O,O,O,X,X,X,-')))
+        self.assertEqual(board.POPCOUNT[board.FULL_MASK], board.CELLS)
+
+
+    def test_legal_states(self):
+        self.assertEqual(sum(1 for flags in board.STATES if flags), 5478)
+
+    def test_final_states(self):
+        x_won = sum(1 for flags in board.STATES if flags & board.X_WON)
+        o_won = sum(1 for flags in board.STATES if flags & board.O_WON)
+        draws = sum(1 for flags in board.STATES if flags & board.DRAW)
+        self.assertEqual((x_won, o_won, draws), (626, 316, 16))
+        # no moves follow a finished game
+        self.assertTrue(all(not board.SUCCESSORS[board.index(x, o)]
+                            for x in xrange(1 << board.CELLS)
+                            for o in xrange(1 << board.CELLS)
+                            if board.outcome(x, o)))
+
+    def test_state(self):
+        self.assertEqual(board.state(0, 0), board.LEGAL)
+        self.assertEqual(board.state(1, 0), board.LEGAL | board.O_TO_MOVE)
+        # 'O' cannot move first
+        self.assertEqual(board.state(0, 1), 0)
+        # both players cannot hold a line
+        self.assertEqual(board.state(*board.decode('X,X,X,O,O,O,X,-,-')), 0)
+
+    def test_is_successor(self):
+        self.assertTrue(board.is_successor((0, 0), (1, 0)))
+        self.assertFalse(board.is_successor((0, 0), (0, 1)))
+        self.assertFalse(board.is_successor((0, 0), (3, 0)))
+        # a move after a win
+        won = board.decode('X,X,X,O,O,-,-,-,-')
+        self.assertFalse(board.is_successor(
+            won, board.decode('X,X,X,O,O,O,-,-,-')))
+
+    def test_play(self):
+        self.assertEqual(board.play((0, 0), 4), (1 << 4, 0))
+        self.assertEqual(board.play((1 << 4, 0), 0), (1 << 4, 1))
+        # the cell is taken
+        self.assertIsNone(board.play((1 << 4, 0), 4))
+        # the game is over
+        self.assertIsNone(board.play(board.decode('X,X,X,O,O,-,-,-,-'), 8))
+
+    def test_outcome(self):
+        self.assertEqual(board.outcome(*board.decode('X,X,X,O,O,-,-,-,-')),
+                         board.X_WON)
+        self.assertEqual(board.outcome(*board.decode('X,X,-,O,O,O,X,-,-')),
+                         board.O_WON)
+        self.assertEqual(board.outcome(*board.decode('X,O,X,X,O,O,O,X,X')),
+                         board.DRAW)
+        self.assertEqual(board.outcome(0, 0), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+"""test_counters.py - Unit tests of the sharded counters. Run with
+python runner.py <App Engine SDK path> test_counters"""
+
+import random
+
+from google.appengine.ext import ndb
+
+import counters
+import testing
+
+
+class CountersTest(testing.TestbedTestCase):
+
+    def setUp(self):
+        super(CountersTest, self).setUp()
+        random.seed(0)
+
+    def test_increment(self):
+        for moves in xrange(1, 31):
+            counters.increment({counters.FINISHED_GAMES: 1,
+                                counters.TOTAL_MOVES: moves})
+        self.assertEqual(
+            counters.get_counts([counters.FINISHED_GAMES,
+                                 counters.TOTAL_MOVES, counters.DRAWS]),
+            {counters.FINISHED_GAMES: 30, counters.TOTAL_MOVES: 465,
+             counters.DRAWS: 0})
+
+    def test_increments_are_spread_over_the_shards(self):
+        for _ in xrange(100):
+            counters.increment({counters.X_WINS: 1})
+        shards = counters.CounterShard.query().fetch()
+        self.assertTrue(1 < len(shards) <= counters.NUM_SHARDS)
+        self.assertEqual(sum(shard.count for shard in shards), 100)
+
+    def test_joins_the_transaction(self):
+        counters.increment({counters.O_WINS: 1})
+
+        def end_game():
+            counters.increment({counters.O_WINS: 1})
+            raise ndb.Rollback()
+        ndb.transaction(end_game, xg=True)
+        self.assertEqual(counters.get_counts([counters.O_WINS]),
+                         {counters.O_WINS: 1})
@@ -0,0 +1,65 @@
+"""test_elo.py - Unit tests of the Elo ratings. Run with
+python -m unittest test_elo"""
+
+import unittest
+from datetime import date, datetime
+
+import elo
+from sqlite_storage import Score
+
+
+def score(key, user, opponent, won, lost=None, day=date(2016, 3, 21),
+          time=None):
+    return Score(key=key, user=user, opponent=opponent, won=won,
+                 lost=not won if lost is None else lost, date=day, time=time)
+
+
+class EloTest(unittest.TestCase):
+
+    def test_expected_score(self):
+        self.assertEqual(elo.expected_score(1500, 1500), 0.5)
+        self.assertAlmostEqual(elo.expected_score(1500, 1900), 1 / 11.0)
+        for rating, opponent_rating in ((1500, 1700), (2100, 1234.5)):
+            self.assertAlmostEqual(
+                elo.expected_score(rating, opponent_rating) +
+                elo.expected_score(opponent_rating, rating), 1)
+
+    def test_rating_changes(self):
+        changes = elo.rating_changes({'alice': 1500, 'bob': 1900}, [
+            score(1, 'alice', 'bob', True), score(2, 'bob', 'alice', False),
+            score(3, 'carol', 'dave', False, False)])
+        self.assertAlmostEqual(changes[0], 32 * 10 / 11.0)
+        self.assertAlmostEqual(changes[1], -changes[0])
+        # a draw between two users at the initial rating
+        self.assertEqual(changes[2], 0)
+
+    def test_games_of_a_time_are_rated_together(self):
+        time = datetime(2016, 3, 21, 12)
+        ratings = elo.replay([score(1, 'alice', 'bob', True, time=time),
+                              score(2, 'bob', 'alice', False, time=time)],
+                             {})
+        self.assertEqual(ratings, {'alice': 1516, 'bob': 1484})
+
+    def test_chronological_order(self):
+        scores = [score(3, 'alice', 'bob', True,
+                        time=datetime(2016, 3, 21, 12)),
+                  score(2, 'alice', 'bob', True,
+                        time=datetime(2016, 3, 21, 11)),
+                  score(1, 'alice', 'bob', True, day=date(2016, 3, 22))]
+        self.assertEqual([s.key for s in sorted(scores,
+                                                key=elo.chronological)],
+                         [2, 3, 1])
+        ratings = elo.replay(sorted(scores, key=elo.chronological), {})
+        # each win is against bob at the initial rating, and is worth less
+        # as alice's rating grows
+        self.assertTrue(1500 + 3 * 14 < ratings['alice'] < 1500 + 3 * 16)
+
+    def test_scores_without_time(self):
+        # the scores of a day recorded without a time are rated together
+        ratings = elo.replay([score(1, 'alice', None, True),
+                              score(2, 'alice', None, True)], {})
+        self.assertEqual(ratings, {'alice': 1532})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,439 @@
+"""test_endpoints.py - Unit tests calling the endpoints of TrisApi on the
+testbed. Run with python runner.py <App Engine SDK path> test_endpoints"""
+
+import threading
+from datetime import date, timedelta
+
+import endpoints
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+# sets the version of the app read by api.py at import
+import testing
+import api
+import counters
+import service
+import storage
+from models import Score, User, UserName, UserStats
+
+
+def request(container, **fields):
+    """Returns the request message of an endpoints.ResourceContainer"""
+    return container.combined_message_class(**fields)
+
+
+def concurrent_request(function, times=1):
+    """Adds a datastore hook running function in another thread, standing
+    in for a concurrent request, before the next times transactions of this
+    thread commit"""
+    remaining = [times]
+    current = threading.current_thread()
+
+    def hook(service_name, call, request, response):
+        if (call == 'Commit' and remaining[0] and
+                threading.current_thread() is current):
+            remaining[0] -= 1
+            thread = threading.Thread(target=function)
+            thread.start()
+            thread.join()
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'concurrent_request', hook, 'datastore_v3')
+
+
+class EndpointsTestCase(testing.TestbedTestCase):
+
+    def setUp(self):
+        super(EndpointsTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub()
+        self.retry_delay = service.MOVE_RETRY_DELAY
+        service.MOVE_RETRY_DELAY = 0
+        self.api = api.TrisApi()
+        for name in ('alice', 'bob'):
+            self.create_user(name)
+
+    def tearDown(self):
+        service.MOVE_RETRY_DELAY = self.retry_delay
+        super(EndpointsTestCase, self).tearDown()
+
+    def create_user(self, name):
+        self.api.create_user(request(api.USER_REQUEST, user_name=name))
+        return User.query(User.name == name).get()
+
+    def new_game(self, user_name1='alice', user_name2='bob', **fields):
+        return self.api.new_game(request(
+            api.NEW_GAME_REQUEST, user_name1=user_name1,
+            user_name2=user_name2, **fields)).urlsafe_key
+
+    def make_move(self, urlsafe_key, **fields):
+        return self.api.make_move(request(
+            api.MAKE_MOVE_REQUEST, urlsafe_game_key=urlsafe_key, **fields))
+
+    def pages(self, method, container, page_size, **fields):
+        """Returns all the pages of an endpoint, following next_cursor"""
+        pages = []
+        cursor = None
+        while True:
+            response = method(request(container, page_size=page_size,
+                                      cursor=cursor, **fields))
+            pages.append(response)
+            cursor = response.next_cursor
+            if not cursor:
+                return pages
+
+
+class PagingTest(EndpointsTestCase):
+
+    def test_scores(self):
+        today = date.today()
+        scores = [Score(user=self.create_user('player{}'.format(number)).key,
+                        date=today - timedelta(days=number % 3), won=True,
+                        lost=False)
+                  for number in xrange(7)]
+        for score in scores:
+            score.put()
+        pages = self.pages(self.api.get_scores, api.SCORES_REQUEST, 3)
+        self.assertEqual([len(page.items) for page in pages], [3, 3, 1])
+        # the most recent first, then in key order
+        expected = sorted(scores, key=lambda score: (
+            -score.date.toordinal(), score.key.id()))
+        self.assertEqual([form.user_name for page in pages
+                          for form in page.items],
+                         [score.user.get().name for score in expected])
+
+    def test_user_games(self):
+        self.create_user('carol')
+        keys = [self.new_game() for _ in xrange(3)]
+        keys += [self.new_game('carol', 'alice') for _ in xrange(2)]
+        self.new_game('bob', 'carol')
+        self.make_move(keys[1], position=5)
+        pages = self.pages(self.api.get_user_games, api.USER_GAMES_REQUEST,
+                           2, user_name='alice')
+        self.assertEqual([len(page.game_forms) for page in pages], [2, 2, 1])
+        # the games of alice as user1 and as user2, the last moved first
+        forms = [form for page in pages for form in page.game_forms]
+        self.assertEqual([form.urlsafe_key for form in forms],
+                         [keys[1]] + keys[:1:-1] + keys[:1])
+
+    def test_active_user_games(self):
+        keys = [self.new_game() for _ in xrange(3)]
+        for position in (1, 4, 2, 5, 3):
+            self.make_move(keys[1], position=position)
+        pages = self.pages(self.api.get_user_games, api.USER_GAMES_REQUEST,
+                           1, user_name='bob', active=True)
+        self.assertEqual([form.urlsafe_key for page in pages
+                          for form in page.game_forms], [keys[2], keys[0]])
+
+    def test_page_size(self):
+        user = User.query(User.name == 'alice').get()
+        ndb.put_multi([Score(user=user.key, date=date.today(), won=True,
+                             lost=False) for _ in xrange(101)])
+        response = self.api.get_scores(request(api.SCORES_REQUEST,
+                                               page_size=1000))
+        self.assertEqual(len(response.items), 100)
+        self.assertTrue(response.next_cursor)
+        self.assertEqual(len(self.api.get_scores(request(
+            api.SCORES_REQUEST)).items), 20)
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.get_scores(request(api.SCORES_REQUEST, page_size=0))
+
+    def test_invalid_cursor(self):
+        with self.assertRaises(endpoints.BadRequestException):
+            self.api.get_scores(request(api.SCORES_REQUEST,
+                                        cursor='not a cursor'))
+
+
+class MakeMoveTest(EndpointsTestCase):
+
+    def test_positions(self):
+        key = self.new_game()
+        for position in (1, 4, 2, 5):
+            form = self.make_move(key, position=position)
+        self.assertEqual(form.board_position, 'X,X,-,O,O,-,-,-,-')
+        self.assertFalse(form.game_over)
+        form = self.make_move(key, position=3)
+        self.assertTrue(form.game_over)
+        self.assertEqual(Score.query().count(), 2)
+        form = self.make_move(key, position=9)
+        self.assertEqual(form.message, 'Game finished! Player 1 Won')
+
+    def test_board_position_string(self):
+        key = self.new_game()
+        self.make_move(key, move='-,-,-,-,X,-,-,-,-')
+        form = self.make_move(key, move='O,-,-,-,X,-,-,-,-')
+        self.assertEqual(form.board_position, 'O,-,-,-,X,-,-,-,-')
+        # two stones at once
+        form = self.make_move(key, move='O,X,X,-,X,-,-,-,-')
+        self.assertEqual(form.board_position, 'O,-,-,-,X,-,-,-,-')
+
+    def test_stale_move_number(self):
+        key = self.new_game()
+        self.make_move(key, position=5, move_number=1)
+        form = self.make_move(key, position=1, move_number=1)
+        self.assertEqual(form.message,
+                         'The game has changed! The next move is number 2')
+        self.assertEqual(form.board_position, '-,-,-,-,X,-,-,-,-')
+
+    def test_invalid_moves(self):
+        key = self.new_game()
+        self.make_move(key, position=5)
+        for fields in ({'position': 10}, {'position': 0}, {'position': 5},
+                       {}):
+            form = self.make_move(key, **fields)
+            self.assertEqual(form.board_position, '-,-,-,-,X,-,-,-,-',
+                             form.message)
+
+    def test_computer_reply(self):
+        key = self.new_game(user_name2=None, difficulty='hard')
+        form = self.make_move(key, position=1)
+        # the only reply of perfect play to a corner is the center
+        self.assertEqual(form.board_position, 'X,-,-,-,O,-,-,-,-')
+
+    def test_mnk_board(self):
+        key = self.new_game(rows=5, cols=5, k=4)
+        for position in (1, 6, 2, 7, 3, 8):
+            self.make_move(key, position=position)
+        form = self.make_move(key, position=4)
+        self.assertTrue(form.game_over)
+        self.assertEqual(form.message, 'Player 1 won!')
+
+
+class MoveTransactionTest(EndpointsTestCase):
+
+    def test_versions(self):
+        key = self.new_game()
+        form = self.make_move(key, position=5, version=0)
+        self.assertEqual(form.version, 1)
+        form = self.make_move(key, position=1, version=0)
+        self.assertEqual(form.message,
+                         'The game has changed! It is at version 1')
+        self.assertEqual((form.board_position, form.version),
+                         ('-,-,-,-,X,-,-,-,-', 1))
+        # a rejected move keeps the version
+        form = self.make_move(key, position=5, version=1)
+        self.assertEqual(form.version, 1)
+
+    def test_finished_game(self):
+        key = self.new_game()
+        for position in (1, 4, 2, 5, 3):
+            form = self.make_move(key, position=position)
+        self.assertTrue(form.game_over)
+        self.assertEqual(Score.query().count(), 2)
+        self.assertEqual(counters.get_counts([counters.FINISHED_GAMES]),
+                         {counters.FINISHED_GAMES: 1})
+        tasks = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME). \
+            get_filtered_tasks(url='/tasks/cache_average_moves_per_game')
+        self.assertEqual(len(tasks), 1)
+
+    def test_game_changed_during_the_move(self):
+        key = self.new_game()
+        concurrent_request(lambda: self.make_move(key, position=1))
+        form = self.make_move(key, position=5)
+        # the move was played again on the game moved by the other request
+        self.assertEqual((form.board_position, form.version),
+                         ('X,-,-,-,O,-,-,-,-', 2))
+
+    def test_game_changed_during_a_versioned_move(self):
+        key = self.new_game()
+        concurrent_request(lambda: self.make_move(key, position=1))
+        form = self.make_move(key, position=5, version=0)
+        self.assertEqual(form.message,
+                         'The game has changed! It is at version 1')
+        self.assertEqual(form.board_position, 'X,-,-,-,-,-,-,-,-')
+
+    def test_too_busy_game(self):
+        key = self.new_game()
+        game_key = ndb.Key(urlsafe=key)
+        concurrent_request(lambda: game_key.get().put(),
+                           service.MOVE_ATTEMPTS)
+        with self.assertRaises(endpoints.ConflictException):
+            self.make_move(key, position=5)
+        self.assertEqual(game_key.get().version, 0)
+
+
+class GetGameTest(EndpointsTestCase):
+
+    def get_game(self, urlsafe_key, version=None):
+        return self.api.get_game(request(
+            api.POLL_GAME_REQUEST, urlsafe_game_key=urlsafe_key,
+            version=version))
+
+    def test_not_modified(self):
+        key = self.new_game()
+        self.assertEqual(self.get_game(key).version, 0)
+        form = self.get_game(key, 0)
+        self.assertTrue(form.not_modified)
+        self.assertEqual((form.urlsafe_key, form.version,
+                          form.board_position), (key, 0, None))
+        self.make_move(key, position=5)
+        form = self.get_game(key, 0)
+        self.assertFalse(form.not_modified)
+        self.assertEqual((form.board_position, form.version),
+                         ('-,-,-,-,X,-,-,-,-', 1))
+
+    def test_cached_version(self):
+        key = self.new_game()
+        self.make_move(key, position=5)
+        # the cached version answers without reading the game
+        ndb.Key(urlsafe=key).delete()
+        self.assertTrue(self.get_game(key, 1).not_modified)
+
+    def test_cache_miss(self):
+        key = self.new_game()
+        self.make_move(key, position=5)
+        memcache.flush_all()
+        self.assertTrue(self.get_game(key, 1).not_modified)
+        self.assertEqual(
+            memcache.get(api.MEMCACHE_GAME_VERSION.format(key)), 1)
+
+    def test_cancel_game(self):
+        key = self.new_game()
+        self.get_game(key)
+        self.api.cancel_game(request(api.GET_GAME_REQUEST,
+                                     urlsafe_game_key=key))
+        with self.assertRaises(endpoints.NotFoundException):
+            self.get_game(key, 0)
+
+
+class WaitForMoveTest(EndpointsTestCase):
+
+    def wait_for_move(self, urlsafe_key, version=None, timeout=None):
+        return self.api.wait_for_move(request(
+            api.WAIT_GAME_REQUEST, urlsafe_game_key=urlsafe_key,
+            version=version, timeout=timeout))
+
+    def test_opponent_move(self):
+        key = self.new_game()
+        self.make_move(key, position=5)
+        # the waiting request starts with an empty context cache
+        ndb.get_context().clear_cache()
+        thread = threading.Timer(
+            0.05, lambda: self.make_move(key, position=1))
+        thread.start()
+        form = self.wait_for_move(key, 1, 5)
+        thread.join()
+        self.assertEqual((form.board_position, form.version),
+                         ('O,-,-,-,X,-,-,-,-', 2))
+
+    def test_already_moved(self):
+        key = self.new_game()
+        self.make_move(key, position=5)
+        self.assertEqual(self.wait_for_move(key, 0, 5).version, 1)
+
+    def test_timeout(self):
+        key = self.new_game()
+        self.make_move(key, position=5)
+        form = self.wait_for_move(key, 1, 1)
+        self.assertTrue(form.not_modified)
+        self.assertEqual(form.version, 1)
+
+    def test_version_required(self):
+        key = self.new_game()
+        with self.assertRaises(endpoints.BadRequestException):
+            self.wait_for_move(key)
+
+
+class MetricsTest(EndpointsTestCase):
+
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        # api.py added its hook to the apiproxy replaced by the testbed
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'metrics', api._count_rpc)
+
+    def get_game_metrics(self):
+        response = self.api.get_metrics(request(api.METRICS_REQUEST))
+        for item in response.endpoints:
+            if item.endpoint == 'get_game':
+                return item
+
+    def test_get_game(self):
+        key = self.new_game()
+        before = self.get_game_metrics()
+        calls, client_errors = (before.calls, before.client_errors) \
+            if before else (0, 0)
+        self.api.get_game(request(api.POLL_GAME_REQUEST,
+                                  urlsafe_game_key=key))
+        self.api.get_game(request(api.POLL_GAME_REQUEST,
+                                  urlsafe_game_key=key, version=0))
+        ndb.Key(urlsafe=key).delete()
+        memcache.flush_all()
+        with self.assertRaises(endpoints.NotFoundException):
+            self.api.get_game(request(api.POLL_GAME_REQUEST,
+                                      urlsafe_game_key=key))
+        after = self.get_game_metrics()
+        # the not modified poll is not an error
+        self.assertEqual((after.calls - calls,
+                          after.client_errors - client_errors, after.errors),
+                         (3, 1, 0))
+        # the published versions are read from memcache
+        self.assertIn('memcache.Get', [rpc.name for rpc in after.rpcs])
+        self.assertTrue(after.memcache_hits)
+
+
+class LeaderboardTest(EndpointsTestCase):
+
+    def leaderboard(self, **fields):
+        return [(item.user_name, item.rank, item.net_win_ratio)
+                for item in self.api.get_leaderboard(request(
+                    api.LEADERBOARD_REQUEST, **fields)).items]
+
+    def test_periods(self):
+        key = self.new_game()
+        for position in (1, 4, 2, 5, 3):
+            self.make_move(key, position=position)
+        expected = [('alice', 1, 1.0), ('bob', 2, -1.0)]
+        self.assertEqual(self.leaderboard(), expected)
+        for period in storage.PERIODS:
+            self.assertEqual(self.leaderboard(period=period), expected)
+        yesterday = date.today() - timedelta(days=1)
+        self.assertEqual(self.leaderboard(period=storage.DAY,
+                                          date=yesterday.isoformat()), [])
+
+    def test_computer_games(self):
+        key = self.new_game(user_name2=None, difficulty='hard')
+        form = self.make_move(key, position=5)
+        while not form.game_over:
+            cell = form.board_position.split(',').index('-')
+            form = self.make_move(key, position=cell + 1)
+        # the Computer is not ranked
+        self.assertEqual([item.user_name for item in self.api.get_leaderboard(
+            request(api.LEADERBOARD_REQUEST)).items], ['alice'])
+        self.assertIsNone(UserStats.get_by_id(User.computer_key().id()))
+
+    def test_user_rankings(self):
+        self.create_user('carol')
+        for user_name2 in ('bob', 'carol'):
+            key = self.new_game(user_name2=user_name2)
+            for position in (1, 4, 2, 5, 3):
+                self.make_move(key, position=position)
+        # carol lost to a higher rated alice, and lost fewer points
+        self.assertEqual(
+            [self.api.get_user_rankings(request(
+                api.USER_REQUEST, user_name=name)).rank
+             for name in ('alice', 'bob', 'carol')], [1, 3, 2])
+
+    def test_bad_requests(self):
+        for fields in ({'period': 'year'},
+                       {'period': storage.DAY, 'date': '18/10/2016'}):
+            with self.assertRaises(endpoints.BadRequestException):
+                self.leaderboard(**fields)
+
+
+class CreateUserTest(EndpointsTestCase):
+
+    def test_taken_name(self):
+        with self.assertRaises(endpoints.ConflictException):
+            self.create_user('alice')
+        self.assertEqual(User.query(User.name == 'alice').count(), 1)
+
+    def test_reserved_computer_name(self):
+        with self.assertRaises(endpoints.ConflictException):
+            self.create_user(storage.COMPUTER_NAME)
+        # also once the Computer played
+        self.new_game(user_name2=None, difficulty='easy')
+        with self.assertRaises(endpoints.ConflictException):
+            self.create_user(storage.COMPUTER_NAME)
+        self.assertEqual(UserName.key_for(storage.COMPUTER_NAME).get().user,
+                         User.computer_key())
@@ -0,0 +1,270 @@
+"""test_main.py - Unit tests of the cron and task queue handlers, run on the
+testbed. Run with python runner.py <App Engine SDK path> test_main"""
+
+import shutil
+import tempfile
+from datetime import date, datetime, timedelta
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+# sets the version of the app read by api.py at import
+import testing
+import api
+import archive
+import elo
+import main
+import storage
+from models import Game, PeriodStats, RatingIndexShard, ReplayedRating,\
+    Score, User, UserName, UserStats, replay_ratings_day
+
+
+class HandlersTestCase(testing.TestbedTestCase):
+
+    def setUp(self):
+        super(HandlersTestCase, self).setUp()
+        self.testbed.init_taskqueue_stub()
+        self.taskqueue = self.testbed.get_stub(
+            testbed.TASKQUEUE_SERVICE_NAME)
+        self.page_size = main.BACKFILL_PAGE_SIZE
+
+    def tearDown(self):
+        main.BACKFILL_PAGE_SIZE = self.page_size
+        super(HandlersTestCase, self).tearDown()
+
+    def get(self, url):
+        response = main.app.get_response(url)
+        self.assertEqual(response.status_int // 100, 2)
+
+    def run_tasks(self):
+        """Runs the queued tasks, and the ones they queue, until the queue
+        is empty. Returns the names of the tasks run."""
+        names = []
+        while True:
+            tasks = self.taskqueue.get_filtered_tasks()
+            if not tasks:
+                return names
+            for task in tasks:
+                self.taskqueue.DeleteTask('default', task.name)
+                response = main.app.get_response(
+                    task.url, method=task.method, POST=task.payload)
+                self.assertEqual(response.status_int // 100, 2)
+                names.append(task.name)
+
+
+class CompactLeaderboardsTest(HandlersTestCase):
+
+    def add_period_stats(self, period, day, count):
+        """Adds the PeriodStats of count users in the bucket holding day"""
+        bucket = storage.period_bucket(period, day)
+        for number in xrange(count):
+            user = User(name='{}{}{}'.format(period, bucket, number)).put()
+            PeriodStats(key=PeriodStats.key_for(user, period, bucket),
+                        period=period, bucket=bucket, user=user).put()
+
+    def buckets(self):
+        return sorted(set((stats.period, stats.bucket)
+                          for stats in PeriodStats.query()))
+
+    def test_compaction(self):
+        main.BACKFILL_PAGE_SIZE = 2
+        today = date.today()
+        old = today - timedelta(days=3 * 366)
+        for period in storage.PERIODS:
+            self.add_period_stats(period, old, 5)
+            self.add_period_stats(period, today, 1)
+        self.get('/crons/compact_leaderboards')
+        names = self.run_tasks()
+        # the 5 old stats of each period are deleted in pages of 2
+        self.assertEqual(len(names), 3 * len(storage.PERIODS))
+        self.assertEqual(self.buckets(), sorted(
+            (period, storage.period_bucket(period, today))
+            for period in storage.PERIODS))
+
+
+    def test_task_names_of_each_day(self):
+        main.BACKFILL_PAGE_SIZE = 2
+        days = [date(2015, 9, 29), date(2015, 9, 30)]
+        old = days[0] - timedelta(days=3 * 366)
+        names = []
+        main_date = main.date
+        try:
+            for day in days:
+                # the same week and month buckets are kept on both days
+                main.date = type('date', (date,), {
+                    'today': classmethod(lambda cls, day=day: day)})
+                for period in storage.PERIODS:
+                    self.add_period_stats(period, old, 3)
+                self.get('/crons/compact_leaderboards')
+                names.extend(self.run_tasks())
+                self.assertEqual(self.buckets(), [])
+        finally:
+            main.date = main_date
+        # a task name cannot be reused, even once the task has run
+        self.assertEqual(len(set(names)), len(names))
+        self.assertEqual(len(names), 2 * 2 * len(storage.PERIODS))
+
+
+class BackfillUserNamesTest(HandlersTestCase):
+
+    def test_backfill(self):
+        main.BACKFILL_PAGE_SIZE = 2
+        users = [User(name=name) for name in ('alice', 'bob', 'carol',
+                                              'alice')]
+        ndb.put_multi(users)
+        taskqueue.add(url='/tasks/backfill_user_names')
+        self.run_tasks()
+        # of the two alices, the first in key order keeps the name
+        self.assertEqual(
+            dict((entry.key.id(), entry.user) for entry in UserName.query()),
+            {'alice': min(users[0].key, users[3].key), 'bob': users[1].key,
+             'carol': users[2].key})
+
+
+class BackfillGamePlayersTest(HandlersTestCase):
+
+    def test_backfill(self):
+        main.BACKFILL_PAGE_SIZE = 2
+        alice, bob = User(name='alice').put(), User(name='bob').put()
+        games = [Game(user1=alice, user2=bob,
+                      board_position=','.join('-' * 9))
+                 for _ in xrange(3)]
+        games.append(Game.new_game(alice, bob))
+        ndb.put_multi(games[:3])
+        taskqueue.add(url='/tasks/backfill_game_players')
+        self.run_tasks()
+        self.assertEqual(Game.query(Game.players == bob).count(), 4)
+        # the games without a last move come last
+        self.assertEqual(Game.query(Game.players == alice).order(
+            -Game.last_move).get().key, games[3].key)
+
+
+class ArchiveGamesTest(HandlersTestCase):
+
+    def setUp(self):
+        super(ArchiveGamesTest, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.blob_store = api.ARCHIVE.blob_store
+        api.ARCHIVE.blob_store = archive.LocalBlobStore(self.root)
+        self.segment_size = archive.SEGMENT_SIZE
+
+    def tearDown(self):
+        archive.SEGMENT_SIZE = self.segment_size
+        api.ARCHIVE.blob_store = self.blob_store
+        shutil.rmtree(self.root)
+        super(ArchiveGamesTest, self).tearDown()
+
+    def test_archive(self):
+        archive.SEGMENT_SIZE = 2
+        alice, bob = User(name='alice').put(), User(name='bob').put()
+        old = datetime.now() - timedelta(days=archive.ARCHIVE_AFTER_DAYS + 1)
+        games = [Game.new_game(alice, bob) for _ in xrange(5)]
+        for game in games[:3]:
+            game.game_over = game.user1_won = True
+            game.last_move = old
+        # in progress
+        games[3].last_move = old
+        ndb.put_multi(games)
+        self.get('/crons/archive_games')
+        # a full segment of 2 games, then the last game
+        self.assertEqual(len(self.run_tasks()), 2)
+        self.assertEqual(Game.query().count(), 2)
+        for game in games[:3]:
+            archived = api.SERVICE.game_history(game.key.urlsafe())
+            self.assertEqual((archived.user1, archived.game_over,
+                              archived.user1_won), ('alice', True, True))
+
+
+    def test_cutoff_without_microseconds(self):
+        alice, bob = User(name='alice').put(), User(name='bob').put()
+        game = Game.new_game(alice, bob)
+        game.game_over = True
+        game.last_move = datetime(2015, 6, 1)
+        game.put()
+        response = main.app.get_response(
+            '/tasks/archive_games', method='POST',
+            POST={'cutoff': datetime(2015, 7, 1).strftime(main.TASK_TIME),
+                  'day': '2015-09-29', 'page': '0'})
+        self.assertEqual(response.status_int, 204)
+        self.assertIsNone(game.key.get())
+        self.assertEqual(api.SERVICE.game_history(game.key.urlsafe()).user1,
+                         'alice')
+
+
+class RemoveComputerStatsTest(HandlersTestCase):
+
+    def test_remove(self):
+        alice = User(name='alice').put()
+        computer = User.computer_key()
+        shard = RatingIndexShard.random_shard()
+        for user, rating in ((alice, 1500.0), (computer, 1600.0)):
+            stats = UserStats(key=UserStats.key_for(user), user=user,
+                              rating=rating)
+            stats.put()
+            PeriodStats(key=PeriodStats.key_for(user, storage.DAY,
+                                                '2016-03-21'),
+                        period=storage.DAY, bucket='2016-03-21',
+                        user=user).put()
+            shard.add(storage.rating_bucket(rating), 1)
+        shard.put()
+        self.assertEqual(RatingIndexShard.rank(1550), 2)
+        self.assertEqual(main.app.get_response(
+            '/tasks/remove_computer_stats', method='POST').status_int, 204)
+        self.assertEqual(RatingIndexShard.rank(1550), 1)
+        self.assertEqual([stats.user for stats in UserStats.query()],
+                         [alice])
+        self.assertEqual([stats.user for stats in PeriodStats.query()],
+                         [alice])
+
+
+class RecomputeRatingsTest(HandlersTestCase):
+
+    def test_recompute(self):
+        main.BACKFILL_PAGE_SIZE = 2
+        users = [User(name=name).put() for name in ('alice', 'bob', 'carol',
+                                                    'dave')]
+        computer = User(key=User.computer_key(), name='Computer').put()
+        ndb.put_multi([UserStats(key=UserStats.key_for(user), user=user)
+                       for user in users])
+        start = datetime(2016, 3, 21, 12)
+        scores = []
+        for number, (winner, loser) in enumerate(
+                [(0, 1), (1, 2), (0, 2), (2, 1), (3, 0), (0, 4), (1, 0)]):
+            time = start + timedelta(hours=number * 10)
+            players = [users[index] if index < len(users) else computer
+                       for index in (winner, loser)]
+            for user, opponent, won in ((players[0], players[1], True),
+                                        (players[1], players[0], False)):
+                scores.append(Score(user=user, opponent=opponent,
+                                    date=time.date(), time=time, won=won,
+                                    lost=not won))
+        ndb.put_multi(scores)
+        expected = elo.replay(
+            sorted([score for score in scores
+                    if computer not in (score.user, score.opponent)],
+                   key=elo.chronological), {})
+
+        self.assertEqual(main.app.get_response(
+            '/tasks/recompute_ratings', method='POST').status_int, 204)
+        names = self.run_tasks()
+        # a task for each of the 4 days, then 2 pages of UserStats
+        self.assertEqual(len(names), 6)
+        for stats in UserStats.query():
+            self.assertAlmostEqual(stats.rating, expected[stats.user])
+        self.assertEqual(ReplayedRating.query().count(), 0)
+        self.assertEqual(RatingIndexShard.rank(max(expected.values())), 1)
+        self.assertEqual(RatingIndexShard.rank(min(expected.values())), 4)
+
+    def test_retried_day(self):
+        alice, bob = User(name='alice').put(), User(name='bob').put()
+        day = date(2016, 3, 21)
+        ndb.put_multi([Score(user=user, opponent=opponent, date=day,
+                             time=datetime(2016, 3, 21, 12), won=won,
+                             lost=not won)
+                       for user, opponent, won in ((alice, bob, True),
+                                                   (bob, alice, False))])
+        for _ in xrange(2):
+            replay_ratings_day('run', day)
+        self.assertEqual(
+            ReplayedRating.key_for('run', alice.id()).get().rating, 1516)
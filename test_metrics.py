@@ -0,0 +1,136 @@
+"""test_metrics.py - Unit tests of the latency histograms and the endpoint
+metrics. Run with python -m unittest test_metrics"""
+
+import httplib
+import unittest
+
+import metrics
+
+
+class Rng(object):
+    """Stands in for random, always drawing value"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def random(self):
+        return self.value
+
+
+class HttpError(Exception):
+
+    def __init__(self, http_status):
+        super(HttpError, self).__init__(http_status)
+        self.http_status = http_status
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_empty(self):
+        histogram = metrics.Histogram()
+        self.assertEqual((histogram.percentile(0.5), histogram.mean()),
+                         (0.0, 0.0))
+
+    def test_percentile(self):
+        histogram = metrics.Histogram()
+        for value in [0.5] * 50 + [3] * 40 + [150] * 9 + [40000]:
+            histogram.add(value)
+        self.assertEqual(histogram.counts[0], 50)
+        self.assertEqual(histogram.counts[-1], 1)
+        self.assertEqual(histogram.percentile(0.5), 1.0)
+        self.assertEqual(histogram.percentile(0.9), 5.0)
+        self.assertEqual(histogram.percentile(0.99), 200.0)
+        # beyond the last bound
+        self.assertEqual(histogram.percentile(1), 40000)
+        self.assertAlmostEqual(histogram.mean(),
+                               (25 + 120 + 1350 + 40000) / 100.0)
+
+    def test_bounds(self):
+        histogram = metrics.Histogram()
+        histogram.add(1)
+        histogram.add(1.5)
+        self.assertEqual(histogram.counts[:2], [1, 1])
+        # capped by the largest value
+        self.assertEqual(histogram.percentile(1), 1.5)
+
+
+class RegistryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = metrics.Registry(slow_request_ms=0, rng=Rng(0))
+
+    def call(self, status=None, rpcs=()):
+        """Calls an instrumented endpoint named endpoint making rpcs, and
+        raising an error of status if any"""
+        @self.registry.instrument
+        def endpoint():
+            for rpc in rpcs:
+                self.registry.record_rpc(*rpc)
+            if status:
+                raise HttpError(status)
+        if status:
+            with self.assertRaises(HttpError):
+                endpoint()
+        else:
+            endpoint()
+
+    def test_errors(self):
+        self.call()
+        self.call(httplib.NOT_FOUND)
+        self.call(httplib.CONFLICT)
+        self.call(httplib.SERVICE_UNAVAILABLE)
+        self.call(httplib.NOT_MODIFIED)
+        endpoints, traces = self.registry.snapshot()
+        endpoint = endpoints['endpoint']
+        self.assertEqual((endpoint.latency.count, endpoint.errors,
+                          endpoint.client_errors), (5, 1, 2))
+
+    def test_rpcs(self):
+        self.call(rpcs=[('datastore_v3', 'Get'),
+                        ('memcache', 'Get', 2, 1),
+                        ('memcache', 'Get', 0, 3)])
+        self.call(rpcs=[('datastore_v3', 'Get')])
+        # outside of an endpoint call
+        self.registry.record_rpc('datastore_v3', 'Put')
+        endpoint = self.registry.snapshot()[0]['endpoint']
+        self.assertEqual(endpoint.rpcs, {'datastore_v3.Get': 2,
+                                         'memcache.Get': 2})
+        self.assertEqual((endpoint.memcache_hits, endpoint.memcache_misses),
+                         (2, 4))
+
+    def test_traces(self):
+        self.call(rpcs=[('datastore_v3', 'BeginTransaction'),
+                        ('datastore_v3', 'Commit')])
+        traces = self.registry.snapshot()[1]
+        self.assertEqual(len(traces), 1)
+        self.assertEqual(traces[0].endpoint, 'endpoint')
+        self.assertEqual([rpc for rpc, offset in traces[0].rpcs],
+                         ['datastore_v3.BeginTransaction',
+                          'datastore_v3.Commit'])
+
+    def test_sampled_traces(self):
+        registry = metrics.Registry(slow_request_ms=0, trace_sample_rate=0.2,
+                                    rng=Rng(0.5))
+        registry.instrument(lambda: None)()
+        self.assertEqual(registry.snapshot()[1], [])
+        # the slow calls only
+        registry = metrics.Registry(slow_request_ms=60000, rng=Rng(0))
+        registry.instrument(lambda: None)()
+        self.assertEqual(registry.snapshot()[1], [])
+
+    def test_max_traces(self):
+        registry = metrics.Registry(slow_request_ms=0, trace_sample_rate=1,
+                                    max_traces=3, rng=Rng(0))
+        for _ in xrange(5):
+            registry.instrument(lambda: None)()
+        self.assertEqual(len(registry.snapshot()[1]), 3)
+
+    def test_snapshot_is_a_copy(self):
+        self.call()
+        endpoints = self.registry.snapshot()[0]
+        endpoints['endpoint'].errors = 10
+        self.assertEqual(self.registry.snapshot()[0]['endpoint'].errors, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""test_mnk.py - Unit tests of the m,n,k board engine and its search. Run
+with python -m unittest test_mnk"""
+
+import unittest
+
+import board
+import mnk
+
+
+def position(rows, cols, k, stones):
+    """Returns the MNKBoard with the stones, a dict of cell to piece"""
+    cells = [stones.get(cell, mnk.EMPTY) for cell in xrange(rows * cols)]
+    return mnk.MNKBoard.from_string(','.join(cells), rows, cols, k)
+
+
+class ClockStub(object):
+    """A clock moving on by step seconds every time it is read"""
+
+    def __init__(self, step):
+        self.now = 0.0
+        self.step = step
+
+    def __call__(self):
+        self.now += self.step
+        return self.now
+
+
+class MNKBoardTest(unittest.TestCase):
+
+    def test_validate_size(self):
+        mnk.validate_size(15, 15, 5)
+        for rows, cols, k in ((2, 5, 3), (5, 20, 3), (5, 5, 2), (5, 5, 6)):
+            with self.assertRaises(ValueError):
+                mnk.validate_size(rows, cols, k)
+
+    def test_windows(self):
+        all_windows, by_cell = mnk.windows(3, 3, 3)
+        self.assertEqual(len(all_windows), len(board.WIN_CONDITIONS))
+        # the center is on both diagonals, a row and a column
+        self.assertEqual(len(by_cell[4]), 4)
+
+    def test_from_string(self):
+        game = position(5, 5, 4, {0: mnk.X, 6: mnk.O, 12: mnk.X})
+        self.assertEqual(game.to_move(), mnk.O)
+        self.assertEqual(mnk.MNKBoard.from_string(game.to_string(), 5, 5,
+                                                  4).cells, game.cells)
+        with self.assertRaises(ValueError):
+            mnk.MNKBoard.from_string('X,O,-', 5, 5, 4)
+        with self.assertRaises(ValueError):
+            mnk.MNKBoard.from_string(','.join('A' * 25), 5, 5, 4)
+
+    def test_wins(self):
+        lines = {'row': (5, 6, 7, 8), 'column': (1, 6, 11, 16),
+                 'diagonal': (0, 6, 12, 18), 'anti-diagonal': (4, 8, 12, 16)}
+        for name, line in lines.items():
+            game = mnk.MNKBoard(5, 5, 4)
+            for cell in line[:-1]:
+                self.assertFalse(game.place(cell, mnk.X), name)
+            self.assertEqual(game.outcome(), 0, name)
+            self.assertTrue(game.place(line[-1], mnk.X), name)
+            self.assertEqual(game.outcome(), board.X_WON, name)
+
+    def test_line_across_the_edge_does_not_win(self):
+        game = mnk.MNKBoard(5, 5, 4)
+        for cell in (3, 4, 5, 6):
+            self.assertFalse(game.place(cell, mnk.O))
+        self.assertEqual(game.outcome(), 0)
+
+    def test_remove(self):
+        game = mnk.MNKBoard(5, 5, 4)
+        for cell in (0, 1, 2, 3):
+            game.place(cell, mnk.O)
+        self.assertEqual(game.outcome(), board.O_WON)
+        game.remove(3)
+        self.assertEqual(game.outcome(), 0)
+        self.assertEqual(game.score, position(5, 5, 4, {
+            0: mnk.O, 1: mnk.O, 2: mnk.O}).score)
+
+    def test_draw(self):
+        game = mnk.MNKBoard.from_string('X,O,X,X,O,O,O,X,X', 3, 3, 3)
+        self.assertEqual(game.outcome(), board.DRAW)
+
+
+class SearchTest(unittest.TestCase):
+
+    def test_takes_the_win(self):
+        game = position(5, 5, 4, {5: mnk.X, 6: mnk.X, 7: mnk.X,
+                                  10: mnk.O, 11: mnk.O, 12: mnk.O})
+        self.assertEqual(mnk.search(game, 4, 5.0), 8)
+
+    def test_blocks_the_win(self):
+        game = position(5, 5, 4, {0: mnk.X, 6: mnk.O, 12: mnk.O, 18: mnk.O,
+                                  4: mnk.X, 20: mnk.X})
+        self.assertEqual(game.to_move(), mnk.X)
+        self.assertEqual(mnk.search(game, 3, 5.0), 24)
+
+    def test_restores_the_position(self):
+        game = position(7, 7, 4, {24: mnk.X, 25: mnk.O})
+        cells, score = list(game.cells), game.score
+        mnk.search(game, 3, 5.0)
+        self.assertEqual((game.cells, game.score), (cells, score))
+
+    def test_time_budget(self):
+        # the clock runs out long before depth 8, the move of the last
+        # completed iteration is returned
+        game = position(15, 15, 5, {112: mnk.X})
+        move = mnk.search(game, 8, 1.0, clock=ClockStub(0.1))
+        self.assertEqual(game.cells[move], mnk.EMPTY)
+
+    def test_game_over(self):
+        game = position(5, 5, 4, {0: mnk.X, 1: mnk.X, 2: mnk.X, 3: mnk.X,
+                                  5: mnk.O, 6: mnk.O, 7: mnk.O})
+        with self.assertRaises(ValueError):
+            mnk.search(game, 2, 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+"""test_models.py - Unit tests of the datastore models, run on the testbed.
+Run with python runner.py <App Engine SDK path> test_models"""
+
+import random
+
+from google.appengine.ext import ndb
+
+import models
+import testing
+from models import RATING_INDEX_SHARDS, RatingIndexShard, User, UserName
+
+
+class UserNameTest(testing.TestbedTestCase):
+
+    def test_create(self):
+        alice = User.create('alice', 'alice@example.com')
+        self.assertEqual(UserName.key_for('alice').get().user, alice.key)
+        self.assertIsNone(User.create('alice', None))
+        self.assertEqual(User.query().count(), 1)
+
+    def test_get_by_names(self):
+        alice = User.create('alice', None)
+        bob = User.create('bob', None)
+        self.assertEqual(User.get_by_names(['alice', 'bob', 'carol', None]),
+                         {'alice': alice, 'bob': bob})
+        self.assertEqual(User.get_by_names([]), {})
+
+    def test_users_before_the_index(self):
+        alice = User(name='alice')
+        alice.put()
+        # the name is taken even though it is not indexed yet
+        self.assertIsNone(User.create('alice', None))
+        self.assertEqual(User.get_by_names(['alice']), {'alice': alice})
+        self.assertEqual(UserName.key_for('alice').get().user, alice.key)
+
+    def test_legacy_names_turned_off(self):
+        User(name='alice').put()
+        models.LEGACY_USER_NAMES = False
+        try:
+            self.assertEqual(User.get_by_names(['alice']), {})
+            self.assertIsNotNone(User.create('alice', None))
+        finally:
+            models.LEGACY_USER_NAMES = True
+
+    def test_index(self):
+        alice = User(name='alice')
+        other = User(name='alice')
+        ndb.put_multi([alice, other])
+        self.assertTrue(UserName.index(alice))
+        self.assertTrue(UserName.index(alice))
+        # the name stays with the first User indexed
+        self.assertFalse(UserName.index(other))
+        self.assertEqual(UserName.key_for('alice').get().user, alice.key)
+
+
+class RatingIndexTest(testing.TestbedTestCase):
+
+    def test_rank(self):
+        random.seed(0)
+        for rating in [1400] * 30 + [1500] * 20 + [1600] * 10:
+            shard = RatingIndexShard.random_shard()
+            shard.add(rating, 1)
+            shard.put()
+        self.assertEqual(RatingIndexShard.query().count(),
+                         RATING_INDEX_SHARDS)
+        self.assertEqual([RatingIndexShard.rank(rating)
+                          for rating in (1700, 1600, 1550, 1500, 1400, 0)],
+                         [1, 1, 11, 11, 31, 61])
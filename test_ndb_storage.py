@@ -0,0 +1,107 @@
+"""test_ndb_storage.py - Unit tests of the datastore repository and of the
+Cloud Storage blob store of the archive, run on the testbed. Run with
+python runner.py <App Engine SDK path> test_ndb_storage"""
+
+import httplib
+from datetime import datetime, timedelta
+
+from google.appengine.api import app_identity
+from google.appengine.api import urlfetch
+
+import testing
+import ndb_storage
+from models import Game, User
+
+
+class Response(object):
+
+    def __init__(self, status_code, content=''):
+        self.status_code = status_code
+        self.content = content
+
+
+class FinishedGamesBeforeTest(testing.TestbedTestCase):
+
+    def test_games_of_unknown_age_are_kept(self):
+        alice, bob = User(name='alice').put(), User(name='bob').put()
+        now = datetime.now()
+        games = [Game.new_game(alice, bob) for _ in xrange(4)]
+        for game, days in zip(games, (3, 2, None, 2)):
+            game.game_over = True
+            game.last_move = days and now - timedelta(days=days)
+        # in progress
+        games[3].game_over = False
+        for game in games:
+            game.put()
+        self.assertEqual(
+            [game.key for game in ndb_storage.NdbRepository().
+             finished_games_before(now - timedelta(days=1), 10)],
+            [games[0].key, games[1].key])
+
+
+class CloudStorageBlobStoreTest(testing.TestbedTestCase):
+
+    def setUp(self):
+        super(CloudStorageBlobStoreTest, self).setUp()
+        self.testbed.init_app_identity_stub()
+        self.blobs = {}
+        self.urls = []
+        self.fetch = urlfetch.fetch
+        urlfetch.fetch = self.fake_fetch
+
+    def tearDown(self):
+        urlfetch.fetch = self.fetch
+        super(CloudStorageBlobStoreTest, self).tearDown()
+
+    def fake_fetch(self, url, payload=None, method=urlfetch.GET,
+                   headers=None, deadline=None):
+        self.assertTrue(headers['Authorization'].startswith('Bearer '))
+        self.urls.append(url)
+        if method == urlfetch.POST:
+            self.blobs[url.split('&name=')[1]] = payload
+            return Response(httplib.OK)
+        name = url.split('/o/')[1].split('?')[0]
+        if name not in self.blobs:
+            return Response(httplib.NOT_FOUND, 'No such object')
+        return Response(httplib.OK, self.blobs[name])
+
+    def test_write_read(self):
+        store = ndb_storage.CloudStorageBlobStore('tris-archive')
+        with store.writer('2015-10-01/0000') as blob:
+            blob.write('games')
+        self.assertEqual(store.reader('2015-10-01/0000').read(), 'games')
+        self.assertTrue(all('/b/tris-archive/o' in url for url in self.urls))
+        self.assertIn('name=2015-10-01%2F0000', self.urls[0])
+        with self.assertRaises(IOError):
+            store.reader('2015-10-02/0000')
+
+    def test_nothing_uploaded_on_error(self):
+        store = ndb_storage.CloudStorageBlobStore('tris-archive')
+        with self.assertRaises(ValueError):
+            with store.writer('2015-10-01/0000') as blob:
+                blob.write('games')
+                raise ValueError()
+        self.assertEqual(self.urls, [])
+
+    def test_default_bucket(self):
+        store = ndb_storage.CloudStorageBlobStore()
+        with store.writer('segment') as blob:
+            blob.write('games')
+        self.assertIn('/b/{}/o'.format(
+            app_identity.get_default_gcs_bucket_name()), self.urls[0])
+
+    def test_no_bucket(self):
+        get_default_gcs_bucket_name = app_identity.get_default_gcs_bucket_name
+        app_identity.get_default_gcs_bucket_name = lambda: None
+        try:
+            store = ndb_storage.CloudStorageBlobStore()
+            with self.assertRaises(IOError):
+                store.reader('segment')
+        finally:
+            app_identity.get_default_gcs_bucket_name = \
+                get_default_gcs_bucket_name
+        self.assertEqual(self.urls, [])
+
+    def test_built_without_requests(self):
+        self.testbed.init_app_identity_stub(enable=False)
+        ndb_storage.CloudStorageBlobStore()
@@ -0,0 +1,89 @@
+"""test_pubsub.py - Unit tests of the brokers of the game versions. Run with
+python runner.py <App Engine SDK path> test_pubsub"""
+
+import threading
+import time
+import unittest
+
+from google.appengine.api import memcache
+
+import pubsub
+import testing
+
+
+def publish_later(broker, channel, version, delay=0.05):
+    """Publishes version from another thread after delay seconds"""
+    thread = threading.Timer(delay, broker.publish, (channel, version))
+    thread.start()
+    return thread
+
+
+class LocalBrokerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.broker = pubsub.LocalBroker()
+
+    def test_publish(self):
+        self.assertIsNone(self.broker.latest('game'))
+        self.broker.publish('game', 2)
+        # versions only go up
+        self.broker.publish('game', 1)
+        self.assertEqual(self.broker.latest('game'), 2)
+        self.broker.publish('game', 3)
+        self.assertEqual(self.broker.latest('game'), 3)
+
+    def test_wait(self):
+        self.broker.publish('game', 0)
+        thread = publish_later(self.broker, 'game', 1)
+        self.assertEqual(self.broker.wait('game', 0, 5), 1)
+        thread.join()
+        # a newer version returns at once
+        self.assertEqual(self.broker.wait('game', -1, 0), 1)
+
+    def test_timeout(self):
+        self.broker.publish('game', 1)
+        start = time.time()
+        self.assertIsNone(self.broker.wait('game', 1, 0.1))
+        self.assertGreaterEqual(time.time() - start, 0.1)
+
+    def test_unknown_channel(self):
+        self.assertIsNone(self.broker.wait('game', 0, 5))
+
+    def test_discard_wakes_the_waiters(self):
+        self.broker.publish('game', 0)
+        thread = threading.Timer(0.05, self.broker.discard, ('game',))
+        thread.start()
+        start = time.time()
+        self.assertIsNone(self.broker.wait('game', 0, 5))
+        self.assertLess(time.time() - start, 5)
+        thread.join()
+        self.assertIsNone(self.broker.latest('game'))
+
+
+class MemcacheBrokerTest(testing.TestbedTestCase):
+
+    def setUp(self):
+        super(MemcacheBrokerTest, self).setUp()
+        self.broker = pubsub.MemcacheBroker(memcache.Client,
+                                            poll_interval=0.01)
+
+    def test_publish(self):
+        self.broker.publish('game', 2)
+        self.broker.publish('game', 1)
+        self.assertEqual(memcache.get('GAME_VERSION_game'), 2)
+        self.broker.publish('game', 3)
+        self.assertEqual(self.broker.latest('game'), 3)
+        self.broker.discard('game')
+        self.assertIsNone(self.broker.latest('game'))
+
+    def test_wait(self):
+        self.broker.publish('game', 0)
+        thread = publish_later(self.broker, 'game', 1)
+        self.assertEqual(self.broker.wait('game', 0, 5), 1)
+        thread.join()
+        self.assertIsNone(self.broker.wait('game', 1, 0.05))
+        self.assertIsNone(self.broker.wait('other game', 0, 5))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""test_recompute_ratings.py - Unit tests of the replay of the ratings of a
+SQLite database. Run with python -m unittest test_recompute_ratings"""
+
+import random
+import unittest
+from multiprocessing.dummy import Pool
+
+import elo
+import pubsub
+import recompute_ratings
+import service
+import sqlite_storage
+from sqlite_storage import Score
+
+
+class ComponentsTest(unittest.TestCase):
+
+    def test_components(self):
+        scores = [Score(key=key, user=user, opponent=opponent)
+                  for key, (user, opponent) in enumerate(
+                      [(1, 2), (2, 1), (3, 4), (4, 3), (2, 5), (5, 2),
+                       (6, None)])]
+        groups = recompute_ratings.components(scores)
+        self.assertEqual(sorted([s.key for s in group] for group in groups),
+                         [[0, 1, 4, 5], [2, 3], [6]])
+
+    def test_batches(self):
+        groups = [[0] * size for size in (5, 1, 4, 2, 3)]
+        batches = recompute_ratings.batches(groups, 2)
+        self.assertEqual(sorted(sum(map(len, batch)) for batch in batches),
+                         [7, 8])
+        # no empty batches
+        self.assertEqual(len(recompute_ratings.batches(groups[:1], 2)), 1)
+
+
+class RecomputeTest(unittest.TestCase):
+
+    def test_same_as_the_online_ratings(self):
+        repository = sqlite_storage.SqliteRepository()
+        game_service = service.GameService(repository, pubsub.LocalBroker())
+        names = ['player{}'.format(number) for number in xrange(8)]
+        for name in names:
+            game_service.create_user(name, None)
+        rng = random.Random(0)
+        for _ in xrange(30):
+            # two groups of players who never meet
+            group = rng.choice([names[:4], names[4:]])
+            user1, user2 = rng.sample(group, 2)
+            game, _ = game_service.new_game(user1, user2)
+            game_id = repository.game_id(game)
+            while not repository.get_game(game_id).game_over:
+                game = repository.get_game(game_id)
+                free = [cell + 1 for cell in xrange(9)
+                        if game.board_position.split(',')[cell] == '-']
+                game_service.make_move(game_id, position=rng.choice(free))
+        online = repository.ratings()
+        self.assertEqual(len(online), 8)
+        # the games moved the ratings
+        self.assertNotEqual(set(online.values()), {elo.INITIAL_RATING})
+
+        pool = Pool(2)
+        try:
+            ratings, report = recompute_ratings.recompute(repository, pool,
+                                                          2)
+        finally:
+            pool.close()
+            pool.join()
+        self.assertEqual(report['components'], 2)
+        self.assertEqual(report['scores'], 60)
+        self.assertEqual(sorted(ratings), sorted(online))
+        for user, rating in ratings.items():
+            self.assertAlmostEqual(rating, online[user])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,320 @@
+"""test_service.py - Unit tests of the game logic and the paging of the
+SQLite repository. Run with python -m unittest test_service"""
+
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import date, timedelta
+
+import pubsub
+import service
+import sqlite_storage
+import storage
+
+
+class ConflictingRepository(sqlite_storage.SqliteRepository):
+    """A repository whose transactions first call before, standing in for
+    a request changing the game at the same time"""
+
+    def __init__(self):
+        super(ConflictingRepository, self).__init__()
+        self.before = []
+
+    def transaction(self, function, *args):
+        if self.before:
+            self.before.pop(0)()
+        return super(ConflictingRepository, self).transaction(function,
+                                                              *args)
+
+
+def busy():
+    raise storage.ConflictError('database is locked')
+
+
+class ServiceTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.repository = ConflictingRepository()
+        self.delays = []
+        self.service = service.GameService(self.repository,
+                                           pubsub.LocalBroker(),
+                                           sleep=self.delays.append)
+        self.service.create_user('alice', None)
+        self.service.create_user('bob', None)
+
+    def new_game(self, **kwargs):
+        game, names = self.service.new_game('alice', 'bob', **kwargs)
+        return self.repository.game_id(game)
+
+
+class MakeMoveTest(ServiceTestCase):
+
+    def test_moves(self):
+        game_id = self.new_game()
+        game, message, names = self.service.make_move(game_id, position=5)
+        self.assertEqual((game.board_position, game.moves, game.version),
+                         ('-,-,-,-,X,-,-,-,-', 1, 1))
+        game, message, names = self.service.make_move(
+            game_id, move='O,-,-,-,X,-,-,-,-', version=1)
+        self.assertEqual(self.repository.get_game(game_id).version, 2)
+        self.assertEqual(list(game.move_log), [4, 0])
+
+    def test_win(self):
+        game_id = self.new_game()
+        for position in (1, 4, 2, 5):
+            self.service.make_move(game_id, position=position)
+        game, message, names = self.service.make_move(game_id, position=3)
+        self.assertTrue(game.game_over and game.user1_won)
+        game, message, names = self.service.make_move(game_id, position=9)
+        self.assertEqual(message, 'Game finished! Player 1 Won')
+        self.assertEqual(game.version, 5)
+        self.assertEqual(self.service.game_totals().finished_games, 1)
+
+    def test_stale_version(self):
+        game_id = self.new_game()
+        self.service.make_move(game_id, position=5)
+        game, message, names = self.service.make_move(game_id, position=1,
+                                                      version=0)
+        self.assertEqual(message, 'The game has changed! It is at version 1')
+        self.assertEqual(self.repository.get_game(game_id).moves, 1)
+
+    def test_invalid_moves(self):
+        game_id = self.new_game()
+        self.service.make_move(game_id, position=5)
+        for kwargs in ({'position': 10}, {'position': 0}, {}):
+            game, message, names = self.service.make_move(game_id, **kwargs)
+            self.assertEqual(game.version, 1, message)
+        with self.assertRaises(service.NotFoundError):
+            self.service.make_move('12345', position=1)
+
+    def test_game_changed_during_the_move(self):
+        game_id = self.new_game()
+        self.repository.before.append(
+            lambda: self.service.make_move(game_id, position=1))
+        game, message, names = self.service.make_move(game_id, position=5)
+        # the move was played again on the game moved by the other request
+        self.assertEqual(game.board_position, 'X,-,-,-,O,-,-,-,-')
+        self.assertEqual(self.repository.get_game(game_id).version, 2)
+        self.assertEqual(len(self.delays), 1)
+
+    def test_game_changed_during_a_versioned_move(self):
+        game_id = self.new_game()
+        self.repository.before.append(
+            lambda: self.service.make_move(game_id, position=1))
+        game, message, names = self.service.make_move(game_id, position=5,
+                                                      version=0)
+        self.assertEqual(message, 'The game has changed! It is at version 1')
+        self.assertEqual(self.repository.get_game(game_id).board_position,
+                         'X,-,-,-,-,-,-,-,-')
+
+    def test_busy_game(self):
+        game_id = self.new_game()
+        self.repository.before.extend([busy] * (service.MOVE_ATTEMPTS - 1))
+        self.service.make_move(game_id, position=5)
+        self.assertEqual(self.repository.get_game(game_id).version, 1)
+        self.assertEqual(len(self.delays), service.MOVE_ATTEMPTS - 1)
+        # the delays grow
+        self.assertTrue(self.delays[-1] > self.delays[0])
+
+    def test_too_busy_game(self):
+        game_id = self.new_game()
+        self.repository.before.extend([busy] * service.MOVE_ATTEMPTS)
+        with self.assertRaises(service.ConflictError):
+            self.service.make_move(game_id, position=5)
+        self.assertEqual(self.repository.get_game(game_id).version, 0)
+
+    def test_computer_reply(self):
+        game, names = self.service.new_game('alice', None,
+                                            difficulty='hard')
+        game_id = self.repository.game_id(game)
+        game, message, names = self.service.make_move(game_id, position=1)
+        # the only reply of perfect play to a corner is the center
+        self.assertEqual(game.board_position, 'X,-,-,-,O,-,-,-,-')
+
+
+class GameStateTest(ServiceTestCase):
+
+    def test_not_modified(self):
+        game_id = self.new_game()
+        with self.assertRaises(service.NotModifiedError):
+            self.service.game_state(game_id, version=0)
+        self.service.make_move(game_id, position=5)
+        game, names = self.service.game_state(game_id, version=0)
+        self.assertEqual(game.version, 1)
+        self.assertEqual(sorted(names.values()), ['alice', 'bob'])
+
+    def test_cancel_game(self):
+        game_id = self.new_game()
+        self.service.cancel_game(game_id)
+        with self.assertRaises(service.NotFoundError):
+            self.service.game_state(game_id)
+
+    def test_existing_user(self):
+        with self.assertRaises(service.ConflictError):
+            self.service.create_user('alice', None)
+
+    def test_reserved_computer_name(self):
+        with self.assertRaises(service.ConflictError):
+            self.service.create_user(storage.COMPUTER_NAME, None)
+
+
+class PagingTest(ServiceTestCase):
+
+    def pages(self, function, *args):
+        """Returns all the pages of function, following the cursors"""
+        pages = []
+        cursor = None
+        while True:
+            page, cursor = function(*args, cursor=cursor)
+            pages.append(page)
+            if not cursor:
+                return pages
+
+    def test_user_games(self):
+        game_ids = [self.new_game() for _ in xrange(7)]
+        for game_id in game_ids[::2]:
+            self.service.make_move(game_id, position=5)
+        for active in (False, True):
+            pages = self.pages(
+                lambda cursor: self.service.user_games(
+                    'alice', 3, cursor, active)[::2])
+            self.assertEqual([len(page) for page in pages], [3, 3, 1])
+            games = [game for page in pages for game in page]
+            self.assertEqual(len(set(game.key for game in games)), 7)
+            last_moves = [(game.last_move, -game.key) for game in games]
+            self.assertEqual(last_moves, sorted(last_moves, reverse=True))
+        # the games played on last come first
+        self.assertEqual([self.repository.game_id(game) for game in games[:4]],
+                         game_ids[::-2])
+
+    def test_active_user_games(self):
+        game_ids = [self.new_game() for _ in xrange(4)]
+        for position in (1, 4, 2, 5, 3):
+            self.service.make_move(game_ids[1], position=position)
+        games, names, cursor = self.service.user_games('bob', 2, None,
+                                                       active=True)
+        games += self.service.user_games('bob', 2, cursor, active=True)[0]
+        self.assertEqual(sorted(self.repository.game_id(game)
+                                for game in games),
+                         sorted(game_ids[:1] + game_ids[2:]))
+
+    def test_scores(self):
+        users = self.repository.import_users(['carol', 'dave'])
+        today = date.today()
+        self.repository.import_scores([sqlite_storage.Score(
+            key=None, user=users[number % 2], opponent=users[1 - number % 2],
+            date=today - timedelta(days=number // 3), time=None, won=True,
+            lost=False)
+            for number in xrange(10)])
+        pages = self.pages(self.repository.scores, 4)
+        self.assertEqual([len(page) for page in pages], [4, 4, 2])
+        # the most recent first, then in key order
+        keys = [(-score.date.toordinal(), score.key)
+                for page in pages for score in page]
+        self.assertEqual(len(set(keys)), 10)
+        self.assertEqual(keys, sorted(keys))
+
+    def test_database_before_game_players(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'tris.db')
+        repository = sqlite_storage.SqliteRepository(path)
+        game_service = service.GameService(repository, pubsub.LocalBroker())
+        game_service.create_user('alice', None)
+        game_service.create_user('bob', None)
+        for _ in xrange(3):
+            game_service.new_game('alice', 'bob')
+        with repository._connection() as connection:
+            connection.execute('DELETE FROM game_players')
+        # the table is filled again when the database is opened
+        repository = sqlite_storage.SqliteRepository(path)
+        user = repository.get_user('bob')
+        self.assertEqual(len(repository.user_games(user.key, 5, None)[0]), 3)
+
+    def test_invalid_cursor(self):
+        user = self.repository.get_user('alice')
+        for function in (self.repository.scores,
+                         lambda size, cursor: self.repository.user_games(
+                             user.key, size, cursor)):
+            with self.assertRaises(storage.InvalidRequestError):
+                function(2, 'not a cursor')
+
+
+class LeaderboardTest(ServiceTestCase):
+
+    def import_scores(self, user, day, results):
+        """Imports a score of user on day for each result, True for a win"""
+        self.repository.import_scores([sqlite_storage.Score(
+            key=None, user=user, opponent=None, date=day, time=None, won=won,
+            lost=not won)
+            for won in results])
+
+    def test_game_end(self):
+        game_id = self.new_game()
+        for position in (1, 4, 2, 5, 3):
+            self.service.make_move(game_id, position=position)
+        for period in (None,) + storage.PERIODS:
+            self.assertEqual(
+                [ranking[:3] for ranking in
+                 self.service.leaderboard(10, period)],
+                [('alice', 1, 1.0), ('bob', 2, -1.0)])
+        self.assertEqual(self.service.leaderboard(
+            10, storage.DAY, date.today() - timedelta(days=1)), [])
+        # the all time leaderboard ranks by rating
+        self.assertEqual([ranking.rating for ranking in
+                          self.service.leaderboard(10)], [1516, 1484])
+        self.assertEqual(self.service.user_ranking('bob').rank, 2)
+
+    def test_computer_games(self):
+        game, names = self.service.new_game('alice', None, difficulty='hard')
+        game_id = self.repository.game_id(game)
+        while not game.game_over:
+            cell = game.board_position.split(',').index('-')
+            game, message, names = self.service.make_move(
+                game_id, position=cell + 1)
+        # the game counts for alice only and moves no rating
+        self.assertEqual([ranking.user_name for ranking in
+                          self.service.leaderboard(10)], ['alice'])
+        stats = self.repository.user_stats(
+            self.repository.get_user('alice').key)
+        self.assertEqual((stats.games, stats.rating), (1, 1500))
+
+    def test_periods(self):
+        carol, dave = self.repository.import_users(['carol', 'dave'])
+        today = date.today()
+        last_month = today - timedelta(days=40)
+        self.import_scores(carol, last_month, [True, True])
+        self.import_scores(dave, last_month, [False])
+        self.import_scores(dave, today, [True])
+        # merged with the rows already imported
+        self.import_scores(carol, today, [False])
+        self.import_scores(carol, today, [False, True])
+        self.assertEqual(
+            [ranking[:3] for ranking in
+             self.service.leaderboard(10, storage.DAY)],
+            [('dave', 1, 1.0), ('carol', 2, -1 / 3.0)])
+        self.assertEqual(
+            [ranking[:3] for ranking in
+             self.service.leaderboard(10, storage.DAY, last_month)],
+            [('carol', 1, 1.0), ('dave', 2, -1.0)])
+        self.assertEqual(
+            [ranking[:3] for ranking in self.service.leaderboard(10)],
+            [('carol', 1, 0.2), ('dave', 2, 0.0)])
+        with self.assertRaises(service.BadRequestError):
+            self.service.leaderboard(10, 'year')
+
+    def test_compaction(self):
+        carol, = self.repository.import_users(['carol'])
+        today = date.today()
+        last_month = today - timedelta(days=40)
+        self.import_scores(carol, last_month, [True])
+        self.repository.compact_period_stats(today)
+        self.assertEqual(self.service.leaderboard(10, storage.DAY,
+                                                  last_month), [])
+        self.assertEqual(len(self.service.leaderboard(10, storage.MONTH,
+                                                      last_month)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""test_solver.py - Unit tests of the perfect play computer opponent. Run
+with python -m unittest test_solver"""
+
+import random
+import unittest
+
+import board
+import solver
+
+
+def play_out(x, o, rng):
+    """Plays perfect moves for both players until the game is over and
+    returns its outcome"""
+    while not board.outcome(x, o):
+        cell = 1 << solver.choose_move(x, o, 'hard', rng)
+        if board.state(x, o) & board.O_TO_MOVE:
+            o |= cell
+        else:
+            x |= cell
+    return board.outcome(x, o)
+
+
+class SolverTest(unittest.TestCase):
+
+    def test_empty_board_is_a_draw(self):
+        self.assertEqual(solver.negamax(0, 0), 0)
+
+    def test_perfect_play_draws(self):
+        rng = random.Random(0)
+        for game in xrange(50):
+            self.assertEqual(play_out(0, 0, rng), board.DRAW)
+
+    def test_perfect_play_draws_after_every_opening(self):
+        rng = random.Random(1)
+        for cell in xrange(board.CELLS):
+            self.assertEqual(play_out(1 << cell, 0, rng), board.DRAW)
+
+    def test_perfect_reply_beats_every_mistake(self):
+        # 'X' in the corner and 'O' on an edge next to it loses
+        x, o = board.decode('X,O,-,-,-,-,-,-,-')
+        self.assertTrue(solver.negamax(x, o) > 0)
+        self.assertEqual(play_out(x, o, random.Random(2)), board.X_WON)
+
+    def test_takes_the_win(self):
+        x, o = board.decode('X,X,-,O,O,-,-,-,-')
+        self.assertEqual(solver.best_moves(x, o), [2])
+
+    def test_blocks_the_win(self):
+        x, o = board.decode('X,X,-,O,-,-,-,-,-')
+        self.assertEqual(solver.best_moves(x, o), [2])
+
+    def test_symmetric_positions_share_a_key(self):
+        corners = [board.decode(position) for position in
+                   ('X,-,-,-,-,-,-,-,-', '-,-,X,-,-,-,-,-,-',
+                    '-,-,-,-,-,-,X,-,-', '-,-,-,-,-,-,-,-,X')]
+        self.assertEqual(len(set(solver.canonical(x, o)
+                                 for x, o in corners)), 1)
+
+    def test_unique_positions(self):
+        legal = [(index >> board.CELLS, index & board.FULL_MASK)
+                 for index, flags in enumerate(board.STATES) if flags]
+        self.assertEqual(len(set(solver.canonical(x, o) for x, o in legal)),
+                         765)
+
+    def test_choose_move(self):
+        x, o = board.decode('X,O,X,-,O,-,-,-,-')
+        rng = random.Random(3)
+        for difficulty in solver.DIFFICULTY_LEVELS:
+            self.assertIn(solver.choose_move(x, o, difficulty, rng),
+                          solver.free_cells(x, o))
+        with self.assertRaises(ValueError):
+            solver.choose_move(x, o, 'impossible', rng)
+        with self.assertRaises(ValueError):
+            solver.choose_move(*board.decode('X,X,X,O,O,-,-,-,-'),
+                               difficulty='hard', rng=rng)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""test_storage.py - Unit tests of the helpers shared by the repositories.
+Run with python -m unittest test_storage"""
+
+import random
+import unittest
+from datetime import date, timedelta
+
+import storage
+
+
+class PeriodBucketTest(unittest.TestCase):
+
+    def test_buckets(self):
+        day = date(2016, 3, 21)
+        self.assertEqual([storage.period_bucket(period, day)
+                          for period in storage.PERIODS],
+                         ['2016-03-21', '2016-W12', '2016-03'])
+
+    def test_iso_weeks(self):
+        # the first days of 2016 are in the last week of 2015
+        self.assertEqual(storage.period_bucket(storage.WEEK, date(2016, 1, 3)),
+                         '2015-W53')
+        self.assertEqual(storage.period_bucket(storage.WEEK, date(2016, 1, 4)),
+                         '2016-W01')
+
+    def test_time_order(self):
+        days = [date(2015, 12, 1) + timedelta(days=number)
+                for number in xrange(100)]
+        for period in storage.PERIODS:
+            buckets = [storage.period_bucket(period, day) for day in days]
+            self.assertEqual(buckets, sorted(buckets))
+
+    def test_unknown_period(self):
+        with self.assertRaises(ValueError):
+            storage.period_bucket('year', date(2016, 3, 21))
+
+    def test_oldest_kept_bucket(self):
+        today = date(2016, 3, 21)
+        self.assertEqual(storage.oldest_kept_bucket(storage.DAY, today),
+                         '2016-02-15')
+        self.assertEqual(storage.oldest_kept_bucket(storage.WEEK, today),
+                         '2015-W39')
+        self.assertEqual(storage.oldest_kept_bucket(storage.MONTH, today),
+                         '2014-03')
+        # the same bucket all the week
+        self.assertEqual(set(storage.oldest_kept_bucket(
+            storage.WEEK, today + timedelta(days=number))
+            for number in xrange(7)), {'2015-W39'})
+
+
+class RatingTreeTest(unittest.TestCase):
+
+    def test_prefix_counts(self):
+        rng = random.Random(0)
+        buckets = [rng.randrange(storage.RATING_BUCKETS)
+                   for _ in xrange(200)]
+        tree = [0] * (storage.RATING_BUCKETS + 1)
+        for bucket in buckets:
+            for node in storage.rating_index_nodes(bucket):
+                tree[node] += 1
+        for bucket in [0, storage.RATING_BUCKETS - 1] + buckets[:20]:
+            self.assertEqual(
+                sum(tree[node]
+                    for node in storage.rating_prefix_nodes(bucket)),
+                sum(1 for other in buckets if other <= bucket))
+
+
+if __name__ == '__main__':
+    unittest.main()
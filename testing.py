@@ -0,0 +1,31 @@
+"""testing.py - Base test case of the tests running on the App Engine
+service stubs of the testbed. Needs the App Engine SDK on the path, see
+runner.py."""
+
+import os
+import unittest
+
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+# api.py builds the endpoints server at import, which reads the version of
+# the app
+os.environ.setdefault('CURRENT_VERSION_ID', 'testing.1')
+
+
+class TestbedTestCase(unittest.TestCase):
+    """Activates a testbed with a strongly consistent high replication
+    datastore and memcache for each test"""
+
+    def setUp(self):
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy)
+        self.testbed.init_memcache_stub()
+        ndb.get_context().clear_cache()
+
+    def tearDown(self):
+        self.testbed.deactivate()